@@ -1,24 +1,139 @@
-import csv                                                          # type: ignore
-import openpyxl                                                     # type: ignore
+import argparse                                                     # type: ignore
 import requests                                                     # type: ignore
 import threading
+import time                                                         # type: ignore
+from contextlib import nullcontext                                  # type: ignore
 from datetime import datetime                                       # type: ignore
 from urllib.parse import quote                                      # type: ignore
-from concurrent.futures import ThreadPoolExecutor, as_completed     # type: ignore
+from concurrent.futures import ThreadPoolExecutor                   # type: ignore
 from requests.utils import dict_from_cookiejar
+import asyncEngine
+import lookupReader
+import workQueue
+import concurrencyControl
+import retryPolicy
+import httpTransport
+import mappingIndex
+import checkpointJournal
+import formTemplates
+import requestMetrics
+import rateLimit
+import serverPool
+import authBreaker
+import sessionCache
+import preflight
+import resultSink
+import sharding
+
+# Lookup columns read by preflight_rows; all other columns are skipped while streaming.
+LOOKUP_COLUMNS = ["pri_ref", "OTM_COST", "transport_id", "transport_order_id"]
+
+# Retry policy per endpoint. The first POST only opens the pricesheet form and
+# can be repeated; the second POST creates the pricesheet, so it is only retried
+# when the request never reached the server.
+RETRY_POLICIES = {
+    "/MercuryGate/pricesheets/editPriceSheet.jsp": retryPolicy.IDEMPOTENT,
+    "/MercuryGate/pricesheets/editPriceSheet_process.jsp": retryPolicy.NOT_IDEMPOTENT,
+}
+
+# Form bodies of the two POST requests, url-encoded once at import time. Only the
+# fields marked VARIABLE are encoded per row (see formTemplates).
+
+# First POST request (editPriceSheet.jsp)
+OPEN_PRICESHEET_FORM = formTemplates.FormTemplate({
+    "sRouteOid": "",
+    "sLegNum": "",
+    "sSheetType": "Cost",
+    "sidCarrier": "(4533774089,3840,0)",
+    "sidShipment": "",
+    "sidTransportOrder": formTemplates.VARIABLE,
+    "mblOrderOids": "",
+    "shipmentOids": "",
+    "redirectURL": f"/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
+    "SelectedObjs": formTemplates.VARIABLE,
+    "listOwnerOids": formTemplates.VARIABLE,
+    "sReturnURL": f"/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
+    "bGLWaiver": "false",
+    "ListCacheKey": ""
+})
+
+# Second POST request (editPriceSheet_process.jsp)
+SAVE_PRICESHEET_FORM = formTemplates.FormTemplate({
+    "sSheetType": "Cost",
+    "listOwnerOids": formTemplates.VARIABLE,
+    "sReturnURL": f"/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
+    "sPostProcessURL": "",
+    "oidPriceSheet": "",
+    "bGLWaiver": "false",
+    "isVendor": "false",
+    "sidCarrier": "(4533774089,3840,0)",
+    "sCarrierMode": "TL",
+    "sCarrierService": "Standard",
+    "fCarrierServiceDays": "",
+    "oidContract": "",
+    "sCurrencyCode": "EUR",
+    "oidCarrierLocation": "-1",
+    "CostChargeModel": "NORMALIZED_MANUAL",
+    "CostCharge1Type": "ITEM",
+    "CostCharge1Desc": "Total Line Haul",
+    "CostCharge1EDICode": "",
+    "CostCharge1Rate": formTemplates.VARIABLE,
+    "CostCharge1RQ": "FR",
+    "CostCharge2Type": "DISCOUNT",
+    "CostCharge2Desc": "Discount",
+    "CostCharge2EDICode": "DSC",
+    "CostCharge2Rate": "",
+    "CostCharge2RQ": "FR",
+    "CostCharge3Type": "ACCESSORIAL_FUEL",
+    "CostCharge3Desc": "Fuel Surcharge",
+    "CostCharge3EDICode": "FUE",
+    "CostCharge3Rate": "",
+    "CostCharge3RQ": "FR",
+    "CostCharge4Type": "ACCESSORIAL",
+    "CostCharge4Desc": "",
+    "CostCharge4EDICode": "LFA",
+    "CostCharge4Rate": "",
+    "CostCharge4RQ": "FR",
+    "CostCharge5Type": "ACCESSORIAL",
+    "CostCharge5Desc": "",
+    "CostCharge5EDICode": "LFA",
+    "CostCharge5Rate": "",
+    "CostCharge5RQ": "FR",
+    "CostCharge6Type": "ACCESSORIAL",
+    "CostCharge6Desc": "",
+    "CostCharge6EDICode": "LFA",
+    "CostCharge6Rate": "",
+    "CostCharge6RQ": "FR",
+    "CostCharge7Type": "ACCESSORIAL_PERCENTAGE_TOTAL",
+    "CostCharge7Desc": "",
+    "CostCharge7EDICode": "TAX:PST",
+    "CostCharge7Rate": "",
+    "CostCharge7RQ": "PCT",
+    "CostNumCharges": "7",
+    "sCommentsPS": "",
+    "fDistance": "",
+    "dateDate1": "",
+    "dateTime1": "",
+    "dateDate2": "",
+    "dateTime2": ""
+})
 
 # Thread-local storage for sessions
 thread_local = threading.local()
 
-def get_session(global_headers, global_cookies):
+def get_session(global_headers, global_cookies, setup=None):
     """
     Each worker gets its own session, but this session is initialized using the
     globally primed headers and cookies (so priming happens only once).
+    setup, if given, is called once with every new session (e.g. to share the
+    primed connection pool and attach the adaptive concurrency controller).
     """
     if not hasattr(thread_local, 'session'):
         session = requests.Session()
         session.headers.update(global_headers)
         session.cookies.update(global_cookies)
+        if setup:
+            setup(session)
         thread_local.session = session
     return thread_local.session
 
@@ -30,175 +145,217 @@ def load_config(config_sheet):
             config[row[0].strip()] = str(row[1]).strip()
     return config
 
-def load_mapping(csv_filename):
-    mapping = {}
+def load_mapping(csv_filename, suffix):
+    """
+    Open the indexed transport_id -> transport_order_id mapping for the CSV.
+    The CSV is only parsed when its index is missing or out of date; values
+    come back already formatted with the suffix.
+    Raises RuntimeError when it cannot be read: going on without it would
+    post other ids than a run (or shard) that has it.
+    """
     try:
-        with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                tid = row.get("transport_id")
-                toid = row.get("transport_order_id")
-                if tid and toid:
-                    mapping[tid.strip()] = toid.strip()
-        print(f"Loaded mapping for {len(mapping)} transport IDs from {csv_filename}.")
+        return mappingIndex.load_mapping_index(csv_filename, suffix)
     except Exception as e:
-        print(f"Error reading mapping CSV file: {e}")
-    return mapping
+        raise RuntimeError(f"Error reading mapping CSV file {csv_filename}: {e}") from e
 
-def format_transport_order_id(mapping_value, suffix):
+def prepare_mapping(excel_path, csv_mapping_path):
+    """
+    Build or check the mapping index once before shard processes start, so
+    they do not all rebuild it at the same time.
     """
-    If mapping value doesn't contain a comma, assume it is the base value and append the suffix.
+    wb = lookupReader.open_workbook_readonly(excel_path)
+    try:
+        config = load_config(wb["config"])
+    finally:
+        wb.close()
+    load_mapping(csv_mapping_path, config["TRANSPORT_ORDER_SUFFIX"])
+
+def row_key(row_data):
+    """
+    Identity of a lookup row in the checkpoint journal. The cost is not part
+    of it: a pricesheet created once must not be created again for a new
+    cost, so the cost is journaled as the entry's value instead.
+    """
+    return f"{str(row_data.get('pri_ref', '')).strip()}|{str(row_data.get('transport_id', '')).strip()}"
+
+def shard_key(row_data):
     """
-    if "," not in mapping_value:
-        formatted = f"({mapping_value}{suffix})"
-    else:
-        if not mapping_value.startswith("("):
-            formatted = f"({mapping_value})"
+    Stable identity a row is sharded by (see sharding.in_shard). Kept apart
+    from row_key so a change to the journal key never moves rows between
+    shards: the same pricesheet must always be created by the same shard.
+    """
+    return f"{str(row_data.get('pri_ref', '')).strip()}|{str(row_data.get('transport_id', '')).strip()}"
+
+def preflight_rows(sheet, config, mapping):
+    """
+    Validate the whole lookup sheet before any request is sent; all
+    transport_ids are resolved in batched mapping lookups. Returns
+    (row_numbers, columns, clean, rejects) where clean holds the indexes of
+    the clean rows (build them with preflight.rows_at; their
+    transport_order_id is already formatted, so no mapping is needed later)
+    and rejects are (row_number, reason, row).
+    """
+    row_numbers, columns = preflight.read_columns(sheet, LOOKUP_COLUMNS, "pri_ref")
+    costs = columns["OTM_COST"]
+    transport_ids = columns["transport_id"]
+    order_ids = columns["transport_order_id"]
+    mapped = preflight.lookup_many(mapping, transport_ids) if mapping else {}
+    suffix = config["TRANSPORT_ORDER_SUFFIX"]
+    
+    clean, rejects = [], []
+    for i, row_number in enumerate(row_numbers):
+        transport_id = transport_ids[i]
+        error = None
+        if not costs[i]:
+            error = "Missing OTM_COST"
+        elif transport_id and mapping:
+            if transport_id in mapped:
+                order_ids[i] = mapped[transport_id]
+            else:
+                error = f"Mapping not found for transport_id {transport_id}"
+        elif order_ids[i]:
+            order_ids[i] = mappingIndex.format_transport_order_id(order_ids[i], suffix)
+        else:
+            error = "Missing transport_order_id"
+        if error:
+            rejects.append((row_number, error, {column: values[i] for column, values in columns.items()}))
         else:
-            formatted = mapping_value
-    return formatted
+            clean.append(i)
+    return row_numbers, columns, clean, rejects
+
+def prime_session(session, base_url, connections=1, session_cache=None):
+    """
+    Perform a GET request to the process URL to initialize (prime) the session,
+    then open `connections` pooled connections in parallel.
+    """
+    url = f"{base_url}/MercuryGate/pricesheets/editPriceSheet_process.jsp"
+    # Skipped while an earlier run primed this server recently (session_cache).
+    if session_cache is None or not session_cache.primed(base_url):
+        try:
+            resp = session.get(url, timeout=10)
+            print("Priming GET status:", resp.status_code)
+            if session_cache is not None and resp.status_code == 200:
+                session_cache.store(base_url)
+        except Exception as e:
+            print("Error during priming GET:", e)
+    # Open the rest of the pool's connections now so the workers start warm.
+    if connections > 1:
+        httpTransport.prewarm(session, url, connections)
+
+def build_steps(transport_order_id, owner_oids, new_cost, base_url):
+    """
+    The two POST requests creating one cost pricesheet for the owners in
+    owner_oids (transport ids). With several owners the form is submitted like
+    a multi-selection from a list: all owners in listOwnerOids, every index
+    selected in SelectedObjs and no single sidTransportOrder.
+    """
+    owners = ",".join(owner_oids)
+    selected = "".join(f"{i}," for i in range(len(owner_oids)))
+    if len(owner_oids) > 1:
+        transport_order_id = ""
+    
+    # -------------------------------
+    # First POST request (editPriceSheet.jsp)
+    # -------------------------------
+    post_payload_1 = OPEN_PRICESHEET_FORM.render(sidTransportOrder=transport_order_id, SelectedObjs=selected, listOwnerOids=owners)
+    post_url_1 = f"{base_url}/MercuryGate/pricesheets/editPriceSheet.jsp"
+    
+    # -------------------------------
+    # Second POST request (editPriceSheet_process.jsp)
+    # -------------------------------
+    post_payload_2 = SAVE_PRICESHEET_FORM.render(listOwnerOids=owners, CostCharge1Rate=new_cost)
+    post_url_2 = f"{base_url}/MercuryGate/pricesheets/editPriceSheet_process.jsp"
+    return [
+        ("First POST", post_url_1, post_payload_1),
+        ("Second POST", post_url_2, post_payload_2),
+    ]
+
+def batch_rows(rows, batch_size):
+    """
+    Group clean rows whose pricesheets are identical into batches of up to
+    batch_size rows. Carrier, currency and charge layout are fixed in the
+    forms, so rows with the same OTM_COST share a pricesheet. Batches are
+    yielded in the order of their first row; batch_size 1 yields every row
+    on its own.
+    """
+    if batch_size <= 1:
+        for row in rows:
+            yield [row]
+        return
+    open_batches = {}
+    for row in rows:
+        cost = row["OTM_COST"]
+        batch = open_batches.setdefault(cost, [])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield open_batches.pop(cost)
+    yield from open_batches.values()
+
+def prepare_batch(rows, base_url):
+    """
+    Build the two POST requests for a batch of preflighted rows sharing one
+    cost (see batch_rows). Returns (rows, so_numbers, steps, server), the
+    state a batch carries through the pipeline stages of either backend;
+    server is the app server that opened the form (None until then).
+    """
+    so_numbers = [str(row.get("pri_ref", "")).strip() for row in rows]
+    owners = [row["transport_id"] for row in rows]
+    return rows, so_numbers, build_steps(rows[0]["transport_order_id"], owners, rows[0]["OTM_COST"], base_url), None
+
+def fan_out(rows, so_numbers, error):
+    """One (row, result) per row of a batch; the batch outcome applies to every row."""
+    if error:
+        suffix = f" (batch of {len(rows)})" if len(rows) > 1 else ""
+        return [(row, f"SO {so} Error: {error}{suffix}") for row, so in zip(rows, so_numbers)]
+    return [(row, f"SO {so} OK") for row, so in zip(rows, so_numbers)]
 
-def prime_session(session, primary_server):
+def run_step(state, step, global_headers, global_cookies, session_setup=None, servers=None):
     """
-    Perform a GET request to the process URL to initialize (prime) the session.
+    Pipeline stage for the threaded backend: send request number `step` of a
+    prepared batch. Returns (done, value) as workQueue.staged_map expects:
+    after a failure or the last request value is the batch's per-row results,
+    otherwise the state is handed to the next stage. With a server pool, all
+    requests of a batch go to the server that opened its form.
     """
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet_process.jsp"
+    rows, so_numbers, steps, server = state
+    label, url, payload = steps[step]
     try:
-        resp = session.get(url, timeout=10)
-        print("Priming GET status:", resp.status_code)
+        # Get the thread-local session initialized with the primed global state.
+        session = get_session(global_headers, global_cookies, session_setup)
+        with servers.pinned(server) if servers else nullcontext():
+            resp = session.post(url, data=payload, timeout=10)
+        if resp.status_code != 200:
+            return True, fan_out(rows, so_numbers, f"{label} failed with {resp.status_code} {resp.text[:100]}")
     except Exception as e:
-        print("Error during priming GET:", e)
+        return True, fan_out(rows, so_numbers, str(e))
+    if step == len(steps) - 1:
+        return True, fan_out(rows, so_numbers, None)
+    return False, (rows, so_numbers, steps, server or (servers.server_of(resp.url) if servers else None))
 
-def process_row(row_data, config, mapping, global_headers, global_cookies, primary_server):
+async def process_batch_async(batch, client, gates, base_url):
     """
-    Process a single row of the Excel lookup data.
-    It performs two POST requests sequentially:
-      1. A POST to editPriceSheet.jsp
-      2. A POST to editPriceSheet_process.jsp
-    Returns a string with the format:
-      "SO {pri_ref} OK" or "SO {pri_ref} Error: <error message>"
+    Coroutine version of the pipeline for the asyncio backend: each request
+    waits for a slot of its stage's asyncEngine.StageGate.
+    client is the shared asyncEngine.AsyncClient.
     """
+    rows, so_numbers, steps, server = prepare_batch(batch, base_url)
+    servers = client.servers
     try:
-        # Get the thread-local session initialized with the primed global state.
-        session = get_session(global_headers, global_cookies)
-        
-        so_number = str(row_data.get("pri_ref", "")).strip()
-        otm_cost = row_data.get("OTM_COST")
-        if otm_cost is None or str(otm_cost).strip() == "":
-            return f"SO {so_number} Error: Missing OTM_COST"
-        new_cost = str(otm_cost).strip()
-        
-        # Read the transport_id and transport_order_id from Excel.
-        transport_id = str(row_data.get("transport_id", "")).strip()
-        if transport_id and mapping:
-            base_mapping = mapping.get(transport_id)
-            if not base_mapping:
-                return f"SO {so_number} Error: Mapping not found for transport_id {transport_id}"
-            transport_order_id = format_transport_order_id(base_mapping, config["TRANSPORT_ORDER_SUFFIX"])
-        else:
-            transport_order_id = str(row_data.get("transport_order_id", "")).strip()
-            if transport_order_id and "," not in transport_order_id:
-                transport_order_id = f"({transport_order_id}{config['TRANSPORT_ORDER_SUFFIX']})"
-            elif transport_order_id and not transport_order_id.startswith("("):
-                transport_order_id = f"({transport_order_id})"
-        
-        # -------------------------------
-        # First POST request (editPriceSheet.jsp)
-        # -------------------------------
-        post_payload_1 = {
-            "sRouteOid": "",
-            "sLegNum": "",
-            "sSheetType": "Cost",
-            "sidCarrier": "(4533774089,3840,0)",
-            "sidShipment": "",
-            "sidTransportOrder": transport_order_id,
-            "mblOrderOids": "",
-            "shipmentOids": "",
-            "redirectURL": f"/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
-            "SelectedObjs": "0,",
-            "listOwnerOids": transport_id,
-            "sReturnURL": f"/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
-            "bGLWaiver": "false",
-            "ListCacheKey": ""
-        }
-        post_url_1 = f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet.jsp"
-        resp1 = session.post(post_url_1, data=post_payload_1, timeout=10)
-        if resp1.status_code != 200:
-            return f"SO {so_number} Error: First POST failed with {resp1.status_code} {resp1.text[:100]}"
-        
-        # -------------------------------
-        # Second POST request (editPriceSheet_process.jsp)
-        # -------------------------------
-        post_payload_2 = {
-            "sSheetType": "Cost",
-            "listOwnerOids": transport_id,
-            "sReturnURL": f"/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
-            "sPostProcessURL": "",
-            "oidPriceSheet": "",
-            "bGLWaiver": "false",
-            "isVendor": "false",
-            "sidCarrier": "(4533774089,3840,0)",
-            "sCarrierMode": "TL",
-            "sCarrierService": "Standard",
-            "fCarrierServiceDays": "",
-            "oidContract": "",
-            "sCurrencyCode": "EUR",
-            "oidCarrierLocation": "-1",
-            "CostChargeModel": "NORMALIZED_MANUAL",
-            "CostCharge1Type": "ITEM",
-            "CostCharge1Desc": "Total Line Haul",
-            "CostCharge1EDICode": "",
-            "CostCharge1Rate": new_cost,
-            "CostCharge1RQ": "FR",
-            "CostCharge2Type": "DISCOUNT",
-            "CostCharge2Desc": "Discount",
-            "CostCharge2EDICode": "DSC",
-            "CostCharge2Rate": "",
-            "CostCharge2RQ": "FR",
-            "CostCharge3Type": "ACCESSORIAL_FUEL",
-            "CostCharge3Desc": "Fuel Surcharge",
-            "CostCharge3EDICode": "FUE",
-            "CostCharge3Rate": "",
-            "CostCharge3RQ": "FR",
-            "CostCharge4Type": "ACCESSORIAL",
-            "CostCharge4Desc": "",
-            "CostCharge4EDICode": "LFA",
-            "CostCharge4Rate": "",
-            "CostCharge4RQ": "FR",
-            "CostCharge5Type": "ACCESSORIAL",
-            "CostCharge5Desc": "",
-            "CostCharge5EDICode": "LFA",
-            "CostCharge5Rate": "",
-            "CostCharge5RQ": "FR",
-            "CostCharge6Type": "ACCESSORIAL",
-            "CostCharge6Desc": "",
-            "CostCharge6EDICode": "LFA",
-            "CostCharge6Rate": "",
-            "CostCharge6RQ": "FR",
-            "CostCharge7Type": "ACCESSORIAL_PERCENTAGE_TOTAL",
-            "CostCharge7Desc": "",
-            "CostCharge7EDICode": "TAX:PST",
-            "CostCharge7Rate": "",
-            "CostCharge7RQ": "PCT",
-            "CostNumCharges": "7",
-            "sCommentsPS": "",
-            "fDistance": "",
-            "dateDate1": "",
-            "dateTime1": "",
-            "dateDate2": "",
-            "dateTime2": ""
-        }
-        post_url_2 = f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet_process.jsp"
-        resp2 = session.post(post_url_2, data=post_payload_2, timeout=10)
-        if resp2.status_code == 200:
-            return f"SO {so_number} OK"
-        else:
-            return f"SO {so_number} Error: Second POST failed with {resp2.status_code} {resp2.text[:100]}"
+        for (label, url, payload), gate in zip(steps, gates):
+            with servers.pinned(server) if servers else nullcontext():
+                resp = await gate.run(client.post(url, data=payload, timeout=10))
+            if resp.status_code != 200:
+                return fan_out(rows, so_numbers, f"{label} failed with {resp.status_code} {resp.text[:100]}")
+            if servers and server is None:
+                server = servers.server_of(resp.url)
+        return fan_out(rows, so_numbers, None)
     except Exception as e:
-        return f"SO {so_number} Error: {str(e)}"
+        return fan_out(rows, so_numbers, str(e))
 
-def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10):
-    wb = openpyxl.load_workbook(excel_path)
+def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10, useAsync=False, maxInFlight=200, adaptive=False, journalPath=None, resume=False, metricsPath=None, prometheusPath=None,
+                                   validateOnly=False, rejectsPath=None, batchSize=1,
+                                   openWorkers=None, saveWorkers=None, resultsPath=None, shard=None):
+    wb = lookupReader.open_workbook_readonly(excel_path)
     config_sheet = wb["config"]
     config = load_config(config_sheet)
     
@@ -216,32 +373,83 @@ def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10):
             raise ValueError(f"Missing required config variable: {var}")
     
     primary_server = config["PRIMARY_SERVER"]
+    # BASE_URL (optional) points the script at another host, e.g. the local mock server.
+    base_url = config.get("BASE_URL", f"https://{primary_server}.mercurygate.net").rstrip("/")
     auth_cookie = config["AUTH_COOKIE"]
     
     mapping = {}
     if csv_mapping_path:
-        mapping = load_mapping(csv_mapping_path)
+        mapping = load_mapping(csv_mapping_path, config["TRANSPORT_ORDER_SUFFIX"])
+    
+    # Validate the whole sheet before any network traffic. Rejected rows go to
+    # the rejects report; only clean rows reach the workers, built one at a
+    # time from the sheet's columns as they are sent.
+    start = time.monotonic()
+    row_numbers, columns, clean, rejects = preflight_rows(wb["lookup"], config, mapping)
+    wb.close()
+    rejectsPath = rejectsPath or excel_path.replace(".xlsx", "_rejects.csv")
+    if shard:
+        # Shard mode: keep only this shard's rows (by a stable hash of
+        # pri_ref|transport_id, so no row is created by two shards). Each shard
+        # writes its own journal, rejects, results and metrics files.
+        clean = [i for i, row in zip(clean, preflight.rows_at(row_numbers, columns, clean))
+                 if sharding.in_shard(shard_key(row), shard)]
+        rejects = [reject for reject in rejects if sharding.in_shard(shard_key(reject[2]), shard)]
+        journalPath, rejectsPath, resultsPath, metricsPath, prometheusPath = (
+            sharding.shard_path(p, shard) for p in (journalPath, rejectsPath, resultsPath, metricsPath, prometheusPath))
+        print(f"Shard {shard[0]}/{shard[1]}: {len(clean)} clean rows, {len(rejects)} rejected.")
+    preflight.write_rejects(rejectsPath, rejects, LOOKUP_COLUMNS)
+    preflight.report(len(clean) + len(rejects), clean, rejects, rejectsPath)
+    print(f"Preflight took {time.monotonic() - start:.1f}s.")
+    if validateOnly:
+        return
     
-    lookup_sheet = wb["lookup"]
-    header_row = [cell.value for cell in lookup_sheet[1]]
-    rows = []
-    for row in lookup_sheet.iter_rows(min_row=2, values_only=True):
-        row_dict = dict(zip(header_row, row))
-        if not row_dict.get("pri_ref"):
-            break
-        rows.append(row_dict)
+    # When resuming, rows already completed according to the journal are skipped.
+    # Rows whose cost changed since they were created are reported, not created again.
+    created_costs = {}
+    completed = checkpointJournal.load_completed(journalPath, created_costs) if resume else {}
+    rows = (row for row in preflight.rows_at(row_numbers, columns, clean) if row_key(row) not in completed)
+    changed = {row_key(row): created_costs[row_key(row)] for row in preflight.rows_at(row_numbers, columns, clean)
+               if created_costs.get(row_key(row), row["OTM_COST"]) != row["OTM_COST"]}
+    if changed:
+        print(f"{len(changed)} rows were already created with another cost and are not created again; "
+              f"update them with editPricesheet (e.g. {', '.join(list(changed)[:5])}).")
+    mapping = None  # clean rows already carry their formatted transport_order_id
+    
+    # With batchSize > 1, rows with the same cost are created together: one
+    # two-step submission per batch, its result fanned out to every row.
+    # Batches are formed as the workers take them.
+    batches = batch_rows(rows, batchSize)
+    
+    retry_policies = retryPolicy.for_server(base_url, RETRY_POLICIES)
+    
+    # Every HTTP call is timed per phase (DNS/connect/TLS/wait/transfer) and
+    # summarized per endpoint at the end of the run.
+    metrics = requestMetrics.RunMetrics("addPricesheet")
+    # Requests to this server from every script running on this host share the
+    # optional RATE_LIMIT_* budget of the config sheet.
+    rate_limit = rateLimit.SharedRateLimit.from_config(config, base_url, "addPricesheet")
+    # With SERVERS on the config sheet, requests are spread over the tenant's app servers.
+    servers = serverPool.ServerPool.from_config(config, base_url)
+    # Requests pause while AUTH_COOKIE is rejected and resume with a new one
+    # (from AUTH_COOKIE_FILE or a prompt).
+    auth = authBreaker.AuthBreaker.from_config(config)
+    # Priming is skipped when a recent run already did it (SESSION_CACHE_TTL).
+    session_cache = sessionCache.SessionCache.from_config(config)
     
     # Create a global session and prime it only once.
-    global_session = requests.Session()
+    # Its connection pool holds one keep-alive connection per worker and is
+    # shared by the workers' sessions.
+    global_session = httpTransport.create_session(retry_policies, maxWorkers, metrics, rate_limit, servers, auth)
     global_session.headers.update({
         "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
         "accept-language": "en-GB,en-US;q=0.9,en;q=0.8,de;q=0.7",
         "cache-control": "max-age=0",
         "content-type": "application/x-www-form-urlencoded",
         "dnt": "1",
-        "origin": f"https://{primary_server}.mercurygate.net",
+        "origin": base_url,
         "priority": "u=0, i",
-        "referer": f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet_process.jsp",
+        "referer": f"{base_url}/MercuryGate/pricesheets/editPriceSheet_process.jsp",
         "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Google Chrome\";v=\"134\"",
         "sec-ch-ua-mobile": "?0",
         "sec-ch-ua-platform": "\"macOS\"",
@@ -253,25 +461,148 @@ def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10):
         "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
         "cookie": auth_cookie
     })
-    prime_session(global_session, primary_server)
+    serverPool.prime(servers, base_url, lambda url: prime_session(global_session, url, 1 if useAsync else maxWorkers, session_cache))
     global_headers = global_session.headers.copy()
     global_cookies = dict_from_cookiejar(global_session.cookies)
     
-    results = []
-    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
-        future_to_row = {
-            executor.submit(process_row, row, config, mapping, global_headers, global_cookies, primary_server): row
-            for row in rows
-        }
-        for future in as_completed(future_to_row):
-            res = future.result()
+    # Results are printed, counted, journaled and (with resultsPath) written
+    # with their row number as they arrive; nothing is kept per row.
+    counts = {"OK": 0, "Error": 0, "submissions": 0}
+    journal = checkpointJournal.CheckpointJournal(journalPath, resume) if journalPath else None
+    sink = resultSink.ResultSink(resultsPath, "Status") if resultsPath else None
+    if sink:
+        for row_number, reason, _ in rejects:
+            sink.write(row_number, f"Rejected: {reason}")
+        for row in preflight.rows_at(row_numbers, columns, clean):
+            key = row_key(row)
+            if key in changed:
+                sink.write(row["row"], f"{completed[key]} (created with cost {changed[key]}, workbook now has {row['OTM_COST']})")
+            elif key in completed:
+                sink.write(row["row"], completed[key])
+    def record(results):
+        counts["submissions"] += 1
+        for row, res in results:
             print(res)
-            results.append(res)
+            ok = " Error: " not in res
+            counts["OK" if ok else "Error"] += 1
+            if journal:
+                journal.record(row_key(row), ok, res, row["OTM_COST"])
+            if sink:
+                sink.write(row["row"], res)
+
+    upper = maxInFlight if useAsync else maxWorkers
+    # With adaptive=True, maxWorkers / maxInFlight become the upper bound and the
+    # number of requests in flight follows the server's latency and error rate.
+    limiter = None
+    if adaptive:
+        limiter = concurrencyControl.AdaptiveLimit.from_config(config, max(1, upper // 2), upper)
     
-    print("Processing complete.")
+    # Rows go through two stages, opening the form (editPriceSheet.jsp) and
+    # saving the pricesheet (editPriceSheet_process.jsp), each with its own
+    # queue and concurrency limit (openWorkers / saveWorkers, by default the
+    # overall limit). Stage timings are reported with the request metrics.
+    stage_limits = {"open": max(1, openWorkers or upper), "save": max(1, saveWorkers or upper)}
+    for stage, stage_limit in stage_limits.items():
+        metrics.add_stage(stage, stage_limit)
+    timers = {stage: (lambda wait, service, stage=stage: metrics.record_stage(stage, wait, service)) for stage in stage_limits}
+    
+    try:
+        if useAsync:
+            # asyncio backend: rows run as coroutines over one pooled client.
+            gates = [asyncEngine.StageGate(stage_limits[stage], timers[stage]) for stage in ("open", "save")]
+            async def handle_async(batch, client):
+                return await process_batch_async(batch, client, gates, base_url)
+
+            asyncEngine.run_rows(batches, handle_async, global_headers, maxInFlight, record, limiter, retry_policies, metrics, rate_limit, servers, auth)
+        else:
+            # Each stage has its own thread pool; at most maxWorkers batches (or
+            # the adaptive limit) are in the pipeline at once, so the number of
+            # requests in flight stays within maxWorkers.
+            def session_setup(session):
+                httpTransport.share_transport(session, global_session)
+                if servers:
+                    servers.attach(session)
+                metrics.attach(session)
+                # Inside the rate limit and auth breaker, so their waits are
+                # not counted as server latency.
+                if limiter:
+                    limiter.attach(session)
+                if rate_limit:
+                    rate_limit.attach(session)
+                auth.attach(session)
+
+            def open_form(batch):
+                return run_step(prepare_batch(batch, base_url), 0, global_headers, global_cookies, session_setup, servers)
+
+            def save_pricesheet(state):
+                return run_step(state, 1, global_headers, global_cookies, session_setup, servers)
+
+            window = limiter.current_limit if limiter else maxWorkers
+            with ThreadPoolExecutor(max_workers=stage_limits["open"]) as open_executor, \
+                 ThreadPoolExecutor(max_workers=stage_limits["save"]) as save_executor:
+                stages = [
+                    (open_executor, open_form, stage_limits["open"], timers["open"]),
+                    (save_executor, save_pricesheet, stage_limits["save"], timers["save"]),
+                ]
+                for results in workQueue.staged_map(stages, batches, window):
+                    record(results)
+    finally:
+        if journal:
+            journal.close()
+        if sink:
+            sink.close()
+    
+    print(f"Processing complete. {counts['OK']} OK, {counts['Error']} errors, {len(rejects)} rejected in preflight.")
+    if batchSize > 1:
+        created = counts["OK"] + counts["Error"]
+        print(f"Batched {created} rows into {counts['submissions']} submissions of up to {batchSize} owners, "
+              f"saving {2 * (created - counts['submissions'])} requests.")
+    if rate_limit:
+        rate_limit.report()
+    if servers:
+        servers.report()
+    auth.report()
+    if session_cache:
+        session_cache.report()
+    metrics.report(metricsPath, prometheusPath)
     
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create pricesheets from the lookup sheet.")
+    parser.add_argument("--validate-only", action="store_true", help="run the preflight validation and write the rejects report only")
+    parser.add_argument("--shard", help="process only shard I of N (e.g. 2/4); every host running a part must use the same N")
+    parser.add_argument("--processes", type=int, metavar="N", help="run N shards as local worker processes and merge their results")
+    parser.add_argument("--merge-shards", type=int, metavar="N", help="only merge the results files of N shards (e.g. copied from several hosts)")
+    args = parser.parse_args()
+    
     excel_file_path = "./OrdersToBeUpdated_pricesheet.xlsx"
     csv_mapping_path = None  
     maxWorkers = 20
-    process_pricesheets_concurrent(excel_file_path, csv_mapping_path, maxWorkers)
+    useAsync = False    # True runs rows as coroutines instead of threads (requires aiohttp)
+    maxInFlight = 200   # Requests kept open at once by the asyncio backend
+    adaptive = True     # Tune the number of requests in flight between 1 and maxWorkers / maxInFlight
+    journalPath = excel_file_path.replace(".xlsx", ".journal.jsonl")
+    resume = False      # True skips rows the journal records as done (after an interrupted run)
+    metricsPath = excel_file_path.replace(".xlsx", ".metrics.json")    # Per-endpoint request timings of the run
+    prometheusPath = None   # e.g. "./addPricesheet.prom" for a Prometheus textfile collector
+    rejectsPath = excel_file_path.replace(".xlsx", "_rejects.csv")   # Rows rejected by the preflight validation
+    batchSize = 1       # >1 creates one pricesheet for up to batchSize loads with the same cost per submission
+    openWorkers = None  # Concurrency of the editPriceSheet.jsp stage (None: maxWorkers / maxInFlight)
+    saveWorkers = None  # Concurrency of the editPriceSheet_process.jsp stage (None: maxWorkers / maxInFlight)
+    resultsPath = excel_file_path.replace(".xlsx", "_results.csv")    # Status per workbook row
+    if args.processes:
+        if csv_mapping_path:
+            prepare_mapping(excel_file_path, csv_mapping_path)
+        # maxWorkers / maxInFlight apply per process.
+        failed = sharding.launch(__file__, args.processes, ["--validate-only"] if args.validate_only else [])
+        if failed:
+            # Rerun the failed shards with --shard (resume = True), then --merge-shards.
+            raise SystemExit(1)
+        if not args.validate_only:
+            sharding.merge_results(resultsPath, args.processes)
+        raise SystemExit(0)
+    if args.merge_shards:
+        sharding.merge_results(resultsPath, args.merge_shards)
+        raise SystemExit(0)
+    process_pricesheets_concurrent(excel_file_path, csv_mapping_path, maxWorkers, useAsync, maxInFlight, adaptive, journalPath, resume,
+                                   metricsPath, prometheusPath, args.validate_only, rejectsPath, batchSize, openWorkers, saveWorkers,
+                                   resultsPath, sharding.parse_shard(args.shard) if args.shard else None)
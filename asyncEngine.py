@@ -0,0 +1,202 @@
+import asyncio                  # type: ignore
+import time                     # type: ignore
+import retryPolicy
+import requestMetrics
+
+try:
+    import aiohttp              # type: ignore
+except ImportError:             # aiohttp is only needed for the asyncio backend
+    aiohttp = None
+
+# --- asyncio HTTP engine ---
+#
+# Alternative backend for the multi-threaded scripts: instead of one thread per
+# in-flight request, every row runs as a coroutine on a single event loop and
+# shares one pooled aiohttp connector. The number of requests in flight is
+# capped by max_in_flight, not by a thread count.
+
+class AsyncResponse:
+    """Minimal response object exposing the attributes the scripts read from requests."""
+    __slots__ = ("status_code", "text", "url")
+
+    def __init__(self, status_code, text, url):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+class AsyncClient:
+    """
+    Pooled async HTTP client with a requests-like get/post API.
+    Headers are taken from the primed requests session so priming still
+    happens only once per run. As with the requests backend, the Cookie header
+    is the only cookie source: there is no cookie jar, so a Set-Cookie (e.g.
+    from priming or a login page) can never replace AUTH_COOKIE. Every finished request is reported to
+    the observers via observer.record(latency, status=..., error=...).
+    retry_policies maps url prefixes to retryPolicy.RetryPolicy objects.
+    metrics, a requestMetrics.RunMetrics, gets the phase timings of every
+    request (once per request, retries included). rate_limit, a
+    rateLimit.SharedRateLimit, is waited for before every request. servers, a
+    serverPool.ServerPool, picks the server each request is sent to. auth, an
+    authBreaker.AuthBreaker, holds requests while the cookie is rejected.
+    """
+    def __init__(self, headers, max_in_flight=200, observers=(), retry_policies=None, metrics=None,
+                 rate_limit=None, servers=None, auth=None):
+        if aiohttp is None:
+            raise RuntimeError("The asyncio backend requires aiohttp (pip install aiohttp).")
+        self.headers = dict(headers)
+        self.max_in_flight = max_in_flight
+        self.observers = list(observers)
+        self.retry_policies = retry_policies or {}
+        self.metrics = metrics
+        self.rate_limit = rate_limit
+        self.servers = servers
+        self.auth = auth
+        self._session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trace_configs=[self.metrics.trace_config()] if self.metrics else None,
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._session.close()
+
+    async def request(self, method, url, data=None, timeout=10):
+        if self.auth is None:
+            return await self._request(method, url, data, timeout)
+        # Rejected requests wait for a new cookie and are sent again.
+        while True:
+            generation = await self.auth.wait_async()
+            resp = await self._request(method, url, data, timeout, self.auth.headers())
+            if not self.auth.check(resp, generation):
+                return resp
+
+    async def _request(self, method, url, data, timeout, headers=None):
+        if self.rate_limit is not None:
+            await self.rate_limit.acquire_async()
+        policy = retryPolicy.resolve(self.retry_policies, url)
+        timing = requestMetrics.new_timing() if self.metrics else None
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            status, text, final_url, error = await self._send(method, url, data, timeout, timing, headers)
+            if error is not None:
+                connect_error = isinstance(error, aiohttp.ClientConnectorError)
+                if policy and policy.should_retry(method, attempt, error=error, connect_error=connect_error):
+                    await asyncio.sleep(policy.delay(attempt))
+                    attempt += 1
+                    continue
+                self._measure(method, url, data, start, timing, attempt, error=error)
+                raise error
+            if policy and policy.should_retry(method, attempt, status=status):
+                await asyncio.sleep(policy.delay(attempt))
+                attempt += 1
+                continue
+            self._measure(method, url, data, start, timing, attempt, status=status, text=text)
+            return AsyncResponse(status, text, final_url)
+
+    def _measure(self, method, url, data, start, timing, retries, status=None, error=None, text=None):
+        if self.metrics is None:
+            return
+        end = time.perf_counter()
+        if timing["headers_at"] is not None and error is None:
+            timing["transfer"] = end - timing["headers_at"]
+        self.metrics.record(method, url, status=status, error=error, timings=timing, total=end - start,
+                            bytes_sent=len(data) if isinstance(data, (bytes, str)) else 0,
+                            bytes_received=len(text.encode("utf-8")) if text else 0, retries=retries)
+
+    async def _send(self, method, url, data, timeout, timing=None, headers=None):
+        """
+        Send one attempt; returns (status, text, url, error) and reports it to
+        the observers. With a server pool every attempt picks its server, so a
+        retry can go to another one.
+        """
+        client_timeout = aiohttp.ClientTimeout(total=timeout)
+        server, target = self.servers.acquire(url) if self.servers else (None, url)
+        start = time.monotonic()
+        ok = False
+        try:
+            async with self._session.request(method, target, data=data, headers=headers, timeout=client_timeout,
+                                             trace_request_ctx=timing) as resp:
+                text = await resp.text(errors="replace")
+            ok = resp.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            for observer in self.observers:
+                observer.record(time.monotonic() - start, error=e)
+            return None, None, url, e
+        finally:
+            if self.servers:
+                self.servers.release(server, ok)
+        for observer in self.observers:
+            observer.record(time.monotonic() - start, status=resp.status)
+        return resp.status, text, str(resp.url), None
+
+    async def get(self, url, timeout=10):
+        return await self.request("GET", url, timeout=timeout)
+
+    async def post(self, url, data=None, timeout=10):
+        return await self.request("POST", url, data=data, timeout=timeout)
+
+class StageGate:
+    """
+    Concurrency limit of one pipeline stage on the asyncio backend, the
+    counterpart of a workQueue.staged_map stage. on_timing(wait, service), if
+    given, receives the time each call queued for a slot and the time it ran.
+    """
+    def __init__(self, limit, on_timing=None):
+        self.limit = limit
+        self.on_timing = on_timing
+        self._semaphore = None
+
+    async def run(self, awaitable):
+        if self._semaphore is None:     # created on first use, inside the running loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+        queued_at = time.monotonic()
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                return await awaitable
+            finally:
+                if self.on_timing:
+                    self.on_timing(started - queued_at, time.monotonic() - started)
+
+async def _run_rows(rows, handler, headers, max_in_flight, on_result, limiter, retry_policies, metrics, rate_limit,
+                    servers, auth):
+    rows_iter = iter(rows)
+    observers = [limiter] if limiter is not None else []
+    async with AsyncClient(headers, max_in_flight, observers, retry_policies, metrics, rate_limit,
+                           servers, auth) as client:
+        async def worker(slot):
+            # Workers pull from the shared iterator, so only max_in_flight rows
+            # are ever materialized as pending coroutines.
+            while True:
+                # With an adaptive limiter, workers above the current limit idle.
+                while limiter is not None and slot >= limiter.limit:
+                    await asyncio.sleep(0.05)
+                row = next(rows_iter, None)
+                if row is None:
+                    return
+                on_result(await handler(row, client))
+
+        await asyncio.gather(*(worker(slot) for slot in range(max_in_flight)))
+
+def run_rows(rows, handler, headers, max_in_flight=200, on_result=print, limiter=None, retry_policies=None,
+             metrics=None, rate_limit=None, servers=None, auth=None):
+    """
+    Run handler(row, client) for every row with at most max_in_flight requests open.
+    handler must be a coroutine function returning the result line for the row;
+    on_result is called with each result as soon as it is available. An optional
+    concurrencyControl.AdaptiveLimit further caps the rows in flight, and
+    retry_policies ({url prefix: RetryPolicy}) enables retries per endpoint and
+    metrics (requestMetrics.RunMetrics) records the timings of every request,
+    rate_limit (rateLimit.SharedRateLimit) throttles them, servers
+    (serverPool.ServerPool) spreads them over several servers and auth
+    (authBreaker.AuthBreaker) pauses them while the cookie is rejected.
+    """
+    asyncio.run(_run_rows(rows, handler, headers, max_in_flight, on_result, limiter, retry_policies, metrics,
+                          rate_limit, servers, auth))
@@ -0,0 +1,173 @@
+import asyncio                  # type: ignore
+import sys                      # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+import sessionCache
+
+# --- Auth circuit breaker ---
+#
+# When AUTH_COOKIE expires mid-run the server answers every request with its
+# login page (often with status 200), so without a check each remaining row
+# would be posted for nothing and counted as OK. Every response is checked
+# for the login page (or a redirect to it), which trips the breaker at once,
+# and for bursts of DENIED_BURST 401s/403s in a row (a single one can be a
+# page the cookie may not open; CSRF rejections, handled by
+# sessionCache.CsrfToken, do not count). A tripped breaker sends no further
+# request, the workers hold their rows, and a new cookie is read from
+# AUTH_COOKIE_FILE (polled until its contents change) or asked for on the
+# terminal (shard processes started by sharding.launch get none, so N of
+# them never prompt at once: they need AUTH_COOKIE_FILE or fail fast). Then
+# the rejected requests are sent again with the new cookie and the run
+# carries on. A login page means the request was not processed, so
+# resending is safe even for non-idempotent posts.
+# Without a way to get a new cookie, requests fail with RuntimeError instead
+# of being sent, so the journal can resume them later.
+
+# Text that only the login page contains (its form action). Other pages can
+# link to /MercuryGate/login/ (e.g. to log out), so that is only checked in
+# the url a request ended up at.
+LOGIN_MARKERS = ("LoginProcess.jsp",)
+
+class AuthBreaker:
+    """
+    Pauses all requests while the auth cookie is rejected. attach() guards a
+    requests session; asyncEngine.AsyncClient uses wait_async()/check().
+    """
+    DENIED_BURST = 3        # 401s/403s in a row that count as an expired cookie
+    POLL = 5.0              # seconds between checks of the cookie file
+
+    def __init__(self, cookie, cookie_file=None, prompt=True):
+        self.cookie = cookie
+        self.cookie_file = cookie_file
+        self.prompt = prompt
+        self.generation = 0     # number of cookie refreshes so far
+        self.trips = 0
+        self.paused = 0.0
+        self.failed = False
+        self._denied = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._closed.set()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Breaker for config["AUTH_COOKIE"]. AUTH_COOKIE_FILE (optional) names a
+        file to read a new cookie from; without it the terminal is asked when
+        there is one.
+        """
+        return cls(config["AUTH_COOKIE"], config.get("AUTH_COOKIE_FILE"))
+
+    def rejected(self, resp):
+        """True if resp is the login page, a redirect to it, or ends a burst of 401s/403s."""
+        if "/login/" in str(resp.url).lower():
+            return True
+        text = resp.text or ""
+        if any(marker in text for marker in LOGIN_MARKERS):
+            return True
+        if sessionCache.csrf_rejected(resp):
+            return False    # a stale CSRF token, refreshed by the caller
+        with self._lock:
+            self._denied = self._denied + 1 if resp.status_code in (401, 403) else 0
+            return self._denied >= self.DENIED_BURST
+
+    def wait(self):
+        """Block while the breaker is open; returns the cookie generation to pass to check()."""
+        if not self._closed.is_set():
+            start = time.monotonic()
+            self._closed.wait()
+            self._count_pause(time.monotonic() - start)
+        if self.failed:
+            raise RuntimeError("AUTH_COOKIE expired and no new cookie was supplied")
+        return self.generation
+
+    async def wait_async(self):
+        """wait() for the asyncio backend."""
+        if not self._closed.is_set():
+            start = time.monotonic()
+            while not self._closed.is_set():
+                await asyncio.sleep(0.2)
+            self._count_pause(time.monotonic() - start)
+        if self.failed:
+            raise RuntimeError("AUTH_COOKIE expired and no new cookie was supplied")
+        return self.generation
+
+    def _count_pause(self, seconds):
+        with self._lock:
+            self.paused += seconds
+
+    def check(self, resp, generation):
+        """
+        True if resp was rejected for authentication; the breaker is then open
+        and the request should be sent again after wait().
+        """
+        if not self.rejected(resp):
+            return False
+        with self._lock:
+            # Requests sent with an older cookie only reopen a breaker that is
+            # still on that cookie.
+            if generation != self.generation or not self._closed.is_set():
+                return True
+            self._closed.clear()
+            self.trips += 1
+        print(f"Auth cookie rejected ({resp.status_code} from {resp.url}); submission paused.")
+        threading.Thread(target=self._refresh, daemon=True).start()
+        return True
+
+    def _refresh(self):
+        cookie = self._new_cookie()
+        with self._lock:
+            if cookie:
+                self.cookie = cookie
+                print("New auth cookie received; resuming.")
+            else:
+                self.failed = True
+                print("No new auth cookie; the remaining rows fail without being sent."
+                      + ("" if self.cookie_file else " Set AUTH_COOKIE_FILE to replace it without a terminal."))
+            self.generation += 1
+            self._denied = 0
+            self._closed.set()
+
+    def _new_cookie(self):
+        if self.cookie_file:
+            print(f"Write a new cookie to {self.cookie_file} to resume (checked every {self.POLL:g}s).")
+            while True:
+                try:
+                    with open(self.cookie_file, encoding="utf-8") as f:
+                        cookie = f.read().strip()
+                except OSError:
+                    cookie = ""
+                if cookie and cookie != self.cookie:
+                    return cookie
+                time.sleep(self.POLL)
+        if self.prompt and sys.stdin is not None and sys.stdin.isatty():
+            try:
+                return input("Paste a new AUTH_COOKIE (empty to stop): ").strip()
+            except EOFError:
+                return ""
+        return ""
+
+    def headers(self, headers=None):
+        """headers (any case of Cookie removed) with the current cookie."""
+        headers = {k: v for k, v in (headers or {}).items() if k.lower() != "cookie"}
+        headers["Cookie"] = self.cookie
+        return headers
+
+    def attach(self, session):
+        """Guard every request made through a requests session."""
+        request = session.request
+
+        def guarded_request(method, url, **kwargs):
+            while True:
+                generation = self.wait()
+                kwargs["headers"] = self.headers(kwargs.get("headers"))
+                resp = request(method, url, **kwargs)
+                if not self.check(resp, generation):
+                    return resp
+
+        session.request = guarded_request
+        return session
+
+    def report(self):
+        if self.trips:
+            print(f"Auth: cookie rejected {self.trips} times, {self.paused:.1f}s of worker time spent paused.")
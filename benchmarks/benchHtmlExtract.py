@@ -0,0 +1,80 @@
+import os                       # type: ignore
+import sys                      # type: ignore
+import re                       # type: ignore
+import timeit                   # type: ignore
+from bs4 import BeautifulSoup   # type: ignore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import htmlExtract
+
+# Micro-benchmark: targeted scanners in htmlExtract vs. the previous
+# BeautifulSoup implementations of parse_response_message (runAdminCommand.py)
+# and get_csrf_token (editStatusMessages.py).
+#
+#   python benchmarks/benchHtmlExtract.py [iterations]
+
+def bs4_admin_message(html_text):
+    soup = BeautifulSoup(html_text, "html.parser")
+    for script in soup.find_all("script"):
+        if "displayWindow('Results', message);" in script.text:
+            match = re.search(r"var message = '(.*?)';", script.text, re.DOTALL)
+            if match:
+                return match.group(1).replace("\\n", "\n")
+    return None
+
+def bs4_csrf_token(html_text):
+    soup = BeautifulSoup(html_text, "html.parser")
+    meta = soup.find("meta", {"name": "_csrf"})
+    if meta and meta.has_attr("content"):
+        return meta["content"]
+    return None
+
+def filler(rows):
+    """Table markup similar in size to the MercuryGate page chrome."""
+    return "".join(
+        f'<tr class="row{i % 2}"><td><a href="/MercuryGate/x.jsp?id={i}">Item {i}</a></td>'
+        f'<td><input type="text" name="f{i}" value="{i}"></td></tr>'
+        for i in range(rows)
+    )
+
+def admin_console_page(rows=400):
+    return (
+        "<html><head><title>Admin Console</title>"
+        '<script src="/MercuryGate/js/common.js"></script>'
+        "<script>function displayWindow(t, m) { alert(m); }</script></head><body>"
+        f"<table>{filler(rows)}</table>"
+        "<script>\nvar message = 'Command executed\\nReindexed 120 objects';\n"
+        "displayWindow('Results', message);\n</script>"
+        "</body></html>"
+    )
+
+def add_message_page(rows=400):
+    return (
+        "<html><head><title>Add Message</title>"
+        '<meta charset="utf-8"><meta name="_csrf_header" content="X-CSRF-TOKEN">'
+        '<meta name="_csrf" content="4f1c2d9e-7a7b-4c55-9a51-0d3f7e2b6c11">'
+        '<script src="/MercuryGate/js/common.js"></script></head><body>'
+        f"<form><table>{filler(rows)}</table></form></body></html>"
+    )
+
+def bench(label, fn, page, iterations):
+    seconds = timeit.timeit(lambda: fn(page), number=iterations)
+    per_call = seconds / iterations * 1e6
+    print(f"  {label:<10} {per_call:10.1f} us/call")
+    return per_call
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cases = [
+        ("adminConsole.jsp message", admin_console_page(), bs4_admin_message, htmlExtract.extract_admin_message),
+        ("addMessage.jsp CSRF token", add_message_page(), bs4_csrf_token, htmlExtract.extract_csrf_token),
+    ]
+    for name, page, old, new in cases:
+        assert old(page) == new(page), f"{name}: results differ"
+        print(f"{name} ({len(page) // 1024} KiB page, {iterations} iterations)")
+        bs4_time = bench("bs4", old, page, iterations)
+        scan_time = bench("scanner", new, page, iterations)
+        print(f"  speed-up   {bs4_time / scan_time:10.1f}x")
+
+if __name__ == "__main__":
+    main()
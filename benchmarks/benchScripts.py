@@ -0,0 +1,252 @@
+import argparse                 # type: ignore
+import csv                      # type: ignore
+import importlib                # type: ignore
+import json                     # type: ignore
+import os                       # type: ignore
+import socket                   # type: ignore
+import subprocess               # type: ignore
+import sys                      # type: ignore
+import tempfile                 # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+from contextlib import redirect_stdout   # type: ignore
+import openpyxl                 # type: ignore
+
+try:
+    import resource             # type: ignore
+except ImportError:             # not available on Windows; peak RSS is then not reported
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+# End-to-end benchmark: runs the scripts against benchmarks/mockServer.py and
+# reports rows/sec, request latency percentiles (p50/p95/p99) and peak RSS for
+# each script and worker count. Every run happens in a fresh child process so
+# RSS and timings do not leak between runs; the mock server runs in its own
+# process as well.
+#
+#   python benchmarks/benchScripts.py --rows 1000 --workers 1,10,20,50 --latency lognormal:0.05,0.5
+#   python benchmarks/benchScripts.py --scripts editPricesheet --async --workers 50,200
+#
+# --json writes the results to a file so runs can be compared over time.
+
+CONFIG = {
+    "PRIMARY_SERVER": "mock",
+    "AUTH_COOKIE": "JSESSIONID=bench",
+    "ENTERPRISE_OID": "4554639789",
+    "ENTERPRISE": "4554639789",
+    "EVENT_SUFFIX": "3500,0",
+    "STATUS_MESSAGE": "AF",
+    "TRANSPORT_ORDER_SUFFIX": ",3300,0",
+    "SCAC": "MOCK",
+}
+
+def write_workbook(path, base_url, header, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    config = wb.create_sheet("config")
+    for key, value in dict(CONFIG, BASE_URL=base_url).items():
+        config.append([key, value])
+    lookup = wb.create_sheet("lookup")
+    lookup.append(header)
+    for row in rows:
+        lookup.append(row)
+    wb.save(path)
+
+def build_pricesheet(workdir, base_url, rows):
+    path = os.path.join(workdir, "pricesheet.xlsx")
+    write_workbook(path, base_url, ["pri_ref", "OTM_COST", "pricesheet_is", "transport_id", "transport_order_id"],
+                   ([f"SO{i}", f"{1000 + i % 500}.50", str(7711000000 + i), str(4554000000 + i), str(4555000000 + i)]
+                    for i in range(rows)))
+    return {"excel": path}
+
+def build_status_messages(workdir, base_url, rows):
+    path = os.path.join(workdir, "statusmessages.xlsx")
+    write_workbook(path, base_url, ["Shipping Order", "SO Oid", "Event Oid", "Pickup Date"],
+                   ([f"SO{i}", str(4554000000 + i % max(1, rows // 4)), str(6600000000 + i), "3/16/2024 7:00:00 AM"]
+                    for i in range(rows)))
+    mapping_path = os.path.join(workdir, "All_SO_Data.csv")
+    with open(mapping_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["transport_id", "transport_order_id"])
+        for i in range(rows):
+            writer.writerow([str(4554000000 + i), str(4555000000 + i)])
+    # Build the mapping index up front so its one-off cost is not part of the first run.
+    import mappingIndex
+    with redirect_stdout(open(os.devnull, "w")):
+        mappingIndex.load_mapping_index(mapping_path, CONFIG["TRANSPORT_ORDER_SUFFIX"])
+    return {"excel": path, "mapping": mapping_path}
+
+def build_sysconfigs(workdir, base_url, rows):
+    path = os.path.join(workdir, "sysconfigs.xlsx")
+    write_workbook(path, base_url, ["page", "setting", "value"],
+                   ([f"editEnterpriseSysConMisc{i}_process.jsp", f"setting{i}", "true"] for i in range(rows)))
+    return {"excel": path}
+
+def build_admin_commands(workdir, base_url, rows):
+    path = os.path.join(workdir, "adminCommands.xlsx")
+    write_workbook(path, base_url, ["Command"], ([f"reindex {i}"] for i in range(rows)))
+    return {"excel": path}
+
+def run_add_pricesheet(module, paths, workers, use_async):
+    module.process_pricesheets_concurrent(paths["excel"], None, workers, use_async, workers, False, paths["journal"])
+
+def run_edit_pricesheet(module, paths, workers, use_async):
+    module.process_pricesheets_concurrent(paths["excel"], None, workers, use_async, workers, False, paths["journal"])
+
+def run_status_messages(module, paths, workers, use_async):
+    module.process_excel_and_post(paths["excel"], paths["mapping"], paths["journal"], False, workers, paths["results"])
+
+def run_sysconfigs(module, paths, workers, use_async):
+    module.process_sysconfigs(paths["excel"], max_workers=workers, journal_path=paths["journal"],
+                              results_path=paths["results"])
+
+def run_admin_commands(module, paths, workers, use_async):
+    module.run_commands(paths["excel"], paths["journal"], False, workers, paths["results"])
+
+# script module -> (workbook builder, runner, supports the asyncio backend)
+SCRIPTS = {
+    "addPricesheet": (build_pricesheet, run_add_pricesheet, True),
+    "editPricesheet": (build_pricesheet, run_edit_pricesheet, True),
+    "editStatusMessages": (build_status_messages, run_status_messages, False),
+    "editSysconfigs": (build_sysconfigs, run_sysconfigs, False),
+    "runAdminCommand": (build_admin_commands, run_admin_commands, False),
+}
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def instrument(latencies, lock):
+    """Time every HTTP attempt of the threaded (requests) and asyncio (aiohttp) backends."""
+    import requests.adapters
+    import asyncEngine
+    send = requests.adapters.HTTPAdapter.send
+    def timed_send(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = send(self, request, *args, **kwargs)
+        except Exception:
+            with lock:
+                latencies.append((time.perf_counter() - start, None))
+            raise
+        with lock:
+            latencies.append((time.perf_counter() - start, resp.status_code))
+        return resp
+    requests.adapters.HTTPAdapter.send = timed_send
+
+    async_send = asyncEngine.AsyncClient._send
+    async def timed_async_send(self, *args, **kwargs):
+        start = time.perf_counter()
+        result = await async_send(self, *args, **kwargs)
+        latencies.append((time.perf_counter() - start, result[0]))
+        return result
+    asyncEngine.AsyncClient._send = timed_async_send
+
+def child(script, paths_json, workers, use_async, out_path):
+    """Run one script once in this process and write its measurements to out_path."""
+    paths = json.loads(paths_json)
+    latencies, lock = [], threading.Lock()
+    instrument(latencies, lock)
+    module = importlib.import_module(script)
+    _, runner, _ = SCRIPTS[script]
+    # The scripts print one line per row; send it to /dev/null but keep the cost.
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        runner(module, paths, workers, use_async)
+        elapsed = time.perf_counter() - start
+    peak_rss_mb = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    values = sorted(latency for latency, _ in latencies)
+    failed = sum(1 for _, status in latencies if status is None or status >= 400)
+    with open(out_path, "w") as f:
+        json.dump({
+            "elapsed": elapsed,
+            "requests": len(values),
+            "failed": failed,
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "peak_rss_mb": peak_rss_mb,
+        }, f)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_mock_server(args):
+    port = free_port()
+    command = [sys.executable, os.path.join(BENCH_DIR, "mockServer.py"), "--port", str(port),
+               "--latency", args.latency, "--error-rate", str(args.error_rate)]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()    # "Mock MercuryGate listening on ..."
+    return server, f"http://127.0.0.1:{port}"
+
+def run_once(script, paths, workers, use_async, workdir):
+    out_path = os.path.join(workdir, "result.json")
+    for name in ("journal", "results"):
+        if os.path.exists(paths[name]):
+            os.remove(paths[name])
+    subprocess.run([sys.executable, os.path.abspath(__file__), "--child", script, json.dumps(paths),
+                    str(workers), "1" if use_async else "0", out_path], check=True, cwd=workdir)
+    with open(out_path) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against the local mock server.")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS), help="comma-separated script names")
+    parser.add_argument("--workers", default="1,5,10,20", help="comma-separated worker counts")
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--latency", default="lognormal:0.02,0.5", help="mock server latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="use the asyncio backend where supported (workers = maxInFlight)")
+    parser.add_argument("--json", default=None, help="also write all results to this file")
+    parser.add_argument("--child", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        script, paths_json, workers, use_async, out_path = args.child
+        return child(script, paths_json, int(workers), use_async == "1", out_path)
+
+    scripts = [s.strip() for s in args.scripts.split(",") if s.strip()]
+    worker_counts = [int(w) for w in args.workers.split(",")]
+    server, base_url = start_mock_server(args)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            print(f"{args.rows} rows per run, mock latency {args.latency}, error rate {args.error_rate}")
+            print(f"{'script':<24} {'workers':>7} {'rows/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                  f"{'requests':>8} {'failed':>6} {'peak RSS MB':>11}")
+            for script in scripts:
+                builder, _, supports_async = SCRIPTS[script]
+                paths = builder(workdir, base_url, args.rows)
+                paths["journal"] = os.path.join(workdir, f"{script}.journal.jsonl")
+                paths["results"] = os.path.join(workdir, f"{script}_results.csv")
+                use_async = args.use_async and supports_async
+                for workers in worker_counts:
+                    m = run_once(script, paths, workers, use_async, workdir)
+                    m.update(script=script, workers=workers, use_async=use_async, rows=args.rows,
+                             rows_per_sec=args.rows / m["elapsed"])
+                    results.append(m)
+                    rss = f"{m['peak_rss_mb']:.1f}" if m["peak_rss_mb"] is not None else "n/a"
+                    print(f"{script + (' (async)' if use_async else ''):<24} {workers:>7} {m['rows_per_sec']:>9.1f} "
+                          f"{m['p50'] * 1000:>8.1f} {m['p95'] * 1000:>8.1f} {m['p99'] * 1000:>8.1f} "
+                          f"{m['requests']:>8} {m['failed']:>6} {rss:>11}")
+    finally:
+        server.terminate()
+        server.wait()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import io                       # type: ignore
+import os                       # type: ignore
+import re                       # type: ignore
+import sys                      # type: ignore
+import tempfile                 # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+from contextlib import redirect_stdout   # type: ignore
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+import authBreaker
+import benchScripts
+import editPricesheet
+import mockServer
+
+# End-to-end check of the auth breaker on both backends: the mock server
+# expires the cookie mid-run and answers with a login page that sets an
+# anonymous JSESSIONID (as the real one does), a new cookie is written to
+# AUTH_COOKIE_FILE, and the run must finish with every row OK and the new
+# cookie, unchanged, in the Cookie header the server received. A cookie jar
+# merging the login page's JSESSIONID into the header would replace it.
+#
+#   python benchmarks/checkAuthRefresh.py
+
+ROWS = 60
+EXPIRE_AFTER = ROWS * 2 // 3   # requests per cookie (one POST per row)
+TIME_LIMIT = 60.0               # seconds per backend before the check fails
+OLD_COOKIE = "JSESSIONID=bench"
+NEW_COOKIE = "JSESSIONID=bench-refreshed"
+
+def supply_cookie(server, cookie_file, done):
+    """Write the new cookie once the server has served its first login page."""
+    while not done.is_set():
+        if any(key.endswith(" 401") for key in list(server.stats)):
+            with open(cookie_file, "w", encoding="utf-8") as f:
+                f.write(NEW_COOKIE)
+            return
+        time.sleep(0.05)
+
+def give_up(backend):
+    # A refreshed cookie that never reaches the server leaves the breaker
+    # waiting for yet another one, so the run would hang instead of failing.
+    print(f"{backend}: run still paused after {TIME_LIMIT:g}s; the refreshed cookie was not used", file=sys.stderr)
+    os._exit(1)
+
+def check(use_async, workdir):
+    backend = "asyncio" if use_async else "threads"
+    server, base_url = mockServer.start_server(auth_cookie="bench", expire_after=EXPIRE_AFTER)
+    cookie_file = os.path.join(workdir, "cookie.txt")
+    with open(cookie_file, "w", encoding="utf-8") as f:
+        f.write(OLD_COOKIE)
+    benchScripts.CONFIG.update(AUTH_COOKIE=OLD_COOKIE, AUTH_COOKIE_FILE=cookie_file, SESSION_CACHE_TTL="0")
+    paths = benchScripts.build_pricesheet(workdir, base_url, ROWS)
+    done = threading.Event()
+    threading.Thread(target=supply_cookie, args=(server, cookie_file, done), daemon=True).start()
+    out = io.StringIO()
+    watchdog = threading.Timer(TIME_LIMIT, give_up, args=(backend,))
+    watchdog.start()
+    try:
+        with redirect_stdout(out):
+            editPricesheet.process_pricesheets_concurrent(paths["excel"], None, 10, use_async, 10, False)
+    finally:
+        watchdog.cancel()
+        done.set()
+        server.shutdown()
+    match = re.search(r"Processing complete\. (\d+) OK", out.getvalue())
+    ok = int(match.group(1)) if match else 0
+    sent_new = server.cookie_uses.get(NEW_COOKIE, 0)
+    print(f"{backend:<8} {ok}/{ROWS} rows OK, {sent_new} requests sent with the refreshed cookie")
+    assert ok == ROWS, f"{backend}: only {ok} of {ROWS} rows succeeded"
+    assert sent_new > 0, f"{backend}: the refreshed cookie never reached the server"
+
+def main():
+    authBreaker.AuthBreaker.POLL = 0.1
+    for use_async in (False, True):
+        with tempfile.TemporaryDirectory() as workdir:
+            check(use_async, workdir)
+
+if __name__ == "__main__":
+    main()
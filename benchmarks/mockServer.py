@@ -0,0 +1,240 @@
+import argparse                 # type: ignore
+import json                     # type: ignore
+import random                   # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+import uuid                     # type: ignore
+from collections import Counter # type: ignore
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer   # type: ignore
+from html import escape                                               # type: ignore
+from urllib.parse import urlsplit, parse_qs                           # type: ignore
+
+# --- Local MercuryGate stand-in ---
+#
+# Serves the pages the scripts talk to so they can be measured without a TMS
+# tenant: editPriceSheet.jsp / editPriceSheet_process.jsp, addMessage.jsp /
+# addMessage_process.jsp, the enterprise sysconfig pages (editEnterprise*.jsp
+# and their _process pages) and adminConsole.jsp. Response latency, error rate,
+# cookie and CSRF checks are configurable. Point a script at it with the
+# BASE_URL config key, e.g. BASE_URL = http://127.0.0.1:8765
+#
+#   python benchmarks/mockServer.py --port 8765 --latency lognormal:0.05,0.5 --error-rate 0.01
+#
+# GET /__stats returns the request counts per endpoint and status as JSON.
+#
+# Posted pricesheet costs and sysconfig settings are remembered and shown in
+# the edit forms (editPriceSheet.jsp?oidPriceSheet=..., editEnterprise*.jsp),
+# so read-before-write (diff mode) runs can be measured against it.
+#
+# With --auth-cookie and --expire-after, each Cookie header value stops
+# working after N requests and the login page is served instead (with
+# --login-status, 401 by default; the real servers often answer 200). Like
+# the real login page it sets an anonymous JSESSIONID. Any other Cookie
+# header that still contains --auth-cookie is a fresh login.
+
+class LatencyModel:
+    """
+    Response delay in seconds drawn from a distribution given as a spec string:
+      fixed:0.02            always 20 ms
+      uniform:0.01,0.05     uniform between 10 and 50 ms
+      lognormal:0.05,0.5    log-normal with 50 ms median and sigma 0.5 (long tail)
+    """
+    def __init__(self, spec="fixed:0", seed=None):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        with self._lock:
+            if self.kind == "fixed":
+                return self.params[0] if self.params else 0.0
+            if self.kind == "uniform":
+                return self._random.uniform(self.params[0], self.params[1])
+            median, sigma = self.params
+            return self._random.lognormvariate(0.0, sigma) * median
+
+def page(title, body="", head=""):
+    return f"<html><head><title>{title}</title>{head}</head><body>{body}</body></html>"
+
+def form_inputs(values):
+    return "".join(f'<input type="text" name="{escape(k)}" value="{escape(v)}">' for k, v in values.items())
+
+def admin_result_page(command):
+    message = f"Command executed: {command}".replace("'", "")
+    return page(
+        "Admin Console",
+        "<script>\n"
+        f"var message = '{message}\\nOK';\n"
+        "displayWindow('Results', message);\n</script>",
+        "<script>function displayWindow(t, m) { }</script>",
+    )
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency="fixed:0", error_rate=0.0, error_status=503,
+                 auth_cookie=None, expire_after=None, require_csrf=False, seed=None, login_status=401):
+        super().__init__(address, MockHandler)
+        self.latency = LatencyModel(latency, seed)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.auth_cookie = auth_cookie
+        self.expire_after = expire_after
+        self.login_status = login_status
+        self.cookie_uses = Counter()    # Cookie header -> requests made with it
+        self.require_csrf = require_csrf
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        self.requests_seen = 0
+        self.csrf_tokens = set()
+        self.pricesheet_costs = {}      # oidPriceSheet -> CostCharge1Rate
+        self.enterprise_settings = {}   # form page -> {setting: value}
+
+    def next_request(self):
+        """Count a request; returns (request number, fail?) drawn under the lock."""
+        with self._lock:
+            self.requests_seen += 1
+            return self.requests_seen, self._random.random() < self.error_rate
+
+    def use_cookie(self, cookie):
+        """Count a request made with cookie; returns the number of requests made with it so far."""
+        with self._lock:
+            self.cookie_uses[cookie] += 1
+            return self.cookie_uses[cookie]
+
+    def count(self, path, status):
+        with self._lock:
+            self.stats[f"{path} {status}"] += 1
+
+    def issue_csrf_token(self):
+        token = str(uuid.uuid4())
+        with self._lock:
+            self.csrf_tokens.add(token)
+        return token
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real servers
+    # Headers and body go out in separate writes; without TCP_NODELAY, Nagle and
+    # delayed ACKs add ~40 ms to every response body.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+        url = urlsplit(self.path)
+        path = url.path
+        if path == "/__stats":
+            return self.reply(200, json.dumps(dict(self.server.stats)), "application/json", count=False)
+
+        server = self.server
+        _, fail = server.next_request()
+        time.sleep(server.latency.sample())
+
+        cookie = self.headers.get("Cookie", "")
+        if server.auth_cookie is not None:
+            expired = server.expire_after is not None and server.use_cookie(cookie) > server.expire_after
+            if expired or server.auth_cookie not in cookie:
+                return self.reply(server.login_status,
+                                  page("Login", '<form action="/MercuryGate/login/LoginProcess.jsp"></form>'),
+                                  extra_headers={"Set-Cookie": f"JSESSIONID=anon{uuid.uuid4().hex}; Path=/"})
+        if fail:
+            return self.reply(server.error_status, page("Service Unavailable"))
+
+        form = parse_qs(body, keep_blank_values=True)
+        query = parse_qs(url.query, keep_blank_values=True)
+        if path.endswith("/pricesheets/editPriceSheet.jsp"):
+            fields = ""
+            if "oidPriceSheet" in query:
+                with server._lock:
+                    cost = server.pricesheet_costs.get(query["oidPriceSheet"][0], "")
+                fields = form_inputs({"CostCharge1Rate": cost})
+            return self.reply(200, page("Edit Price Sheet", f"<form name=\"priceSheet\">{fields}</form>"))
+        if path.endswith("/pricesheets/editPriceSheet_process.jsp"):
+            oid = (form.get("oidPriceSheet") or [""])[0]
+            if method == "POST" and oid:
+                with server._lock:
+                    server.pricesheet_costs[oid] = (form.get("CostCharge1Rate") or [""])[0]
+            return self.reply(200, page("Price Sheet Saved"))
+        if path.endswith("/transport/addMessage.jsp"):
+            token = server.issue_csrf_token()
+            head = f'<meta name="_csrf_header" content="X-CSRF-TOKEN"><meta name="_csrf" content="{token}">'
+            return self.reply(200, page("Add Message", "<form></form>", head),
+                              extra_headers={"Set-Cookie": f"JSESSIONID={uuid.uuid4().hex}; Path=/"})
+        if path.endswith("/transport/addMessage_process.jsp"):
+            if server.require_csrf and method == "POST":
+                token = (form.get("_csrf") or [self.headers.get("X-CSRF-TOKEN", "")])[0]
+                if token not in server.csrf_tokens:
+                    return self.reply(403, page("Forbidden", "Invalid CSRF token"))
+            return self.reply(200, page("Message Added"))
+        if "/MercuryGate/enterprise/" in path and path.endswith(".jsp"):
+            form_page = path.rsplit("/", 1)[1].replace("_process", "")
+            with server._lock:
+                settings = server.enterprise_settings.setdefault(form_page, {})
+                if method == "POST" and path.endswith("_process.jsp"):
+                    settings.update((k, v[0]) for k, v in form.items() if k != "sidEnterprise")
+                fields = form_inputs(settings)
+            return self.reply(200, page("Enterprise Settings", f"<form>{fields}</form>"))
+        if path.endswith("/util/adminConsole.jsp"):
+            if method == "POST":
+                return self.reply(200, admin_result_page((form.get("sCommandList") or [""])[0]))
+            return self.reply(200, page("Admin Console", "<form></form>"))
+        return self.reply(404, page("Not Found"))
+
+    def reply(self, status, text, content_type="text/html;charset=UTF-8", extra_headers=None, count=True):
+        if count:
+            self.server.count(urlsplit(self.path).path, status)
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """Start a MockServer on a background thread; returns (server, base_url)."""
+    server = MockServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local MercuryGate stand-in for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="fixed:0.02", help="fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--auth-cookie", default=None, help="reject requests whose Cookie header lacks this text (401)")
+    parser.add_argument("--expire-after", type=int, default=None, help="treat each cookie as expired after N requests")
+    parser.add_argument("--login-status", type=int, default=401, help="status of the login page served for rejected cookies")
+    parser.add_argument("--require-csrf", action="store_true", help="check the _csrf field on addMessage_process.jsp")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    server = MockServer((args.host, args.port), args.latency, args.error_rate, args.error_status,
+                        args.auth_cookie, args.expire_after, args.require_csrf, args.seed, args.login_status)
+    print(f"Mock MercuryGate listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
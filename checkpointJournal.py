@@ -0,0 +1,90 @@
+import json                     # type: ignore
+import os                       # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+
+# --- Checkpoint journal ---
+#
+# Every processed row is appended to a JSON-lines journal as soon as its result
+# is known: {"key": <row identity>, "ok": true|false, "result": "..."}, plus
+# "value" when the caller records the value the row wrote. Writes
+# are flushed and fsync'ed in batches, so a crash loses at most the last batch.
+# A resumed run streams the journal once and skips every key whose latest entry
+# succeeded, instead of re-posting the whole workbook. Any other run starts the
+# journal afresh. Keys of the scripts that update records include the value a
+# row writes, so a workbook reused under the same name with new data never
+# resumes from an older one's entries. A row that creates a record is keyed by
+# its identity only (creating it twice would duplicate it); its value is
+# journaled separately so a resumed run can report rows whose value changed.
+
+class CheckpointJournal:
+    """
+    Thread-safe journal of row outcomes with batched fsync. A resumed run
+    appends to the existing journal; otherwise it is truncated.
+    """
+    def __init__(self, path, resume=False, fsync_every=100, fsync_interval=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def record(self, key, ok, result, value=None):
+        entry = {"key": key, "ok": ok, "result": result}
+        if value is not None:
+            entry["value"] = value
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def load_completed(path, values=None):
+    """
+    Stream a journal and return {key: result} for every key whose latest entry
+    succeeded. If a dict is passed as values, it is filled with {key: value}
+    for those entries that recorded one. A missing journal or a torn last line
+    (crash mid-write) is fine.
+    """
+    completed = {}
+    if not path or not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("ok"):
+                completed[entry["key"]] = entry.get("result", "")
+                if values is not None and "value" in entry:
+                    values[entry["key"]] = entry["value"]
+                elif values is not None:
+                    values.pop(entry["key"], None)
+            else:
+                completed.pop(entry.get("key"), None)
+                if values is not None:
+                    values.pop(entry.get("key"), None)
+    print(f"Loaded {len(completed)} completed rows from journal {path}.")
+    return completed
@@ -0,0 +1,94 @@
+import threading                # type: ignore
+import time                     # type: ignore
+from collections import deque   # type: ignore
+import requests                 # type: ignore
+
+# --- Adaptive concurrency (AIMD) ---
+#
+# Instead of a fixed worker count, the number of requests allowed in flight is
+# adjusted from what the server is telling us: while the rolling p95 latency
+# stays under target and there are no timeouts, 429s or 5xx responses the limit
+# grows by one (additive increase); when latency or errors climb it is cut by a
+# factor (multiplicative decrease).
+
+class AdaptiveLimit:
+    """
+    Thread-safe AIMD controller for the number of in-flight requests.
+    Feed it observations with record() (or attach() it to a requests session)
+    and read the current limit from .limit.
+    """
+    def __init__(self, initial=10, min_limit=1, max_limit=50, target_p95=2.0,
+                 window=40, error_threshold=0.05, decrease_factor=0.7, name="requests"):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_p95 = target_p95
+        self.error_threshold = error_threshold
+        self.decrease_factor = decrease_factor
+        self.name = name
+        self.window = window
+        self._limit = max(min_limit, min(initial, max_limit))
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, initial, max_limit, name="requests"):
+        """Build a controller using the optional ADAPTIVE_* keys of the config sheet."""
+        return cls(
+            initial=initial,
+            max_limit=max_limit,
+            min_limit=int(config.get("ADAPTIVE_MIN_WORKERS", 1)),
+            target_p95=float(config.get("ADAPTIVE_TARGET_P95", 2.0)),
+            error_threshold=float(config.get("ADAPTIVE_ERROR_RATE", 0.05)),
+            name=name,
+        )
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def current_limit(self):
+        """Callable form of .limit for code that polls the limit."""
+        return self._limit
+
+    def record(self, latency, status=None, error=None):
+        """
+        Record one finished request. A sample counts as an error when the request
+        raised (timeout, connection error) or returned 429 or a 5xx status.
+        """
+        failed = error is not None or status == 429 or (status is not None and status >= 500)
+        with self._lock:
+            self._samples.append((latency, failed))
+            if len(self._samples) >= self.window:
+                self._adjust()
+
+    def _adjust(self):
+        latencies = sorted(latency for latency, _ in self._samples)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        error_rate = sum(1 for _, failed in self._samples if failed) / len(self._samples)
+        old = self._limit
+        if error_rate > self.error_threshold or p95 > self.target_p95:
+            new = max(self.min_limit, int(old * self.decrease_factor))
+        else:
+            new = min(self.max_limit, old + 1)
+        # Start a fresh window so a single slow burst only cuts the limit once.
+        self._samples.clear()
+        if new != old:
+            self._limit = new
+            print(f"[{self.name}] concurrency limit {old} -> {new} (p95 {p95:.2f}s, errors {error_rate:.0%})")
+
+    def attach(self, session):
+        """Observe every request made through a requests session."""
+        request = session.request
+
+        def observed_request(method, url, **kwargs):
+            start = time.monotonic()
+            try:
+                resp = request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.record(time.monotonic() - start, error=e)
+                raise
+            self.record(time.monotonic() - start, status=resp.status_code)
+            return resp
+
+        session.request = observed_request
+        return session
@@ -1,9 +1,100 @@
-import csv                                                          # type: ignore
-import openpyxl                                                     # type: ignore
-import requests                                                     # type: ignore
+import argparse                                                     # type: ignore
+import time                                                         # type: ignore
+from decimal import Decimal, InvalidOperation                       # type: ignore
 from datetime import datetime                                       # type: ignore
 from urllib.parse import quote                                      # type: ignore
-from concurrent.futures import ThreadPoolExecutor, as_completed     # type: ignore
+from concurrent.futures import ThreadPoolExecutor                   # type: ignore
+import asyncEngine
+import lookupReader
+import workQueue
+import concurrencyControl
+import retryPolicy
+import httpTransport
+import mappingIndex
+import checkpointJournal
+import formTemplates
+import requestMetrics
+import rateLimit
+import serverPool
+import authBreaker
+import sessionCache
+import preflight
+import htmlExtract
+import pageCache
+import resultSink
+import sharding
+
+# Lookup columns used by process_row; all other columns are skipped while streaming.
+LOOKUP_COLUMNS = ["pri_ref", "OTM_COST", "pricesheet_is", "transport_id", "transport_order_id"]
+
+# Retry policy per endpoint. Posting the same cost to an existing pricesheet
+# leaves it unchanged, so the update is safe to repeat.
+RETRY_POLICIES = {
+    "/MercuryGate/pricesheets/editPriceSheet_process.jsp": retryPolicy.IDEMPOTENT,
+}
+
+# Form body of the update POST, url-encoded once at import time. Only the fields
+# marked VARIABLE are encoded per row (see formTemplates).
+# Hardcode values that are not needed
+PRICESHEET_FORM = formTemplates.FormTemplate({
+    "sSheetType": "Cost",
+    "listOwnerOids": "4554639789", #TODO: Remove hardcoded Stellantis enterprise
+    "sReturnURL": "/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
+    "sPostProcessURL": "",
+    "oidPriceSheet": formTemplates.VARIABLE,
+    "bGLWaiver": "false",
+    "isVendor": "false",
+    "sidCarrier": "(4533774089,3840,0)",
+    "sCarrierMode": "TL",
+    "sCarrierService": "Standard",
+    "fCarrierServiceDays": "",
+    "oidContract": "",
+    "sCurrencyCode": "EUR",
+    "oidCarrierLocation": "-1",
+    "CostChargeModel": "NORMALIZED_MANUAL",
+    "CostCharge1Type": "ITEM",
+    "CostCharge1Desc": "Total Line Haul",
+    "CostCharge1EDICode": "",
+    "CostCharge1Rate": formTemplates.VARIABLE,
+    "CostCharge1RQ": "FR",
+    "CostCharge2Type": "DISCOUNT",
+    "CostCharge2Desc": "Discount",
+    "CostCharge2EDICode": "DSC",
+    "CostCharge2Rate": "",
+    "CostCharge2RQ": "FR",
+    "CostCharge3Type": "ACCESSORIAL_FUEL",
+    "CostCharge3Desc": "Fuel Surcharge",
+    "CostCharge3EDICode": "FUE",
+    "CostCharge3Rate": "",
+    "CostCharge3RQ": "FR",
+    "CostCharge4Type": "ACCESSORIAL",
+    "CostCharge4Desc": "",
+    "CostCharge4EDICode": "LFA",
+    "CostCharge4Rate": "",
+    "CostCharge4RQ": "FR",
+    "CostCharge5Type": "ACCESSORIAL",
+    "CostCharge5Desc": "",
+    "CostCharge5EDICode": "LFA",
+    "CostCharge5Rate": "",
+    "CostCharge5RQ": "FR",
+    "CostCharge6Type": "ACCESSORIAL",
+    "CostCharge6Desc": "",
+    "CostCharge6EDICode": "LFA",
+    "CostCharge6Rate": "",
+    "CostCharge6RQ": "FR",
+    "CostCharge7Type": "ACCESSORIAL_PERCENTAGE_TOTAL",
+    "CostCharge7Desc": "",
+    "CostCharge7EDICode": "TAX:PST",
+    "CostCharge7Rate": "",
+    "CostCharge7RQ": "PCT",
+    "CostNumCharges": "7",
+    "sCommentsPS": "",
+    "fDistance": "",
+    "dateDate1": "",
+    "dateTime1": "",
+    "dateDate2": "",
+    "dateTime2": ""
+})
 
 def load_config(config_sheet):
     config = {}
@@ -13,141 +104,177 @@ def load_config(config_sheet):
             config[row[0].strip()] = str(row[1]).strip()
     return config
 
-def load_mapping(csv_filename):
-    mapping = {}
+def load_mapping(csv_filename, suffix):
+    """
+    Open the indexed transport_id -> transport_order_id mapping for the CSV.
+    The CSV is only parsed when its index is missing or out of date; values
+    come back already formatted with the suffix.
+    Raises RuntimeError when it cannot be read: going on without it would
+    post other ids than a run (or shard) that has it.
+    """
     try:
-        with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                tid = row.get("transport_id")
-                toid = row.get("transport_order_id")
-                if tid and toid:
-                    mapping[tid.strip()] = toid.strip()
-        print(f"Loaded mapping for {len(mapping)} transport IDs from {csv_filename}.")
+        return mappingIndex.load_mapping_index(csv_filename, suffix)
     except Exception as e:
-        print(f"Error reading mapping CSV file: {e}")
-    return mapping
+        raise RuntimeError(f"Error reading mapping CSV file {csv_filename}: {e}") from e
 
-def format_transport_order_id(mapping_value, suffix):
+def prepare_mapping(excel_path, csv_mapping_path):
     """
-    If mapping value doesn't contain a comma, assume it is the base value and append the suffix.
+    Build or check the mapping index once before shard processes start, so
+    they do not all rebuild it at the same time.
     """
-    if "," not in mapping_value:
-        formatted = f"({mapping_value}{suffix})"
-    else:
-        if not mapping_value.startswith("("):
-            formatted = f"({mapping_value})"
+    wb = lookupReader.open_workbook_readonly(excel_path)
+    try:
+        config = load_config(wb["config"])
+    finally:
+        wb.close()
+    load_mapping(csv_mapping_path, config["TRANSPORT_ORDER_SUFFIX"])
+
+def row_key(row_data):
+    """Identity of a lookup row in the checkpoint journal (including the cost it sets)."""
+    return "|".join(str(row_data.get(column, "")).strip() for column in ("pri_ref", "pricesheet_is", "OTM_COST"))
+
+def coalesce_key(row_data):
+    """Rows updating the same pricesheet are duplicates; only the last one needs posting."""
+    return row_data["pricesheet_is"]
+
+def preflight_rows(sheet, config, mapping):
+    """
+    Validate the whole lookup sheet before any request is sent; all
+    transport_ids are resolved in batched mapping lookups. Returns
+    (row_numbers, columns, clean, rejects) where clean holds the indexes of
+    the clean rows (build them with preflight.rows_at; their
+    transport_order_id is already formatted, so no mapping is needed later)
+    and rejects are (row_number, reason, row).
+    """
+    row_numbers, columns = preflight.read_columns(sheet, LOOKUP_COLUMNS, "pri_ref")
+    costs = columns["OTM_COST"]
+    pricesheets = columns["pricesheet_is"]
+    transport_ids = columns["transport_id"]
+    order_ids = columns["transport_order_id"]
+    mapped = preflight.lookup_many(mapping, transport_ids) if mapping else {}
+    suffix = config["TRANSPORT_ORDER_SUFFIX"]
+    
+    clean, rejects = [], []
+    for i, row_number in enumerate(row_numbers):
+        transport_id = transport_ids[i]
+        error = None
+        if not costs[i]:
+            error = "Missing OTM_COST"
+        elif not pricesheets[i]:
+            error = "Missing pricesheet_is"
+        elif transport_id and mapping:
+            if transport_id in mapped:
+                order_ids[i] = mapped[transport_id]
+            else:
+                error = f"Mapping not found for transport_id {transport_id}"
+        elif order_ids[i]:
+            order_ids[i] = mappingIndex.format_transport_order_id(order_ids[i], suffix)
+        if error:
+            rejects.append((row_number, error, {column: values[i] for column, values in columns.items()}))
         else:
-            formatted = mapping_value
-    return formatted
+            clean.append(i)
+    return row_numbers, columns, clean, rejects
 
-def prime_session(session, primary_server):
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet_process.jsp"
-    try:
-        resp = session.get(url, timeout=10)
-        print("Priming GET status:", resp.status_code)
-    except Exception as e:
-        print("Error during priming GET:", e)
+def prime_session(session, base_url, connections=1, session_cache=None):
+    url = f"{base_url}/MercuryGate/pricesheets/editPriceSheet_process.jsp"
+    # Skipped while an earlier run primed this server recently (session_cache).
+    if session_cache is None or not session_cache.primed(base_url):
+        try:
+            resp = session.get(url, timeout=10)
+            print("Priming GET status:", resp.status_code)
+            if session_cache is not None and resp.status_code == 200:
+                session_cache.store(base_url)
+        except Exception as e:
+            print("Error during priming GET:", e)
+    # Open the rest of the pool's connections now so the workers start warm.
+    if connections > 1:
+        httpTransport.prewarm(session, url, connections)
 
-def process_row(row_data, config, mapping, session, primary_server):
+def prepare_row(row_data, config, mapping, base_url):
     """
-    Process a single row of the Excel lookup data.
-    Returns a string with the format:
-      "SO {pri_ref} OK" or "SO {pri_ref} Error: <error message>"
+    Validate a single row of the Excel lookup data and build its POST request.
+    Returns (so_number, error, (url, body)); error is a message when the
+    row cannot be processed. Shared by the threaded and the asyncio backend.
     """
     # Ensure required fields are present:
     # "OTM_COST" for the new cost,
     # "pri_ref" as the SO number (for PRO),
     # "pricesheet_is" as oidPriceSheet,
     # "transport_order_id" if no CSV mapping is provided.
+    so_number = str(row_data.get("pri_ref", "")).strip()
+    otm_cost = row_data.get("OTM_COST")
+    if otm_cost is None or str(otm_cost).strip() == "":
+        return so_number, "Missing OTM_COST", None
+    new_cost = str(otm_cost).strip()
+    oidPriceSheet = str(row_data.get("pricesheet_is", "")).strip()
+    if not oidPriceSheet:
+        return so_number, "Missing pricesheet_is", None
+    
+    # Use CSV mapping if available; if not, use Excel column "transport_order_id".
+    transport_id = str(row_data.get("transport_id", "")).strip()
+    if transport_id and mapping:
+        base_mapping = mapping.get(transport_id)
+        if not base_mapping:
+            return so_number, f"Mapping not found for transport_id {transport_id}", None
+        transport_order_id = base_mapping  # pre-formatted by the mapping index
+    else:
+        # Fall back to using Excel column "transport_order_id"
+        transport_order_id = str(row_data.get("transport_order_id", "")).strip()
+        if transport_order_id and "," not in transport_order_id:
+            transport_order_id = f"({transport_order_id}{config['TRANSPORT_ORDER_SUFFIX']})"
+        elif transport_order_id and not transport_order_id.startswith("("):
+            transport_order_id = f"({transport_order_id})"
+    
+    post_payload = PRICESHEET_FORM.render(oidPriceSheet=oidPriceSheet, CostCharge1Rate=new_cost)
+    
+    post_url = f"{base_url}/MercuryGate/pricesheets/editPriceSheet_process.jsp"
+    return so_number, None, (post_url, post_payload)
+
+def current_cost_url(oidPriceSheet, base_url):
+    """Edit page of an existing pricesheet, read in diff mode for its current cost."""
+    return f"{base_url}/MercuryGate/pricesheets/editPriceSheet.jsp?oidPriceSheet={quote(oidPriceSheet)}&sSheetType=Cost"
+
+def parse_current_cost(resp):
+    """CostCharge1Rate shown on the edit page, or None if the page did not load or lacks the field."""
+    if resp.status_code != 200:
+        return None
+    return htmlExtract.extract_form_values(resp.text, ["CostCharge1Rate"]).get("CostCharge1Rate")
+
+def cost_unchanged(current, new_cost):
+    """True when the pricesheet already has new_cost; compared as numbers where both parse ("1000.5" == "1000.50")."""
+    if current is None:
+        return False
     try:
-        so_number = str(row_data.get("pri_ref", "")).strip()
-        otm_cost = row_data.get("OTM_COST")
-        if otm_cost is None or str(otm_cost).strip() == "":
-            return f"SO {so_number} Error: Missing OTM_COST"
-        new_cost = str(otm_cost).strip()
-        oidPriceSheet = str(row_data.get("pricesheet_is", "")).strip()
-        if not oidPriceSheet:
-            return f"SO {so_number} Error: Missing pricesheet_is"
-        
-        # Use CSV mapping if available; if not, use Excel column "transport_order_id".
-        transport_id = str(row_data.get("transport_id", "")).strip()
-        if transport_id and mapping:
-            base_mapping = mapping.get(transport_id)
-            if not base_mapping:
-                return f"SO {so_number} Error: Mapping not found for transport_id {transport_id}"
-            transport_order_id = format_transport_order_id(base_mapping, config["TRANSPORT_ORDER_SUFFIX"])
-        else:
-            # Fall back to using Excel column "transport_order_id"
-            transport_order_id = str(row_data.get("transport_order_id", "")).strip()
-            if transport_order_id and "," not in transport_order_id:
-                transport_order_id = f"({transport_order_id}{config['TRANSPORT_ORDER_SUFFIX']})"
-            elif transport_order_id and not transport_order_id.startswith("("):
-                transport_order_id = f"({transport_order_id})"
+        return Decimal(current.strip()) == Decimal(new_cost)
+    except InvalidOperation:
+        return current.strip() == new_cost
+
+def process_row(row_data, config, mapping, session, base_url, cache=None):
+    """
+    Process a single row of the Excel lookup data.
+    With a pageCache.PageCache (diff mode) the pricesheet's current cost is read
+    first and the POST is skipped when it already matches; if the page cannot
+    be read the row is posted as usual.
+    Returns a string with the format:
+      "SO {pri_ref} OK", "SO {pri_ref} OK (unchanged)" or "SO {pri_ref} Error: <error message>"
+    """
+    so_number = str(row_data.get("pri_ref", "")).strip()
+    try:
+        so_number, error, request = prepare_row(row_data, config, mapping, base_url)
+        if error:
+            return f"SO {so_number} Error: {error}"
         
-        # Hardcode values that are not needed
-        post_payload = {
-            "sSheetType": "Cost",
-            "listOwnerOids": "4554639789", #TODO: Remove hardcoded Stellantis enterprise
-            "sReturnURL": "/MercuryGate/transport/editTransportOrig.jsp?sidTransport=(4554639789,3300,0)",
-            "sPostProcessURL": "",
-            "oidPriceSheet": oidPriceSheet,
-            "bGLWaiver": "false",
-            "isVendor": "false",
-            "sidCarrier": "(4533774089,3840,0)",
-            "sCarrierMode": "TL",
-            "sCarrierService": "Standard",
-            "fCarrierServiceDays": "",
-            "oidContract": "",
-            "sCurrencyCode": "EUR",
-            "oidCarrierLocation": "-1",
-            "CostChargeModel": "NORMALIZED_MANUAL",
-            "CostCharge1Type": "ITEM",
-            "CostCharge1Desc": "Total Line Haul",
-            "CostCharge1EDICode": "",
-            "CostCharge1Rate": new_cost,
-            "CostCharge1RQ": "FR",
-            "CostCharge2Type": "DISCOUNT",
-            "CostCharge2Desc": "Discount",
-            "CostCharge2EDICode": "DSC",
-            "CostCharge2Rate": "",
-            "CostCharge2RQ": "FR",
-            "CostCharge3Type": "ACCESSORIAL_FUEL",
-            "CostCharge3Desc": "Fuel Surcharge",
-            "CostCharge3EDICode": "FUE",
-            "CostCharge3Rate": "",
-            "CostCharge3RQ": "FR",
-            "CostCharge4Type": "ACCESSORIAL",
-            "CostCharge4Desc": "",
-            "CostCharge4EDICode": "LFA",
-            "CostCharge4Rate": "",
-            "CostCharge4RQ": "FR",
-            "CostCharge5Type": "ACCESSORIAL",
-            "CostCharge5Desc": "",
-            "CostCharge5EDICode": "LFA",
-            "CostCharge5Rate": "",
-            "CostCharge5RQ": "FR",
-            "CostCharge6Type": "ACCESSORIAL",
-            "CostCharge6Desc": "",
-            "CostCharge6EDICode": "LFA",
-            "CostCharge6Rate": "",
-            "CostCharge6RQ": "FR",
-            "CostCharge7Type": "ACCESSORIAL_PERCENTAGE_TOTAL",
-            "CostCharge7Desc": "",
-            "CostCharge7EDICode": "TAX:PST",
-            "CostCharge7Rate": "",
-            "CostCharge7RQ": "PCT",
-            "CostNumCharges": "7",
-            "sCommentsPS": "",
-            "fDistance": "",
-            "dateDate1": "",
-            "dateTime1": "",
-            "dateDate2": "",
-            "dateTime2": ""
-        }
+        if cache is not None:
+            url = current_cost_url(row_data["pricesheet_is"], base_url)
+            try:
+                current = cache.get(url, lambda: parse_current_cost(session.get(url, timeout=10)))
+            except Exception:
+                current = None
+            if cost_unchanged(current, row_data["OTM_COST"]):
+                return f"SO {so_number} OK (unchanged)"
         
         # Send the POST request.
-        post_url = f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet_process.jsp"
+        post_url, post_payload = request
         resp = session.post(post_url, data=post_payload, timeout=10)
         if resp.status_code == 200:
             return f"SO {so_number} OK"
@@ -156,8 +283,38 @@ def process_row(row_data, config, mapping, session, primary_server):
     except Exception as e:
         return f"SO {so_number} Error: {str(e)}"
 
-def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10):
-    wb = openpyxl.load_workbook(excel_path)
+async def process_row_async(row_data, config, mapping, client, base_url, cache=None):
+    """
+    Coroutine version of process_row for the asyncio backend.
+    client is the shared asyncEngine.AsyncClient.
+    """
+    so_number = str(row_data.get("pri_ref", "")).strip()
+    try:
+        so_number, error, request = prepare_row(row_data, config, mapping, base_url)
+        if error:
+            return f"SO {so_number} Error: {error}"
+        if cache is not None:
+            url = current_cost_url(row_data["pricesheet_is"], base_url)
+            async def fetch():
+                return parse_current_cost(await client.get(url, timeout=10))
+            try:
+                current = await cache.get_async(url, fetch)
+            except Exception:
+                current = None
+            if cost_unchanged(current, row_data["OTM_COST"]):
+                return f"SO {so_number} OK (unchanged)"
+        post_url, post_payload = request
+        resp = await client.post(post_url, data=post_payload, timeout=10)
+        if resp.status_code == 200:
+            return f"SO {so_number} OK"
+        else:
+            return f"SO {so_number} Error: {resp.status_code} {resp.text[:100]}"
+    except Exception as e:
+        return f"SO {so_number} Error: {str(e)}"
+
+def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10, useAsync=False, maxInFlight=200, adaptive=False, journalPath=None, resume=False, metricsPath=None, prometheusPath=None,
+                                   validateOnly=False, rejectsPath=None, diffMode=False, resultsPath=None, shard=None):
+    wb = lookupReader.open_workbook_readonly(excel_path)
     config_sheet = wb["config"]
     config = load_config(config_sheet)
     
@@ -175,32 +332,94 @@ def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10):
             raise ValueError(f"Missing required config variable: {var}")
     
     primary_server = config["PRIMARY_SERVER"]
+    # BASE_URL (optional) points the script at another host, e.g. the local mock server.
+    base_url = config.get("BASE_URL", f"https://{primary_server}.mercurygate.net").rstrip("/")
     auth_cookie = config["AUTH_COOKIE"]
     
     mapping = {}
     if csv_mapping_path:
-        mapping = load_mapping(csv_mapping_path)
-    
-    lookup_sheet = wb["lookup"]
-    header_row = [cell.value for cell in lookup_sheet[1]]
-    # Stop processing at the first blank row in column "pri_ref"
-    rows = []
-    for row in lookup_sheet.iter_rows(min_row=2, values_only=True):
-        row_dict = dict(zip(header_row, row))
-        if not row_dict.get("pri_ref"):
-            break
-        rows.append(row_dict)
-    
-    session = requests.Session()
+        mapping = load_mapping(csv_mapping_path, config["TRANSPORT_ORDER_SUFFIX"])
+    
+    # Validate the whole sheet before any network traffic. Rejected rows go to
+    # the rejects report; only clean rows reach the workers, built one at a
+    # time from the sheet's columns as they are sent.
+    start = time.monotonic()
+    row_numbers, columns, clean, rejects = preflight_rows(wb["lookup"], config, mapping)
+    wb.close()
+    rejectsPath = rejectsPath or excel_path.replace(".xlsx", "_rejects.csv")
+    if shard:
+        # Shard mode: keep only this shard's rows. The hash is over the
+        # pricesheet, so all rows of one pricesheet land in the same shard and
+        # coalescing below still sees every duplicate. Each shard writes its
+        # own journal, rejects, results and metrics files.
+        clean = [i for i, row in zip(clean, preflight.rows_at(row_numbers, columns, clean))
+                 if sharding.in_shard(coalesce_key(row), shard)]
+        rejects = [reject for reject in rejects if sharding.in_shard(coalesce_key(reject[2]), shard)]
+        journalPath, rejectsPath, resultsPath, metricsPath, prometheusPath = (
+            sharding.shard_path(p, shard) for p in (journalPath, rejectsPath, resultsPath, metricsPath, prometheusPath))
+        print(f"Shard {shard[0]}/{shard[1]}: {len(clean)} clean rows, {len(rejects)} rejected.")
+    preflight.write_rejects(rejectsPath, rejects, LOOKUP_COLUMNS)
+    preflight.report(len(clean) + len(rejects), clean, rejects, rejectsPath)
+    # Posting a cost overwrites the previous one, so for repeated pricesheets
+    # only the last row's cost is sent.
+    duplicates = clean
+    clean, coalesced = preflight.coalesce(clean, lambda i: coalesce_key(preflight.row_at(row_numbers, columns, i)))
+    kept = set(clean)
+    superseded = [row_numbers[i] for i in duplicates if i not in kept]
+    duplicates = kept = None
+    print(f"Coalesced {coalesced} duplicate rows (last row per pricesheet wins), saving {coalesced} requests.")
+    print(f"Preflight took {time.monotonic() - start:.1f}s.")
+    if validateOnly:
+        return
+    
+    # When resuming, rows already completed according to the journal are skipped.
+    completed = checkpointJournal.load_completed(journalPath) if resume else {}
+    def pending_rows():
+        for row in preflight.rows_at(row_numbers, columns, clean):
+            if row_key(row) in completed:
+                if sink:
+                    sink.write(row["row"], completed[row_key(row)])
+            else:
+                yield row
+    rows = pending_rows()
+    mapping = None  # clean rows already carry their formatted transport_order_id
+    
+    retry_policies = retryPolicy.for_server(base_url, RETRY_POLICIES)
+    
+    # Every HTTP call is timed per phase (DNS/connect/TLS/wait/transfer) and
+    # summarized per endpoint at the end of the run.
+    metrics = requestMetrics.RunMetrics("editPricesheet")
+    # Requests to this server from every script running on this host share the
+    # optional RATE_LIMIT_* budget of the config sheet.
+    rate_limit = rateLimit.SharedRateLimit.from_config(config, base_url, "editPricesheet")
+    # With SERVERS on the config sheet, requests are spread over the tenant's app servers.
+    servers = serverPool.ServerPool.from_config(config, base_url)
+    # Requests pause while AUTH_COOKIE is rejected and resume with a new one
+    # (from AUTH_COOKIE_FILE or a prompt).
+    auth = authBreaker.AuthBreaker.from_config(config)
+    # Priming is skipped when a recent run already did it (SESSION_CACHE_TTL).
+    session_cache = sessionCache.SessionCache.from_config(config)
+    # With adaptive=True, maxWorkers / maxInFlight become the upper bound and the
+    # number of requests in flight follows the server's latency and error rate.
+    limiter = None
+    if adaptive:
+        upper = maxInFlight if useAsync else maxWorkers
+        limiter = concurrencyControl.AdaptiveLimit.from_config(config, max(1, upper // 2), upper)
+    
+    # One session shared by all workers; its pool holds one keep-alive
+    # connection per worker. The thread backend's limiter observes it (inside
+    # the rate limit and auth breaker); the asyncio backend has its own client.
+    session = httpTransport.create_session(retry_policies, maxWorkers, metrics, rate_limit, servers, auth,
+                                           None if useAsync else limiter)
     session.headers.update({
         "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
         "accept-language": "en-GB,en-US;q=0.9,en;q=0.8,de;q=0.7",
         "cache-control": "max-age=0",
         "content-type": "application/x-www-form-urlencoded",
         "dnt": "1",
-        "origin": f"https://{primary_server}.mercurygate.net",
+        "origin": base_url,
         "priority": "u=0, i",
-        "referer": f"https://{primary_server}.mercurygate.net/MercuryGate/pricesheets/editPriceSheet_process.jsp",
+        "referer": f"{base_url}/MercuryGate/pricesheets/editPriceSheet_process.jsp",
         "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Google Chrome\";v=\"134\"",
         "sec-ch-ua-mobile": "?0",
         "sec-ch-ua-platform": "\"macOS\"",
@@ -214,20 +433,104 @@ def process_pricesheets_concurrent(excel_path, csv_mapping_path, maxWorkers=10):
     })
     
     # Prime the session.
-    prime_session(session, primary_server)
+    serverPool.prime(servers, base_url, lambda url: prime_session(session, url, 1 if useAsync else maxWorkers, session_cache))
     
-    results = []
-    with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
-        future_to_row = {executor.submit(process_row, row, config, mapping, session, primary_server): row for row in rows}
-        for future in as_completed(future_to_row):
-            res = future.result()
-            print(res)
-            results.append(res)
+    # Results are printed, counted, journaled and (with resultsPath) written
+    # with their row number as they arrive; nothing is kept per row.
+    counts = {"OK": 0, "Error": 0, "Unchanged": 0}
+    journal = checkpointJournal.CheckpointJournal(journalPath, resume) if journalPath else None
+    sink = resultSink.ResultSink(resultsPath, "Status") if resultsPath else None
+    if sink:
+        for row_number, reason, _ in rejects:
+            sink.write(row_number, f"Rejected: {reason}")
+        for row_number in superseded:
+            sink.write(row_number, "Skipped: a later row updates the same pricesheet")
+    def record(item):
+        row, res = item
+        print(res)
+        ok = " Error: " not in res
+        counts["OK" if ok else "Error"] += 1
+        counts["Unchanged"] += res.endswith(" (unchanged)")
+        if journal:
+            journal.record(row_key(row), ok, res)
+        if sink:
+            sink.write(row["row"], res)
+
+    # In diff mode every pricesheet's current cost is read first (pages cached
+    # for the run) and only rows whose cost differs are posted.
+    cache = pageCache.PageCache() if diffMode else None
     
-    print("Processing complete.")
+    try:
+        if useAsync:
+            # asyncio backend: rows run as coroutines over one pooled client.
+            async def handle_async(row, client):
+                return row, await process_row_async(row, config, mapping, client, base_url, cache)
+
+            asyncEngine.run_rows(rows, handle_async, session.headers, maxInFlight, record, limiter, retry_policies, metrics, rate_limit, servers, auth)
+        else:
+            # Keep a bounded window of futures so rows are handed out only as
+            # workers free up.
+            def handle(row):
+                return row, process_row(row, config, mapping, session, base_url, cache)
+
+            window = limiter.current_limit if limiter else maxWorkers * 2
+            with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+                for item in workQueue.bounded_map(executor, handle, rows, window):
+                    record(item)
+    finally:
+        if journal:
+            journal.close()
+        if sink:
+            sink.close()
+    
+    print(f"Processing complete. {counts['OK']} OK, {counts['Error']} errors, {len(rejects)} rejected in preflight, {coalesced} coalesced.")
+    if cache is not None:
+        print(f"Diff mode: {counts['Unchanged']} rows already had their cost and were not posted "
+              f"({cache.fetches} pages read, {cache.hits} cache hits).")
+    if rate_limit:
+        rate_limit.report()
+    if servers:
+        servers.report()
+    auth.report()
+    if session_cache:
+        session_cache.report()
+    metrics.report(metricsPath, prometheusPath)
     
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update pricesheet costs from the lookup sheet.")
+    parser.add_argument("--validate-only", action="store_true", help="run the preflight validation and write the rejects report only")
+    parser.add_argument("--shard", help="process only shard I of N (e.g. 2/4); every host running a part must use the same N")
+    parser.add_argument("--processes", type=int, metavar="N", help="run N shards as local worker processes and merge their results")
+    parser.add_argument("--merge-shards", type=int, metavar="N", help="only merge the results files of N shards (e.g. copied from several hosts)")
+    args = parser.parse_args()
+    
     excel_file_path = "./OrdersToBeUpdated_pricesheet.xlsx"
     csv_mapping_path = None  
     maxWorkers = 20
-    process_pricesheets_concurrent(excel_file_path, csv_mapping_path, maxWorkers)
+    useAsync = False    # True runs rows as coroutines instead of threads (requires aiohttp)
+    maxInFlight = 200   # Requests kept open at once by the asyncio backend
+    adaptive = True     # Tune the number of requests in flight between 1 and maxWorkers / maxInFlight
+    journalPath = excel_file_path.replace(".xlsx", ".journal.jsonl")
+    resume = False      # True skips rows the journal records as done (after an interrupted run)
+    metricsPath = excel_file_path.replace(".xlsx", ".metrics.json")    # Per-endpoint request timings of the run
+    prometheusPath = None   # e.g. "./editPricesheet.prom" for a Prometheus textfile collector
+    rejectsPath = excel_file_path.replace(".xlsx", "_rejects.csv")   # Rows rejected by the preflight validation
+    diffMode = False    # True reads each pricesheet's current cost first and only posts rows that change it
+    resultsPath = excel_file_path.replace(".xlsx", "_results.csv")    # Status per workbook row
+    if args.processes:
+        if csv_mapping_path:
+            prepare_mapping(excel_file_path, csv_mapping_path)
+        # maxWorkers / maxInFlight apply per process.
+        failed = sharding.launch(__file__, args.processes, ["--validate-only"] if args.validate_only else [])
+        if failed:
+            # Rerun the failed shards with --shard (resume = True), then --merge-shards.
+            raise SystemExit(1)
+        if not args.validate_only:
+            sharding.merge_results(resultsPath, args.processes)
+        raise SystemExit(0)
+    if args.merge_shards:
+        sharding.merge_results(resultsPath, args.merge_shards)
+        raise SystemExit(0)
+    process_pricesheets_concurrent(excel_file_path, csv_mapping_path, maxWorkers, useAsync, maxInFlight, adaptive, journalPath, resume,
+                                   metricsPath, prometheusPath, args.validate_only, rejectsPath, diffMode, resultsPath,
+                                   sharding.parse_shard(args.shard) if args.shard else None)
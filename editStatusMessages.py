@@ -1,10 +1,30 @@
-import csv                      # type: ignore
-import openpyxl                 # type: ignore
-import requests                 # type: ignore
 from datetime import datetime   # type: ignore
 from urllib.parse import quote  # type: ignore
-from bs4 import BeautifulSoup   # type: ignore
 import re                       # type: ignore
+from concurrent.futures import ThreadPoolExecutor   # type: ignore
+from contextlib import nullcontext  # type: ignore
+import retryPolicy
+import httpTransport
+import mappingIndex
+import checkpointJournal
+import workQueue
+import lookupReader
+import resultSink
+import htmlExtract
+import requestMetrics
+import rateLimit
+import serverPool
+import authBreaker
+import sessionCache
+
+# Retry policy per endpoint. Every POST adds a new status message, so it is only
+# retried when the request never reached the server.
+RETRY_POLICIES = {
+    "/MercuryGate/transport/addMessage_process.jsp": retryPolicy.NOT_IDEMPOTENT,
+}
+
+# Lookup columns used by prepare_status_row; all other columns are skipped while streaming.
+LOOKUP_COLUMNS = ["Shipping Order", "SO Oid", "Event Oid", "Pickup Date"]
 
 def load_config(config_sheet):
     config = {}
@@ -14,30 +34,25 @@ def load_config(config_sheet):
             config[row[0].strip()] = str(row[1]).strip()
     return config
 
-def load_mapping(csv_filename):
-    mapping = {}
+def load_mapping(csv_filename, suffix):
+    """
+    Open the indexed transport_id -> transport_order_id mapping for the CSV.
+    The CSV is only parsed when its index is missing or out of date; values
+    come back already formatted with the suffix.
+    Raises RuntimeError when it cannot be read.
+    """
     try:
-        with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                tid = row.get("transport_id")
-                toid = row.get("transport_order_id")
-                if tid and toid:
-                    mapping[tid.strip()] = toid.strip()
-        print(f"Loaded mapping for {len(mapping)} transport IDs from {csv_filename}.")
+        return mappingIndex.load_mapping_index(csv_filename, suffix)
     except Exception as e:
-        print(f"Error reading mapping CSV file: {e}")
-    return mapping
+        raise RuntimeError(f"Error reading mapping CSV file {csv_filename}: {e}") from e
 
-def get_csrf_token(session, primary_server):
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/transport/addMessage.jsp?norefresh=&messageCode=AF"
+def get_csrf_token(session, base_url):
+    url = f"{base_url}/MercuryGate/transport/addMessage.jsp?norefresh=&messageCode=AF"
     try:
         resp = session.get(url, timeout=10)
         if resp.status_code == 200:
-            soup = BeautifulSoup(resp.text, "html.parser")
-            meta = soup.find("meta", {"name": "_csrf"})
-            if meta and meta.has_attr("content"):
-                token = meta["content"]
+            token = htmlExtract.extract_csrf_token(resp.text)
+            if token is not None:
                 print("Extracted CSRF token from meta tag:", token)
                 return token
             else:
@@ -50,19 +65,6 @@ def get_csrf_token(session, primary_server):
         print("Error fetching CSRF token:", e)
         return ""
 
-def format_transport_order_id(mapping_value, suffix):
-    """
-    If mapping value doesn't contain a comma, assume it is the base value and append the suffix.
-    """
-    if "," not in mapping_value:
-        formatted = f"({mapping_value}{suffix})"
-    else:
-        if not mapping_value.startswith("("):
-            formatted = f"({mapping_value})"
-        else:
-            formatted = mapping_value
-    return formatted
-
 def format_sidEvent(event_oid, event_suffix):
     return f"({event_oid},{event_suffix})"
 
@@ -92,16 +94,121 @@ def parse_pickup_datetime(value):
                 print("Failed to parse pickup date/time:", value, "Error:", e)
                 return str(value).strip(), ""
 
-def prime_session(session, primary_server):
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/transport/addMessage.jsp?norefresh=&messageCode=AF"
+def prime_session(session, base_url, connections=1, session_cache=None, csrf=None):
+    """
+    Prime the session with addMessage.jsp (its CSRF token goes to csrf),
+    unless session_cache says a recent run already primed base_url.
+    """
+    url = f"{base_url}/MercuryGate/transport/addMessage.jsp?norefresh=&messageCode=AF"
+    if session_cache is None or not session_cache.primed(base_url):
+        try:
+            resp = session.get(url, timeout=10)
+            print("Priming GET status:", resp.status_code)
+            if resp.status_code == 200:
+                if session_cache is not None:
+                    session_cache.store(base_url)
+                token = htmlExtract.extract_csrf_token(resp.text)
+                if csrf is not None and token:
+                    csrf.set(token)
+        except Exception as e:
+            print("Error during priming GET:", e)
+    # Open the rest of the pool's connections now so the workers start warm.
+    if connections > 1:
+        httpTransport.prewarm(session, url, connections)
+
+def prepare_status_row(row_data, config, mapping):
+    """
+    Validate one lookup row and build its addMessage_process.jsp payload.
+    Returns (transport_id, transport_order_id, post_payload, error); error is a
+    message for the Status column when the row cannot be posted.
+    """
+    # Get transport ID from "SO Oid"
+    transport_id = row_data.get("SO Oid")
+    if not transport_id:
+        return None, None, None, "Missing SO Oid (transport_id)"
+    transport_id = str(transport_id).strip()
+    
+    base_mapping = mapping.get(transport_id)
+    if not base_mapping:
+        return transport_id, None, None, f"Mapping not found for transport_id {transport_id}"
+    transport_order_id = base_mapping  # pre-formatted by the mapping index
+    
+    # Get Event Oid and build sidEvent.
+    event_oid = row_data.get("Event Oid")
+    if not event_oid:
+        return transport_id, transport_order_id, None, "Missing Event Oid"
+    event_oid = str(event_oid).strip()
+    sidEvent = format_sidEvent(event_oid, config["EVENT_SUFFIX"])
+    
+    # Parse the pickup date and time.
+    pickup_date_raw = row_data.get("Pickup Date")
+    date_str, time_str = parse_pickup_datetime(pickup_date_raw)
+    
+    # For PRO, use the value from the "Shipping Order" column.
+    pro_value = row_data.get("Shipping Order")
+    if pro_value:
+        pro_value = str(pro_value).strip()
+    else:
+        pro_value = ""
+    scac_value = config["SCAC"]
+    
+    post_payload = {
+        "norefresh": "",
+        "bRefresh": "false",
+        "oidEnterprise": config["ENTERPRISE_OID"],
+        "bShowReferences": "true",
+        "sidTransportOrder": transport_order_id,
+        "sidEvent": sidEvent,
+        "requireApproval": "false",
+        "changeRequestType": "",
+        "changeRequestOwnerOid": "",
+        "sEvent": "",
+        "sOrigApptComment": "",
+        "SCAC": scac_value,
+        "PRO": pro_value,
+        "sType": "AF",
+        "dateDate1": "",
+        "dateTime1": "",
+        "dateDate2": date_str,
+        "dateTime2": "12:00 PM", # hardcoded
+        #"dateTime2": time_str, # dynamic    
+        "sLateReasonCode": "",
+        "sidReferenceType1": "(100106,3250,0)", # TODO: Check if this can be blank
+        "sReference1": ""
+    }
+    return transport_id, transport_order_id, post_payload, None
+
+def post_status_message(session, post_url, post_payload, csrf=None):
+    """
+    Post one status message with the current CSRF token in the X-CSRF-TOKEN
+    header (the header addMessage.jsp names in its _csrf_header meta tag).
+    Only a post the CSRF filter rejected (403 with its rejection text, see
+    sessionCache.csrf_rejected) is sent once more, with a new token; any
+    other response is final. Returns (ok, result_text) for the Status column.
+    """
     try:
-        resp = session.get(url, timeout=10)
-        print("Priming GET status:", resp.status_code)
+        token = csrf.token if csrf else None
+        response = session.post(post_url, data=post_payload, timeout=10,
+                                headers={"X-CSRF-TOKEN": token} if token else None)
+        if csrf and sessionCache.csrf_rejected(response):
+            # The filter rejects a post before the page adds anything, so resending is safe.
+            token = csrf.refresh(token)
+            response = session.post(post_url, data=post_payload, timeout=10,
+                                    headers={"X-CSRF-TOKEN": token} if token else None)
+        #print("=== POST Debug ===")
+        #print("POST URL:", post_url)
+        #print("POST payload:", post_payload)
+        #print("Response Status Code:", response.status_code)
+        #print("Response (first 300 chars):", response.text[:300])
+        if response.status_code == 200:
+            return True, "200 OK"
+        return False, f"{response.status_code}: {response.text[:100]}"
     except Exception as e:
-        print("Error during priming GET:", e)
+        return False, f"Error: {str(e)}"
 
-def process_excel_and_post(excel_path, csv_mapping_path):
-    wb = openpyxl.load_workbook(excel_path)
+def process_excel_and_post(excel_path, csv_mapping_path, journal_path=None, resume=False, max_workers=10,
+                           results_path=None, merge_output_path=None, metrics_path=None, prometheus_path=None):
+    wb = lookupReader.open_workbook_readonly(excel_path)
     config_sheet = wb["config"]
     config = load_config(config_sheet)
     
@@ -119,23 +226,39 @@ def process_excel_and_post(excel_path, csv_mapping_path):
             raise ValueError(f"Missing required config variable: {var}")
     
     primary_server = config["PRIMARY_SERVER"]
+    # BASE_URL (optional) points the script at another host, e.g. the local mock server.
+    base_url = config.get("BASE_URL", f"https://{primary_server}.mercurygate.net").rstrip("/")
     auth_cookie = config["AUTH_COOKIE"]
     
-    mapping = load_mapping(csv_mapping_path)
+    mapping = load_mapping(csv_mapping_path, config["TRANSPORT_ORDER_SUFFIX"])
     if not mapping:
         print("No mapping data loaded. Exiting.")
+        wb.close()
         return
     
-    session = requests.Session()
+    # Every HTTP call is timed per phase (DNS/connect/TLS/wait/transfer) and
+    # summarized per endpoint at the end of the run.
+    metrics = requestMetrics.RunMetrics("editStatusMessages")
+    # Requests to this server from every script running on this host share the
+    # optional RATE_LIMIT_* budget of the config sheet.
+    rate_limit = rateLimit.SharedRateLimit.from_config(config, base_url, "editStatusMessages")
+    # With SERVERS on the config sheet, requests are spread over the tenant's app servers.
+    servers = serverPool.ServerPool.from_config(config, base_url)
+    # Requests pause while AUTH_COOKIE is rejected and resume with a new one
+    # (from AUTH_COOKIE_FILE or a prompt).
+    auth = authBreaker.AuthBreaker.from_config(config)
+    # Priming is skipped and the CSRF token reused after a recent run (SESSION_CACHE_TTL).
+    session_cache = sessionCache.SessionCache.from_config(config)
+    session = httpTransport.create_session(retryPolicy.for_server(base_url, RETRY_POLICIES), max_workers, metrics, rate_limit, servers, auth)
     session.headers.update({
         "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
         "accept-language": "en-GB,en-US;q=0.9,en;q=0.8,de;q=0.7",
         "cache-control": "max-age=0",
         "content-type": "application/x-www-form-urlencoded",
         "dnt": "1",
-        "origin": f"https://{primary_server}.mercurygate.net",
+        "origin": base_url,
         "priority": "u=0, i",
-        "referer": f"https://{primary_server}.mercurygate.net/MercuryGate/transport/addMessage_process.jsp",
+        "referer": f"{base_url}/MercuryGate/transport/addMessage_process.jsp",
         "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Google Chrome\";v=\"134\"",
         "sec-ch-ua-mobile": "?0",
         "sec-ch-ua-platform": "\"macOS\"",
@@ -148,112 +271,94 @@ def process_excel_and_post(excel_path, csv_mapping_path):
         "cookie": auth_cookie
     })
     
-    # Prime the session.
-    prime_session(session, primary_server)
+    # Prime the session. Each server has its own CSRF token, from its priming
+    # page or the cache, only fetched again when a post is rejected for it.
+    csrf_tokens = {}    # server base url -> sessionCache.CsrfToken
+    def csrf_for(url):
+        if url not in csrf_tokens:
+            csrf_tokens[url] = sessionCache.CsrfToken(lambda: get_csrf_token(session, url), session_cache, url)
+        return csrf_tokens[url]
+    serverPool.prime(servers, base_url, lambda url: prime_session(session, url, max_workers, session_cache, csrf_for(url)))
     
-    post_url = f"https://{primary_server}.mercurygate.net/MercuryGate/transport/addMessage_process.jsp"
+    post_url = f"{base_url}/MercuryGate/transport/addMessage_process.jsp"
     
-    lookup_sheet = wb["lookup"]
-    header_row = [cell.value for cell in lookup_sheet[1]]
-    if "Status" in header_row:
-        status_col = header_row.index("Status") + 1
-    else:
-        status_col = len(header_row) + 1
-        lookup_sheet.cell(row=1, column=status_col, value="Status")
+    # Statuses are streamed to the results file as they arrive instead of being
+    # written into the workbook and saved at the end.
+    results_path = results_path or excel_path.replace(".xlsx", "_results.csv")
+    sink = resultSink.ResultSink(results_path, "Status")
     
-    for idx, row in enumerate(lookup_sheet.iter_rows(min_row=2, values_only=True), start=2):
-        row_data = dict(zip(header_row, row))
-        if not row_data.get("Shipping Order"):
-            print(f"Empty 'Shipping Order' at row {idx}. Stopping processing.")
-            break
-
-        # Get transport ID from "SO Oid"
-        transport_id = row_data.get("SO Oid")
-        if not transport_id:
-            msg = "Missing SO Oid (transport_id)"
-            print(f"Row {idx}: {msg}")
-            lookup_sheet.cell(row=idx, column=status_col, value=msg)
-            continue
-        transport_id = str(transport_id).strip()
-        
-        base_mapping = mapping.get(transport_id)
-        if not base_mapping:
-            msg = f"Mapping not found for transport_id {transport_id}"
-            print(f"Row {idx}: {msg}")
-            lookup_sheet.cell(row=idx, column=status_col, value=msg)
-            continue
-        transport_order_id = format_transport_order_id(base_mapping, config["TRANSPORT_ORDER_SUFFIX"])
-        
-        # Get Event Oid and build sidEvent.
-        event_oid = row_data.get("Event Oid")
-        if not event_oid:
-            msg = "Missing Event Oid"
-            print(f"Row {idx}: {msg}")
-            lookup_sheet.cell(row=idx, column=status_col, value=msg)
-            continue
-        event_oid = str(event_oid).strip()
-        sidEvent = format_sidEvent(event_oid, config["EVENT_SUFFIX"])
-        
-        # Parse the pickup date and time.
-        pickup_date_raw = row_data.get("Pickup Date")
-        date_str, time_str = parse_pickup_datetime(pickup_date_raw)
-        
-        # For PRO, use the value from the "Shipping Order" column.
-        pro_value = row_data.get("Shipping Order")
-        if pro_value:
-            pro_value = str(pro_value).strip()
-        else:
-            pro_value = ""
-        scac_value = config["SCAC"]
-        
-        post_payload = {
-            "norefresh": "",
-            "bRefresh": "false",
-            "oidEnterprise": config["ENTERPRISE_OID"],
-            "bShowReferences": "true",
-            "sidTransportOrder": transport_order_id,
-            "sidEvent": sidEvent,
-            "requireApproval": "false",
-            "changeRequestType": "",
-            "changeRequestOwnerOid": "",
-            "sEvent": "",
-            "sOrigApptComment": "",
-            "SCAC": scac_value,
-            "PRO": pro_value,
-            "sType": "AF",
-            "dateDate1": "",
-            "dateTime1": "",
-            "dateDate2": date_str,
-            "dateTime2": "12:00 PM", # hardcoded
-            #"dateTime2": time_str, # dynamic    
-            "sLateReasonCode": "",
-            "sidReferenceType1": "(100106,3250,0)", # TODO: Check if this can be blank
-            "sReference1": ""
-        }
-        
-        try:
-            response = session.post(post_url, data=post_payload, timeout=10)
-            #print("=== POST Debug (Row", idx, ") ===")
-            #print("POST URL:", post_url)
-            #print("POST payload:", post_payload)
-            #print("Response Status Code:", response.status_code)
-            #print("Response (first 300 chars):", response.text[:300])
-            if response.status_code == 200:
-                result_text = "200 OK"
-            else:
-                result_text = f"{response.status_code}: {response.text[:100]}"
-            print(f"Row {idx} -> transport_order_id: {transport_order_id} | {result_text}")
-            lookup_sheet.cell(row=idx, column=status_col, value=result_text)
-        except Exception as e:
-            err_msg = f"Error: {str(e)}"
-            print(f"Row {idx} -> {err_msg}")
-            lookup_sheet.cell(row=idx, column=status_col, value=err_msg)
+    # Rows completed in an earlier run keep their journaled status when resuming.
+    completed = checkpointJournal.load_completed(journal_path) if resume else {}
+    journal = checkpointJournal.CheckpointJournal(journal_path, resume) if journal_path else None
+    
+    def postable_rows():
+        """Validate rows in workbook order; invalid rows get their Status right away."""
+        for idx, row_data in lookupReader.iter_lookup_rows(wb["lookup"], LOOKUP_COLUMNS, "Shipping Order"):
+            key = f"{row_data.get('SO Oid')}|{row_data.get('Event Oid')}|{row_data.get('Pickup Date')}"
+            if key in completed:
+                sink.write(idx, completed[key])
+                continue
+            
+            transport_id, transport_order_id, post_payload, error = prepare_status_row(row_data, config, mapping)
+            if error:
+                print(f"Row {idx}: {error}")
+                sink.write(idx, error)
+                continue
+            yield idx, key, transport_id, transport_order_id, post_payload
+    
+    def handle(item):
+        idx, key, transport_id, transport_order_id, post_payload = item
+        # With SERVERS the post (and a resend) goes to the server its token is from.
+        server = servers.choose() if servers else None
+        with servers.pinned(server) if servers else nullcontext():
+            csrf = csrf_for(server.base_url if server else base_url)
+            ok, result_text = post_status_message(session, post_url, post_payload, csrf)
+        return idx, key, transport_order_id, ok, result_text
+    
+    # Status events of one transport are applied in workbook order (one lane per
+    # SO Oid); different transports are posted in parallel. Results are only
+    # written from this thread.
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = workQueue.keyed_map(executor, handle, postable_rows(), lambda item: item[2], max_workers * 2)
+            for idx, key, transport_order_id, ok, result_text in results:
+                if result_text.startswith("Error: "):
+                    print(f"Row {idx} -> {result_text}")
+                else:
+                    print(f"Row {idx} -> transport_order_id: {transport_order_id} | {result_text}")
+                sink.write(idx, result_text)
+                if journal:
+                    journal.record(key, ok, result_text)
+    finally:
+        if journal:
+            journal.close()
+        sink.close()
+        wb.close()
+    print(f"Processing complete. Results saved to {results_path}")
+    if rate_limit:
+        rate_limit.report()
+    if servers:
+        servers.report()
+    auth.report()
+    if session_cache:
+        session_cache.report()
+    refreshes = sum(csrf.refreshes for csrf in csrf_tokens.values())
+    if refreshes:
+        print(f"CSRF token rejected and fetched again {refreshes} times.")
+    metrics.report(metrics_path, prometheus_path)
     
-    output_path = "./OrdersToBeUpdated_tmp_updated.xlsx"
-    wb.save(output_path)
-    print(f"Processing complete. Results saved to {output_path}")
+    if merge_output_path:
+        resultSink.merge_into_workbook(excel_path, results_path, merge_output_path, "Status")
 
 if __name__ == "__main__":
     excel_file_path = "./OrdersToBeUpdated_statusmessages.xlsx"
     csv_mapping_path = "./All_SO_Data.csv"
-    process_excel_and_post(excel_file_path, csv_mapping_path)
+    journal_path = excel_file_path.replace(".xlsx", ".journal.jsonl")
+    resume = False  # True skips rows the journal records as done (after an interrupted run)
+    max_workers = 10  # Transports posted in parallel; rows of one transport stay in order
+    results_path = excel_file_path.replace(".xlsx", "_results.csv")
+    merge_output_path = None  # e.g. "./OrdersToBeUpdated_tmp_updated.xlsx" to copy the statuses into a workbook
+    metrics_path = excel_file_path.replace(".xlsx", ".metrics.json")  # Per-endpoint request timings of the run
+    prometheus_path = None  # e.g. "./editStatusMessages.prom" for a Prometheus textfile collector
+    process_excel_and_post(excel_file_path, csv_mapping_path, journal_path, resume, max_workers,
+                           results_path, merge_output_path, metrics_path, prometheus_path)
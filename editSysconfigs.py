@@ -1,8 +1,27 @@
-import openpyxl                                                     # type: ignore
-import requests                                                     # type: ignore
 from urllib.parse import quote_plus                                 # type: ignore
 from collections import defaultdict                                 # type: ignore
-from concurrent.futures import ThreadPoolExecutor, as_completed     # type: ignore
+from contextlib import nullcontext                                  # type: ignore
+from concurrent.futures import ThreadPoolExecutor                   # type: ignore
+import workQueue
+import lookupReader
+import resultSink
+import concurrencyControl
+import retryPolicy
+import httpTransport
+import checkpointJournal
+import requestMetrics
+import rateLimit
+import serverPool
+import authBreaker
+import sessionCache
+import htmlExtract
+import pageCache
+
+# Retry policy per endpoint. Sysconfig pages set absolute values, so posting a
+# page again leaves the same settings in place.
+RETRY_POLICIES = {
+    "/MercuryGate/enterprise/": retryPolicy.IDEMPOTENT,
+}
 
 # --- Helpers ---
 
@@ -19,45 +38,74 @@ def encode_sid(enterprise_oid):
     return quote_plus(f"({enterprise_oid},3640,0)")
 
 def group_settings_by_page(sheet):
-    """Group setting changes by page name for batch POST requests."""
+    """
+    Group setting changes by page name for batch POST requests. A setting
+    listed more than once keeps its last value. Returns (grouped, page_rows,
+    rows read, duplicate settings); page_rows maps each page to the
+    (workbook row, setting) pairs it was grouped from.
+    """
     grouped = defaultdict(dict)
-    header = [cell.value for cell in sheet[1]]
+    page_rows = defaultdict(list)
+    rows = duplicates = 0
+    header = lookupReader.read_header(sheet)
     page_idx = header.index("page")
     setting_idx = header.index("setting")
     value_idx = header.index("value")
 
-    for row in sheet.iter_rows(min_row=2, values_only=True):
+    for row_number, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
         # Stop if any required field is missing (first empty row)
         if not row[page_idx] or not row[setting_idx] or not row[value_idx]:
             break
         page = str(row[page_idx]).strip()
         setting = str(row[setting_idx]).strip()
         value = str(row[value_idx]).strip()
+        rows += 1
+        duplicates += setting in grouped[page]
         grouped[page][setting] = value
-    return grouped
-
-def ensure_status_column(sheet):
-    """Add a Status column to the sheet if missing and return its index."""
-    header = [cell.value for cell in sheet[1]]
-    if "Status" in header:
-        return header.index("Status") + 1
-    col = len(header) + 1
-    sheet.cell(row=1, column=col, value="Status")
-    return col
-
-def prime_session(session, primary_server):
+        page_rows[page].append((row_number, setting))
+    return grouped, page_rows, rows, duplicates
+
+def journal_key(page, settings):
+    """Identity of a page in the checkpoint journal, including the values it sets."""
+    return page + "|" + "&".join(f"{k}={v}" for k, v in sorted(settings.items()))
+
+def prime_session(session, base_url, connections=1, session_cache=None):
     """Make a priming GET request to warm up the session."""
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/enterprise/editEnterpriseSysConMisc.jsp"
+    url = f"{base_url}/MercuryGate/enterprise/editEnterpriseSysConMisc.jsp"
+    # Skipped while an earlier run primed this server recently (session_cache).
+    if session_cache is None or not session_cache.primed(base_url):
+        try:
+            resp = session.get(url, timeout=10)
+            print("Priming GET status:", resp.status_code)
+            if session_cache is not None and resp.status_code == 200:
+                session_cache.store(base_url)
+        except Exception as e:
+            print("Error during priming GET:", e)
+    # Open the rest of the pool's connections now so the workers start warm.
+    if connections > 1:
+        httpTransport.prewarm(session, url, connections)
+
+def read_current_settings(page, settings, sidEnterprise, base_url, session, cache):
+    """
+    Diff mode: read the page's form (editEnterprise*.jsp for its _process page)
+    and return the current values of the given settings. Settings the page
+    does not show are missing from the result; if the page cannot be read the
+    result is empty, so every setting is posted.
+    """
+    url = f"{base_url}/MercuryGate/enterprise/{page.replace('_process', '')}?sidEnterprise={sidEnterprise}"
+    def fetch():
+        resp = session.get(url, timeout=15)
+        return resp.text if resp.status_code == 200 else ""
     try:
-        resp = session.get(url, timeout=10)
-        print("Priming GET status:", resp.status_code)
-    except Exception as e:
-        print("Error during priming GET:", e)
+        html_text = cache.get(url, fetch)
+    except Exception:
+        return {}
+    return htmlExtract.extract_form_values(html_text, settings)
 
-def post_settings(page, settings, sidEnterprise, config, primary_server):
+def post_settings(page, settings, sidEnterprise, config, base_url, session):
     """Send a single POST request for one settings page with all its settings."""
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/enterprise/{page}"
-    referer_url = f"https://{primary_server}.mercurygate.net/MercuryGate/enterprise/{page.replace('_process', '')}"
+    url = f"{base_url}/MercuryGate/enterprise/{page}"
+    referer_url = f"{base_url}/MercuryGate/enterprise/{page.replace('_process', '')}"
 
     # Build raw form body
     form_items = [f"sidEnterprise={sidEnterprise}"] + [f"{k}={v}" for k, v in settings.items()]
@@ -79,12 +127,12 @@ def post_settings(page, settings, sidEnterprise, config, primary_server):
         "upgrade-insecure-requests": "1",
         "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
         "referer": referer_url,
-        "origin": f"https://{primary_server}.mercurygate.net",
+        "origin": base_url,
         "cookie": config["AUTH_COOKIE"]
     }
 
     try:
-        resp = requests.post(url, data=body_str, headers=headers, timeout=15)
+        resp = session.post(url, data=body_str, headers=headers, timeout=15)
         if resp.status_code == 200:
             return "200 - OK"
         else:
@@ -93,9 +141,11 @@ def post_settings(page, settings, sidEnterprise, config, primary_server):
         return f"Error: {str(e)}"
 
 # --- Main Processing ---
-def process_sysconfigs(excel_path, max_workers=10):
+def process_sysconfigs(excel_path, max_workers=10, adaptive=False, journal_path=None, resume=False,
+                       results_path=None, merge_output_path=None, metrics_path=None, prometheus_path=None,
+                       diff_mode=False):
     """Main entry point for processing sysconfig updates from Excel file."""
-    wb = openpyxl.load_workbook(excel_path)
+    wb = lookupReader.open_workbook_readonly(excel_path)
     config = load_config(wb["config"])
     lookup_sheet = wb["lookup"]
 
@@ -105,43 +155,123 @@ def process_sysconfigs(excel_path, max_workers=10):
             raise ValueError(f"Missing required config key: {k}")
 
     primary_server = config["PRIMARY_SERVER"]
+    # BASE_URL (optional) points the script at another host, e.g. the local mock server.
+    base_url = config.get("BASE_URL", f"https://{primary_server}.mercurygate.net").rstrip("/")
     sidEnterprise = quote_plus(f"({config['ENTERPRISE']},3640,0)")
 
-    # Create a session for priming
-    session = requests.Session()
+    # Create a session for priming; it is also shared by the workers, with
+    # retrying adapters mounted for the sysconfig pages.
+    # Every HTTP call is timed per phase (DNS/connect/TLS/wait/transfer) and
+    # summarized per endpoint at the end of the run.
+    metrics = requestMetrics.RunMetrics("editSysconfigs")
+    # Requests to this server from every script running on this host share the
+    # optional RATE_LIMIT_* budget of the config sheet.
+    rate_limit = rateLimit.SharedRateLimit.from_config(config, base_url, "editSysconfigs")
+    # With SERVERS on the config sheet, requests are spread over the tenant's app servers.
+    servers = serverPool.ServerPool.from_config(config, base_url)
+    # Requests pause while AUTH_COOKIE is rejected and resume with a new one
+    # (from AUTH_COOKIE_FILE or a prompt).
+    auth = authBreaker.AuthBreaker.from_config(config)
+    # Priming is skipped when a recent run already did it (SESSION_CACHE_TTL).
+    session_cache = sessionCache.SessionCache.from_config(config)
+    # With adaptive=True, max_workers is the upper bound and the number of pages
+    # posted at once follows the server's latency and error rate; the limiter
+    # observes the session's requests inside the rate limit and auth breaker.
+    limiter = None
+    if adaptive:
+        limiter = concurrencyControl.AdaptiveLimit.from_config(config, max(1, max_workers // 2), max_workers)
+    session = httpTransport.create_session(retryPolicy.for_server(base_url, RETRY_POLICIES), max_workers, metrics, rate_limit,
+                                           servers, auth, limiter)
     session.headers.update({
         "User-Agent": "Mozilla/5.0",
         "Cookie": config["AUTH_COOKIE"]
     })
-    prime_session(session, primary_server)
+    serverPool.prime(servers, base_url, lambda url: prime_session(session, url, max_workers, session_cache))
 
     # Group settings per page and prepare for batch POSTing
-    grouped = group_settings_by_page(lookup_sheet)
-    status_col = ensure_status_column(lookup_sheet)
-
-    futures = {}
-    results = {}
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for page, settings in grouped.items():
-            futures[executor.submit(post_settings, page, settings, sidEnterprise, config, primary_server)] = page
-
-        for future in as_completed(futures):
-            page = futures[future]
-            results[page] = future.result()
-
-    # Record status back into Excel
-    for row in range(2, lookup_sheet.max_row + 1):
-        page_cell = lookup_sheet.cell(row=row, column=1).value
-        if not page_cell:
-            break
-        page = str(page_cell).strip()
-        status = results.get(page, "Not attempted")
-        lookup_sheet.cell(row=row, column=status_col, value=status)
+    grouped, page_rows, rows, duplicates = group_settings_by_page(lookup_sheet)
+    print(f"Coalesced {rows} rows into {len(grouped)} page POSTs ({duplicates} duplicate settings, "
+          f"last value wins), saving {rows - len(grouped)} requests.")
+
+    # In diff mode each page's form is read first (cached for the run) and only
+    # the settings whose value differs are posted; pages without changes are
+    # not posted at all.
+    cache = pageCache.PageCache() if diff_mode else None
+    unchanged = {}      # page -> settings that already had their value
+
+    def handle(item):
+        page, settings = item
+        if cache is not None:
+            current = read_current_settings(page, settings, sidEnterprise, base_url, session, cache)
+            unchanged[page] = {k for k, v in settings.items() if current.get(k) == v}
+            settings = {k: v for k, v in settings.items() if k not in unchanged[page]}
+            if not settings:
+                return page, "Unchanged"
+        return page, post_settings(page, settings, sidEnterprise, config, base_url, session)
+
+    # Every row's status is streamed to the results file as soon as its page
+    # is done, so a crash mid-run keeps the results of the finished pages.
+    results_path = results_path or excel_path.replace(".xlsx", "_results.csv")
+    sink = resultSink.ResultSink(results_path, "Status")
+    written = set()
+
+    def write_page(page, status):
+        for row, setting in page_rows[page]:
+            sink.write(row, "Unchanged" if setting in unchanged.get(page, ()) else status)
+            written.add(row)
+
+    # Pages completed in an earlier run keep their journaled status when resuming.
+    completed = checkpointJournal.load_completed(journal_path) if resume else {}
+    results = {page: completed[journal_key(page, settings)] for page, settings in grouped.items()
+               if journal_key(page, settings) in completed}
+    pending = [(page, settings) for page, settings in grouped.items() if page not in results]
+
+    window = limiter.current_limit if limiter else max_workers
+    try:
+        for page, status in results.items():
+            write_page(page, status)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            with checkpointJournal.CheckpointJournal(journal_path, resume) if journal_path else nullcontext() as journal:
+                for page, status in workQueue.bounded_map(executor, handle, pending, window):
+                    results[page] = status
+                    write_page(page, status)
+                    if journal:
+                        journal.record(journal_key(page, grouped[page]), status in ("200 - OK", "Unchanged"), status)
+
+        # Rows after the first incomplete one were not grouped and not posted.
+        header = lookupReader.read_header(lookup_sheet)
+        page_idx = header.index("page")
+        for row, values in enumerate(lookup_sheet.iter_rows(min_row=2, max_col=page_idx + 1, values_only=True), start=2):
+            if not values or not values[page_idx]:
+                break
+            if row not in written:
+                sink.write(row, "Not attempted")
+    finally:
+        sink.close()
+    wb.close()
+    print(f"Finished. Results written to {results_path}")
+    if cache is not None:
+        skipped = sum(len(settings) for settings in unchanged.values())
+        print(f"Diff mode: {skipped} settings already had their value, "
+              f"{sum(1 for status in results.values() if status == 'Unchanged')} pages not posted "
+              f"({cache.fetches} pages read).")
+    if rate_limit:
+        rate_limit.report()
+    if servers:
+        servers.report()
+    auth.report()
+    if session_cache:
+        session_cache.report()
+    metrics.report(metrics_path, prometheus_path)
 
-    # Save results
-    output_path = excel_path.replace(".xlsx", "_updated.xlsx")
-    wb.save(output_path)
-    print(f"Finished. Results written to {output_path}")
+    if merge_output_path:
+        resultSink.merge_into_workbook(excel_path, results_path, merge_output_path, "Status")
 
 if __name__ == "__main__":
-    process_sysconfigs("./SysConfigUpdates.xlsx", max_workers=10)
+    # resume=True skips pages the journal records as done (after an interrupted run);
+    # set merge_output_path (e.g. "./SysConfigUpdates_updated.xlsx") to copy the statuses into a workbook
+    process_sysconfigs("./SysConfigUpdates.xlsx", max_workers=10, adaptive=True,
+                       journal_path="./SysConfigUpdates.journal.jsonl", resume=False,
+                       results_path="./SysConfigUpdates_results.csv", merge_output_path=None,
+                       metrics_path="./SysConfigUpdates.metrics.json", prometheus_path=None,
+                       diff_mode=False)   # True reads each page first and only posts settings that change
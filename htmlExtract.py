@@ -0,0 +1,113 @@
+import re                       # type: ignore
+from html import unescape       # type: ignore
+
+# --- Targeted HTML extractors ---
+#
+# The scripts only ever need a few values out of a response page: the CSRF
+# token from <meta name="_csrf">, the result message of adminConsole.jsp or the
+# current value of the form fields they are about to post. Building a
+# full BeautifulSoup tree for that costs far more CPU (under the GIL) than the
+# request itself at high concurrency. These scanners use precompiled regexes,
+# look only at the tags they care about and stop at the first match.
+# benchmarks/benchHtmlExtract.py compares them with the bs4 implementation.
+
+META_TAG = re.compile(r"<meta\b[^>]*>", re.IGNORECASE)
+TAG_ATTR = re.compile(r"""([^\s"'=<>/]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+ADMIN_MARKER = "displayWindow('Results', message);"
+ADMIN_MESSAGE = re.compile(r"var message = '(.*?)';", re.DOTALL)
+SCRIPT_OPEN = re.compile(r"<script\b[^>]*>", re.IGNORECASE)
+SCRIPT_CLOSE = re.compile(r"</script\s*>", re.IGNORECASE)
+FORM_FIELD = re.compile(r"<(input|select|textarea)\b[^>]*>", re.IGNORECASE)
+SELECT_CLOSE = re.compile(r"</select\s*>", re.IGNORECASE)
+TEXTAREA_CLOSE = re.compile(r"</textarea\s*>", re.IGNORECASE)
+OPTION_TAG = re.compile(r"<option\b[^>]*>", re.IGNORECASE)
+CHECKED = re.compile(r"\schecked\b", re.IGNORECASE)
+SELECTED = re.compile(r"\sselected\b", re.IGNORECASE)
+
+def tag_attributes(tag):
+    """Parse the attributes of a single start tag into a dict (names lower-cased, values unescaped)."""
+    attrs = {}
+    for match in TAG_ATTR.finditer(tag):
+        value = next(v for v in match.groups()[1:] if v is not None)
+        attrs.setdefault(match.group(1).lower(), unescape(value))
+    return attrs
+
+def extract_meta_content(html_text, name):
+    """Return the content attribute of the first <meta name=...> tag, or None."""
+    for match in META_TAG.finditer(html_text):
+        tag = match.group(0)
+        if name not in tag:
+            continue
+        attrs = tag_attributes(tag)
+        if attrs.get("name") == name and "content" in attrs:
+            return attrs["content"]
+    return None
+
+def extract_csrf_token(html_text):
+    """Return the CSRF token from <meta name="_csrf" content="...">, or None."""
+    return extract_meta_content(html_text, "_csrf")
+
+def iter_scripts(html_text, start=0):
+    """Yield the text of every <script> element from position start on."""
+    while True:
+        opening = SCRIPT_OPEN.search(html_text, start)
+        if not opening:
+            return
+        closing = SCRIPT_CLOSE.search(html_text, opening.end())
+        end = closing.start() if closing else len(html_text)
+        yield html_text[opening.end():end]
+        start = closing.end() if closing else len(html_text)
+
+def extract_admin_message(html_text):
+    """
+    Return the 'var message' of the adminConsole.jsp script that shows the
+    results window, or None. Only scripts after the first marker are scanned.
+    """
+    marker = html_text.find(ADMIN_MARKER)
+    if marker < 0:
+        return None
+    # Start at the script that encloses the first marker.
+    start = max(html_text.rfind("<script", 0, marker), html_text.rfind("<SCRIPT", 0, marker))
+    for script in iter_scripts(html_text, max(start, 0)):
+        if ADMIN_MARKER in script:
+            match = ADMIN_MESSAGE.search(script)
+            if match:
+                return match.group(1).replace("\\n", "\n")
+    return None
+
+def extract_form_values(html_text, names):
+    """
+    Return {name: current value} for the form fields in names, as the browser
+    would submit them: an input's value ("" for an unchecked checkbox or
+    radio), the selected option of a select (else its first option) and a
+    textarea's text. Fields not on the page are left out. Tags whose text does
+    not mention a wanted name are skipped without parsing.
+    """
+    wanted = set(names)
+    values = {}
+    for match in FORM_FIELD.finditer(html_text):
+        tag = match.group(0)
+        if not any(name in tag for name in wanted):
+            continue
+        attrs = tag_attributes(tag)
+        name = attrs.get("name")
+        if name not in wanted:
+            continue
+        kind = match.group(1).lower()
+        if kind == "input":
+            if attrs.get("type", "").lower() in ("checkbox", "radio"):
+                if CHECKED.search(tag):
+                    values[name] = attrs.get("value", "on")
+                else:
+                    values.setdefault(name, "")
+            else:
+                values[name] = attrs.get("value", "")
+        elif kind == "textarea":
+            closing = TEXTAREA_CLOSE.search(html_text, match.end())
+            values[name] = unescape(html_text[match.end():closing.start() if closing else len(html_text)])
+        else:
+            closing = SELECT_CLOSE.search(html_text, match.end())
+            options = [o.group(0) for o in OPTION_TAG.finditer(html_text, match.end(), closing.start() if closing else len(html_text))]
+            selected = next((o for o in options if SELECTED.search(o)), options[0] if options else None)
+            values[name] = tag_attributes(selected).get("value", "") if selected else ""
+    return values
@@ -0,0 +1,107 @@
+import socket                   # type: ignore
+import time                     # type: ignore
+from concurrent.futures import ThreadPoolExecutor   # type: ignore
+from urllib.parse import urlsplit                   # type: ignore
+import requests                 # type: ignore
+from requests.adapters import HTTPAdapter           # type: ignore
+from urllib3.connection import HTTPConnection       # type: ignore
+import retryPolicy
+
+# --- Shared HTTP transport ---
+#
+# Most of the latency to a hosted tenant is TCP and TLS handshakes, so every
+# script builds its session the same way:
+#   - the connection pool holds one connection per worker, so connections are
+#     never discarded and reopened because the pool is full (urllib3 keeps 10
+#     by default);
+#   - pooled connections are kept alive (HTTP keep-alive plus TCP keep-alive
+#     probes, so idle connections survive firewalls and NAT timeouts);
+#   - after priming, prewarm() opens the pool's connections in parallel, so the
+#     handshakes are done before the burst of rows starts.
+
+# urllib3's defaults (TCP_NODELAY) plus TCP keep-alive probes.
+SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections send TCP keep-alive probes."""
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault("socket_options", SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+
+def create_session(policies, workers, metrics=None, rate_limit=None, servers=None, auth=None, limiter=None):
+    """
+    Session with retrying keep-alive adapters for the {url prefix: RetryPolicy}
+    map, pooling one connection per worker. metrics (requestMetrics.RunMetrics)
+    is attached before any connection is opened; rate_limit
+    (rateLimit.SharedRateLimit) throttles every request, outside the timings.
+    servers (serverPool.ServerPool) spreads the requests over its servers,
+    each with the same adapters and a pool of its own. auth
+    (authBreaker.AuthBreaker) holds all requests while the cookie is rejected.
+    limiter (concurrencyControl.AdaptiveLimit) observes every request inside
+    rate_limit and auth, so its latencies never include their waits.
+    """
+    session = requests.Session()
+    if servers is not None:
+        policies = servers.policies(policies)
+    retryPolicy.mount(session, policies, max(1, workers), KeepAliveAdapter)
+    if servers is not None:
+        servers.attach(session)
+    if metrics is not None:
+        metrics.attach(session)
+    if limiter is not None:
+        limiter.attach(session)
+    if rate_limit is not None:
+        rate_limit.attach(session)
+    if auth is not None:
+        auth.attach(session)
+    return session
+
+def share_transport(session, source):
+    """Let session use the adapters (and so the warm connection pool) of source."""
+    for prefix, adapter in source.adapters.items():
+        session.mount(prefix, adapter)
+    return session
+
+def _connection_pool(session, url):
+    adapter = session.get_adapter(url)
+    if hasattr(adapter, "get_connection_with_tls_context"):
+        pool = adapter.get_connection_with_tls_context(requests.Request("GET", url).prepare(), session.verify,
+                                                       cert=session.cert)
+    else:
+        pool = adapter.get_connection(url)
+    # Same certificate settings requests applies before sending.
+    adapter.cert_verify(pool, url, session.verify, session.cert)
+    return pool
+
+def prewarm(session, url, connections, timeout=10):
+    """
+    Open up to `connections` connections to url's host in parallel (TCP + TLS,
+    no HTTP request) and leave them idle in the session's pool.
+    """
+    pool = _connection_pool(session, url)
+    count = min(connections, pool.pool.maxsize)
+    if count < 1:
+        return 0
+    start = time.monotonic()
+    conns = [pool._get_conn() for _ in range(count)]
+
+    def open_connection(conn):
+        if conn.sock is not None:
+            return True     # already connected (e.g. by the priming request)
+        conn.timeout = timeout
+        try:
+            conn.connect()
+            return True
+        except Exception:
+            conn.close()
+            return False
+
+    try:
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            opened = sum(executor.map(open_connection, conns))
+    finally:
+        for conn in conns:
+            pool._put_conn(conn)
+    print(f"Pre-warmed {opened}/{count} connections to {urlsplit(url).netloc} "
+          f"in {(time.monotonic() - start) * 1000:.0f} ms")
+    return opened
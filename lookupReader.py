@@ -0,0 +1,35 @@
+import openpyxl                 # type: ignore
+
+# --- Streaming lookup sheet reader ---
+#
+# load_workbook(excel_path) in edit mode parses and keeps every cell of the
+# workbook before the first request goes out. In read-only mode openpyxl parses
+# the sheet XML lazily, so rows can be handed to the workers as they are read
+# and only the columns a script actually uses are kept.
+
+def open_workbook_readonly(excel_path):
+    """Open the workbook in read-only (streaming) mode. Call wb.close() when done."""
+    return openpyxl.load_workbook(excel_path, read_only=True)
+
+def read_header(sheet):
+    """Return the header row of a sheet as a list of values."""
+    for row in sheet.iter_rows(min_row=1, max_row=1, values_only=True):
+        return list(row)
+    return []
+
+def iter_lookup_rows(sheet, columns, stop_column):
+    """
+    Stream the rows of a lookup sheet as (row_number, row_dict) tuples.
+    row_dict only holds the projected columns that exist in the header, so
+    row_dict.get() behaves as it does for a full header row. Iteration stops
+    at the first row with a blank stop_column.
+    """
+    header = read_header(sheet)
+    projection = [(col, header.index(col)) for col in columns if col in header]
+    max_col = max(pos for _, pos in projection) + 1 if projection else 1
+
+    for row_number, row in enumerate(sheet.iter_rows(min_row=2, max_col=max_col, values_only=True), start=2):
+        row_dict = {col: row[pos] if pos < len(row) else None for col, pos in projection}
+        if not row_dict.get(stop_column):
+            break
+        yield row_number, row_dict
@@ -0,0 +1,154 @@
+import csv                      # type: ignore
+import hashlib                  # type: ignore
+import os                       # type: ignore
+import sqlite3                  # type: ignore
+import tempfile                 # type: ignore
+import threading                # type: ignore
+
+# --- Indexed transport_id -> transport_order_id mapping ---
+#
+# Parsing All_SO_Data.csv with csv.DictReader on every run costs more than the
+# rest of startup combined once the export reaches millions of lines. The CSV
+# is instead loaded once into an SQLite file next to it, keyed by transport_id
+# and holding the already formatted transport order id. The index records the
+# CSV's size and mtime (and optionally its SHA-256) plus the suffix used for
+# formatting, and is rebuilt only when one of them changes.
+
+INDEX_VERSION = "1"
+
+def format_transport_order_id(mapping_value, suffix):
+    """
+    If mapping value doesn't contain a comma, assume it is the base value and append the suffix.
+    """
+    if "," not in mapping_value:
+        formatted = f"({mapping_value}{suffix})"
+    else:
+        if not mapping_value.startswith("("):
+            formatted = f"({mapping_value})"
+        else:
+            formatted = mapping_value
+    return formatted
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def source_signature(csv_path, suffix, verify_hash=False):
+    stat = os.stat(csv_path)
+    signature = {
+        "version": INDEX_VERSION,
+        "size": str(stat.st_size),
+        "mtime_ns": str(stat.st_mtime_ns),
+        "suffix": suffix,
+    }
+    if verify_hash:
+        signature["sha256"] = file_sha256(csv_path)
+    return signature
+
+def read_signature(index_path):
+    try:
+        conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+        try:
+            return dict(conn.execute("SELECT key, value FROM meta"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+def build_index(csv_path, index_path, signature, batch_size=50000):
+    """Parse the CSV once and write the index to a temp file, then swap it in."""
+    # A temp file of its own, so runs building the same index at once (other
+    # hosts on a shared drive, back-to-back runs) never swap in each other's.
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(index_path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(index_path)))
+    os.close(fd)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("CREATE TABLE mapping (transport_id TEXT PRIMARY KEY, transport_order_id TEXT NOT NULL) WITHOUT ROWID")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        suffix = signature["suffix"]
+        batch = []
+        with open(csv_path, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
+                tid = row.get("transport_id")
+                toid = row.get("transport_order_id")
+                if tid and toid:
+                    batch.append((tid.strip(), format_transport_order_id(toid.strip(), suffix)))
+                if len(batch) >= batch_size:
+                    conn.executemany("INSERT OR REPLACE INTO mapping VALUES (?, ?)", batch)
+                    batch = []
+        conn.executemany("INSERT OR REPLACE INTO mapping VALUES (?, ?)", batch)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", signature.items())
+        conn.execute("INSERT INTO meta SELECT 'rows', COUNT(*) FROM mapping")
+        conn.commit()
+        conn.close()
+        os.chmod(tmp_path, 0o644)     # mkstemp files are private; the index is not
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class MappingIndex:
+    """
+    Read-only, thread-safe view of an index file with a dict-like get().
+    Values are already formatted transport order ids.
+    """
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._local = threading.local()
+        self._count = int(self._conn().execute("SELECT value FROM meta WHERE key = 'rows'").fetchone()[0])
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def get(self, transport_id, default=None):
+        row = self._conn().execute(
+            "SELECT transport_order_id FROM mapping WHERE transport_id = ?", (transport_id,)
+        ).fetchone()
+        return row[0] if row else default
+
+    def get_many(self, transport_ids, chunk_size=500):
+        """Look up many transport IDs in batches; returns {transport_id: transport_order_id} for those found."""
+        ids = list(dict.fromkeys(transport_ids))
+        found = {}
+        conn = self._conn()
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(conn.execute(
+                f"SELECT transport_id, transport_order_id FROM mapping WHERE transport_id IN ({placeholders})", chunk
+            ))
+        return found
+
+    def __contains__(self, transport_id):
+        return self.get(transport_id) is not None
+
+    def __len__(self):
+        return self._count
+
+def load_mapping_index(csv_path, suffix, index_path=None, verify_hash=False):
+    """
+    Return a MappingIndex for csv_path, building or rebuilding the index file
+    (default: <csv_path>.idx.sqlite) when the CSV or the suffix changed.
+    """
+    index_path = index_path or csv_path + ".idx.sqlite"
+    signature = source_signature(csv_path, suffix, verify_hash)
+    meta = read_signature(index_path) or {}
+    if any(meta.get(key) != value for key, value in signature.items()):
+        print(f"Building mapping index {index_path} from {csv_path}...")
+        build_index(csv_path, index_path, signature)
+    index = MappingIndex(index_path)
+    print(f"Loaded mapping for {len(index)} transport IDs from {index_path}.")
+    return index
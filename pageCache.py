@@ -0,0 +1,66 @@
+import asyncio                  # type: ignore
+import threading                # type: ignore
+
+# --- Per-run page cache ---
+#
+# Diff mode reads the current state of an object before deciding whether to
+# post. Several rows can point at the same page (e.g. settings of one sysconfig
+# page), so fetched values are cached for the rest of the run. Lookups are
+# single-flight: concurrent workers asking for the same key wait for the one
+# fetch in progress instead of requesting the page again. Failed fetches are
+# not cached.
+
+class PageCache:
+    """
+    Thread-safe cache of fetched page values for one run.
+    get(key, fetch) serves threads, get_async(key, fetch) coroutines;
+    fetch() (or await fetch()) returns the value to cache.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._pending = {}          # key -> Event of the fetch in progress
+        self._tasks = {}            # key -> asyncio future (asyncio backend)
+        self.hits = 0
+        self.fetches = 0
+
+    def get(self, key, fetch):
+        while True:
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    return self._values[key]
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    self.fetches += 1
+                    break
+            event.wait()    # another thread is fetching key; re-check once it is done
+        try:
+            value = fetch()
+            with self._lock:
+                self._values[key] = value
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    async def get_async(self, key, fetch):
+        if key in self._values:
+            self.hits += 1
+            return self._values[key]
+        task = self._tasks.get(key)
+        if task is None:
+            self.fetches += 1
+            task = self._tasks[key] = asyncio.ensure_future(fetch())
+        else:
+            self.hits += 1
+        try:
+            value = await asyncio.shield(task)
+        except Exception:
+            self._tasks.pop(key, None)
+            raise
+        self._values[key] = value
+        self._tasks.pop(key, None)
+        return value
@@ -0,0 +1,77 @@
+import csv                      # type: ignore
+from collections import Counter # type: ignore
+import lookupReader
+
+# --- Preflight validation ---
+#
+# Rows that can never succeed (missing cost, unmapped transport_id, ...) used
+# to be found one at a time inside the workers, after the run had started.
+# A preflight pass reads the projected lookup columns once, resolves all
+# mapping keys in a few batched queries, and splits the sheet into clean rows
+# for the network stage and rejects, which are written to a report. Scripts
+# can keep the clean rows as indexes into the columns and build each row's
+# dict only when it is sent (rows_at), so a large sheet is never held as one
+# dict per row. The
+# validation rules themselves live in the scripts. Scripts whose updates are
+# idempotent also coalesce duplicate rows here, so each object is posted once.
+
+def read_columns(sheet, columns, stop_column):
+    """
+    Read the projected lookup columns into one list per column.
+    Returns (row_numbers, {column: [values]}); values are stripped strings
+    ("" for empty cells). Columns missing from the header come back all "".
+    """
+    row_numbers = []
+    data = {column: [] for column in columns}
+    for row_number, row in lookupReader.iter_lookup_rows(sheet, columns, stop_column):
+        row_numbers.append(row_number)
+        for column in columns:
+            value = row.get(column)
+            data[column].append("" if value is None else str(value).strip())
+    return row_numbers, data
+
+def row_at(row_numbers, columns, i):
+    """Row i of read_columns' result as {column: value}, with its workbook row number under "row"."""
+    row = {column: values[i] for column, values in columns.items()}
+    row["row"] = row_numbers[i]
+    return row
+
+def rows_at(row_numbers, columns, indexes):
+    """Yield the rows at indexes (see row_at), built one at a time."""
+    for i in indexes:
+        yield row_at(row_numbers, columns, i)
+
+def lookup_many(mapping, keys):
+    """Resolve many mapping keys at once; returns {key: value} for the keys found."""
+    keys = [key for key in dict.fromkeys(keys) if key]
+    if hasattr(mapping, "get_many"):
+        return mapping.get_many(keys)
+    return {key: mapping[key] for key in keys if key in mapping}
+
+def write_rejects(path, rejects, columns):
+    """Write (row_number, reason, row_dict) rejects as CSV: row, reason, then the lookup columns."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["row", "reason"] + list(columns))
+        for row_number, reason, row in rejects:
+            writer.writerow([row_number, reason] + [row.get(column, "") for column in columns])
+
+def report(total, clean, rejects, rejects_path=None):
+    """Print the preflight summary, grouping reject reasons (without per-row ids)."""
+    print(f"Preflight: {total} rows, {len(clean)} clean, {len(rejects)} rejected.")
+    reasons = Counter(reason.split(" for ")[0] for _, reason, _ in rejects)
+    for reason, count in reasons.most_common():
+        print(f"  {count:>7}  {reason}")
+    if rejects and rejects_path:
+        print(f"Rejected rows written to {rejects_path}")
+
+def coalesce(rows, key):
+    """
+    Collapse rows with the same key(row) into one, last write wins: the kept
+    row has the values of the last duplicate at the position of the first.
+    For idempotent updates only. Returns (rows, number of rows dropped).
+    """
+    latest = {}
+    for row in rows:
+        latest[key(row)] = row
+    return list(latest.values()), len(rows) - len(latest)
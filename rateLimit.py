@@ -0,0 +1,258 @@
+import asyncio                  # type: ignore
+import atexit                   # type: ignore
+import getpass                  # type: ignore
+import hashlib                  # type: ignore
+import json                     # type: ignore
+import os                       # type: ignore
+import tempfile                 # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+from datetime import datetime   # type: ignore
+from urllib.parse import urlsplit   # type: ignore
+
+try:
+    import fcntl                # type: ignore
+except ImportError:             # Windows: the limit then only holds within one process
+    fcntl = None
+
+# --- Shared rate limit ---
+#
+# Several scripts often run at the same time against one tenant, each sizing
+# its own pool. To keep their combined load under the tenant's ceiling, every
+# request first takes a slot from a token bucket kept in a small state file
+# per server (in the temp directory by default) and guarded by flock, so all
+# processes on the host draw from the same bucket. The bucket is run as GCRA
+# (a theoretical arrival time instead of a token count): taking a slot is a
+# single read-modify-write, and a refused caller is told how long to sleep.
+# Slots are never booked ahead, so a job with many waiting threads cannot
+# push the others back.
+#
+# Fair share: each job also has its own bucket at rate / n for the n jobs
+# active on the server. It is only enforced while another job is waiting for
+# a slot, so a job running alone (or next to jobs that use less than their
+# share) gets the whole rate, and competing jobs get equal parts.
+#
+# The state file is made writable for every user, so jobs of different users
+# share one bucket. Where another user's file cannot be opened (e.g. /tmp
+# with fs.protected_regular), a job falls back to a file of its own user and
+# the limit then only holds among that user's jobs; a RATE_LIMIT_DIR that is
+# not sticky avoids that.
+#
+# Configured with the optional config sheet keys RATE_LIMIT_RPS,
+# RATE_LIMIT_BURST, RATE_LIMIT_SCHEDULE and RATE_LIMIT_DIR (see from_config).
+
+class RateSchedule:
+    """
+    Requests/second and burst by local time of day. spec is a comma-separated
+    list of "HH:MM-HH:MM=RPS[/BURST]" windows (a window may wrap past
+    midnight, e.g. "19:00-06:00=20/40"); rps and burst apply outside them.
+    """
+    def __init__(self, rps, burst=None, spec=""):
+        self.default = (float(rps), float(burst or max(1.0, rps)))
+        self.windows = []
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            span, _, limits = part.partition("=")
+            start, _, end = span.partition("-")
+            window_rps, _, window_burst = limits.partition("/")
+            window_rps = float(window_rps)
+            self.windows.append((self._minutes(start), self._minutes(end),
+                                 (window_rps, float(window_burst or max(1.0, window_rps)))))
+        for rate, _ in [self.default] + [w[2] for w in self.windows]:
+            if rate <= 0:
+                raise ValueError(f"Rate limit must be positive: {rate}")
+
+    @staticmethod
+    def _minutes(hhmm):
+        hours, _, minutes = hhmm.strip().partition(":")
+        return int(hours) * 60 + int(minutes or 0)
+
+    def at(self, when=None):
+        """(rps, burst) in effect at datetime when (default: now)."""
+        when = when or datetime.now()
+        minute = when.hour * 60 + when.minute
+        for start, end, limits in self.windows:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return limits
+        return self.default
+
+class SharedRateLimit:
+    """
+    Host-wide token bucket for one server. acquire() (or acquire_async())
+    blocks until the job may send its next request; attach() does so for
+    every request of a requests session.
+    """
+    IDLE_AFTER = 2.0        # seconds without a request after which a job no longer counts for the fair share
+    FORGET_AFTER = 60.0     # seconds after which a job that made no request is dropped from the state
+
+    def __init__(self, server, schedule, job="run", state_dir=None):
+        self.server = server
+        self.schedule = schedule
+        self.job_name = job
+        digest = hashlib.sha1(server.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(state_dir or tempfile.gettempdir(), f"tms-ratelimit-{digest}.json")
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        self._registered = False
+        self.requests = 0
+        self.waited = 0.0
+
+    @classmethod
+    def from_config(cls, config, base_url, job="run"):
+        """
+        Limit built from the optional config sheet keys, or None when no limit
+        is configured: RATE_LIMIT_RPS (requests/second across all jobs on this
+        host), RATE_LIMIT_BURST (default: one second's worth),
+        RATE_LIMIT_SCHEDULE (time-of-day windows, see RateSchedule) and
+        RATE_LIMIT_DIR (where the shared state lives).
+        """
+        if "RATE_LIMIT_RPS" not in config:
+            return None
+        schedule = RateSchedule(float(config["RATE_LIMIT_RPS"]), config.get("RATE_LIMIT_BURST"),
+                                config.get("RATE_LIMIT_SCHEDULE", ""))
+        limit = cls(urlsplit(base_url).netloc, schedule, job, config.get("RATE_LIMIT_DIR"))
+        rps, burst = schedule.at()
+        print(f"Rate limit for {limit.server}: {rps:g} requests/s (burst {burst:g}), shared via {limit.path}")
+        return limit
+
+    @property
+    def job(self):
+        # Forked workers are jobs of their own.
+        return f"{self.job_name}:{os.getpid()}"
+
+    def _file(self):
+        # A descriptor inherited across fork shares its lock with the parent,
+        # so every process opens its own.
+        if self._fd is None or self._pid != os.getpid():
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            except PermissionError as e:
+                root, ext = os.path.splitext(self.path)
+                self.path = f"{root}-{getpass.getuser()}{ext}"
+                print(f"Cannot share the rate limit state of another user ({e}); "
+                      f"limiting this user's jobs only, via {self.path}")
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                os.fchmod(self._fd, 0o666)      # the umask applies to os.open's mode
+            except OSError:
+                pass                            # another user's file
+            self._pid = os.getpid()
+        return self._fd
+
+    def _locked_update(self, update):
+        fd = self._file()
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            raw = b""
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                raw += chunk
+            try:
+                state = json.loads(raw) if raw else {}
+            except ValueError:
+                state = {}      # torn or foreign file: start a fresh bucket
+            result = update(state)
+            data = json.dumps(state).encode("utf-8")
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, data)
+            os.ftruncate(fd, len(data))
+            return result
+        finally:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def try_acquire(self):
+        """
+        Take a slot for this job if one is free now. Returns 0 when the request
+        may be sent, otherwise the seconds to wait before asking again.
+        """
+        rps, burst = self.schedule.at()
+        interval = 1.0 / rps
+        job = self.job
+
+        def update(state):
+            now = time.time()
+            jobs = state.setdefault("jobs", {})
+            for name in [name for name, s in jobs.items() if now - s["seen"] > self.FORGET_AFTER]:
+                del jobs[name]
+            me = jobs.setdefault(job, {"tat": now, "retry_at": 0.0, "seen": now})
+            me["seen"] = now
+            active = sum(1 for s in jobs.values() if now - s["seen"] < self.IDLE_AFTER)
+            others_waiting = any(name != job and now < s["retry_at"] + interval for name, s in jobs.items())
+            # Shared bucket: rps with `burst` requests of tolerance. Job
+            # bucket: an equal share of both, enforced only while another job
+            # is waiting, so unused capacity is never left idle.
+            tolerance = (burst - 1) * interval
+            job_interval = interval * active
+            job_tolerance = max(0.0, burst / active - 1) * job_interval
+            need_shared = state.get("tat", now) - tolerance - now
+            need_job = me["tat"] - job_tolerance - now if others_waiting else 0.0
+            if need_shared <= 0 and need_job <= 0:
+                state["tat"] = max(state.get("tat", now), now) + interval
+                me["tat"] = max(me["tat"], now) + job_interval
+                me["retry_at"] = 0.0
+                return 0.0
+            wait = max(need_shared, min(need_job, interval), 0.001)
+            me["retry_at"] = now + wait
+            return wait
+
+        with self._lock:
+            if not self._registered:
+                atexit.register(self.release)
+                self._registered = True
+            return self._locked_update(update)
+
+    def acquire(self):
+        """Block until this job may send a request."""
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                break
+            time.sleep(wait)
+        self._count(time.monotonic() - start)
+
+    async def acquire_async(self):
+        """acquire() for the asyncio backend."""
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+        self._count(time.monotonic() - start)
+
+    def _count(self, waited):
+        with self._lock:
+            self.requests += 1
+            self.waited += waited
+
+    def release(self):
+        """Remove this job from the shared state so it no longer counts for the fair share."""
+        def update(state):
+            state.get("jobs", {}).pop(self.job, None)
+        try:
+            with self._lock:
+                self._locked_update(update)
+        except OSError:
+            pass
+
+    def attach(self, session):
+        """Throttle every request made through a requests session."""
+        request = session.request
+
+        def throttled_request(method, url, **kwargs):
+            self.acquire()
+            return request(method, url, **kwargs)
+
+        session.request = throttled_request
+        return session
+
+    def report(self):
+        print(f"Rate limit: {self.requests} requests to {self.server}, "
+              f"{self.waited:.1f}s of worker time spent waiting for the shared limit.")
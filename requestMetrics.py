@@ -0,0 +1,438 @@
+import json                     # type: ignore
+import os                       # type: ignore
+import socket                   # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+from bisect import bisect_left  # type: ignore
+from collections import Counter # type: ignore
+from urllib.parse import urlsplit   # type: ignore
+import requests                 # type: ignore
+from urllib3.connection import HTTPConnection, HTTPSConnection                  # type: ignore
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool      # type: ignore
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError          # type: ignore
+
+try:
+    import aiohttp              # type: ignore
+except ImportError:             # only needed to trace the asyncio backend
+    aiohttp = None
+
+# --- Per-request metrics ---
+#
+# Every HTTP call is split into phases so a slow run can be attributed to the
+# server, the network or the client:
+#
+#   dns       name resolution
+#   connect   TCP connect (asyncio backend: includes TLS)
+#   tls       TLS handshake (requests backend only)
+#   wait      request sent -> response headers received (server time + RTT)
+#   transfer  response headers -> body fully read
+#   overhead  everything else: retry backoff, waiting for a pooled connection,
+#             building the request, cookie handling
+#
+# For requests sessions the phases come from urllib3 connection classes that
+# stamp the current thread's timing record; for the asyncio backend from an
+# aiohttp TraceConfig. RunMetrics aggregates them per endpoint (url path) into
+# histograms, together with status codes, bytes and retries, and writes a JSON
+# summary and optionally a Prometheus text exposition file.
+
+PHASES = ("total", "dns", "connect", "tls", "wait", "transfer", "overhead")
+
+# Histogram bucket upper bounds in seconds.
+BUCKETS = (0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15,
+           0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0)
+
+_current = threading.local()
+
+def current_timing():
+    """Timing record of the request running on this thread, or None."""
+    return getattr(_current, "timing", None)
+
+def new_timing():
+    return {"dns": 0.0, "connect": 0.0, "tls": 0.0, "wait": 0.0, "attempts": 0,
+            "sent_at": None, "headers_at": None}
+
+class Histogram:
+    """Fixed-bucket latency histogram with approximate quantiles."""
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)     # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate the q-quantile by linear interpolation inside its bucket (clamped to min/max)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        estimate = self.max
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / n
+                break
+            seen += n
+        return min(self.max, max(self.min, estimate))
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "buckets": {str(bound): n for bound, n in zip(list(self.bounds) + ["+Inf"], self.counts)},
+        }
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "statuses": dict(self.statuses),
+            "errors": dict(self.errors),
+            "retries": self.retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "phases": {phase: histogram.to_dict() for phase, histogram in self.phases.items()},
+        }
+
+class StageStats:
+    """Queue wait and service time of one pipeline stage (see workQueue.staged_map)."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.wait = Histogram()
+        self.service = Histogram()
+
+    def to_dict(self, duration):
+        return {
+            "limit": self.limit,
+            "items": self.service.count,
+            # Share of the stage's slots that were busy over the run.
+            "utilization": round(self.service.sum / (self.limit * duration), 4) if duration > 0 else 0.0,
+            "wait": self.wait.to_dict(),
+            "service": self.service.to_dict(),
+        }
+
+# --- urllib3 instrumentation (requests backend) ---
+
+class TimedConnectionMixin:
+    """Stamps DNS, connect, TLS and wait times into the current thread's timing record."""
+    def _new_conn(self):
+        timing = current_timing()
+        start = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}")
+        resolved = time.perf_counter()
+        # Connect to the resolved addresses so the lookup is not repeated (and
+        # timed as connect) inside urllib3; SNI and Host still use self.host.
+        # Like socket.create_connection, a refused or timed-out address moves
+        # on to the next one (each gets the full connect timeout).
+        host = self._dns_host
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address[4][0]
+                try:
+                    conn = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        self._tcp_time = time.perf_counter() - start
+        if timing is not None:
+            timing["dns"] += resolved - start
+            timing["connect"] += time.perf_counter() - resolved
+        return conn
+
+    def request(self, *args, **kwargs):
+        result = super().request(*args, **kwargs)
+        self._sent_at = time.perf_counter()
+        return result
+
+    def request_chunked(self, *args, **kwargs):
+        result = super().request_chunked(*args, **kwargs)
+        self._sent_at = time.perf_counter()
+        return result
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timing = current_timing()
+        if timing is not None:
+            now = time.perf_counter()
+            timing["wait"] += now - getattr(self, "_sent_at", now)
+            timing["headers_at"] = now
+            timing["attempts"] += 1
+        return response
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        timing = current_timing()
+        self._tcp_time = 0.0
+        start = time.perf_counter()
+        super().connect()
+        if timing is not None:
+            timing["tls"] += time.perf_counter() - start - self._tcp_time
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class RunMetrics:
+    """
+    Thread-safe per-endpoint aggregation of request metrics for one run.
+    attach() instruments a requests session, trace_config() an aiohttp
+    session; report() prints a summary and writes the JSON / Prometheus files.
+    """
+    def __init__(self, name="run"):
+        self.name = name
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.stages = {}
+
+    def record(self, method, url, status=None, error=None, timings=None, total=0.0,
+               bytes_sent=0, bytes_received=0, retries=0):
+        endpoint = f"{method.upper()} {urlsplit(url).path}"
+        timings = timings or {}
+        phases = {phase: timings.get(phase, 0.0) for phase in ("dns", "connect", "tls", "wait", "transfer")}
+        phases["total"] = total
+        phases["overhead"] = max(0.0, total - sum(phases[p] for p in ("dns", "connect", "tls", "wait", "transfer")))
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.requests += 1
+            if status is not None:
+                stats.statuses[str(status)] += 1
+            if error is not None:
+                stats.errors[type(error).__name__] += 1
+            stats.retries += retries
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            for phase, value in phases.items():
+                stats.phases[phase].observe(value)
+
+    def attach(self, session):
+        """
+        Instrument a requests session: its adapters open timed connections and
+        every request is recorded. Call after mounting the adapters and before
+        the first request.
+        """
+        for adapter in session.adapters.values():
+            poolmanager = getattr(adapter, "poolmanager", None)
+            if poolmanager is not None:
+                poolmanager.pool_classes_by_scheme = {
+                    "http": TimedHTTPConnectionPool,
+                    "https": TimedHTTPSConnectionPool,
+                }
+        request = session.request
+
+        def measured_request(method, url, **kwargs):
+            timing = _current.timing = new_timing()
+            start = time.perf_counter()
+            try:
+                resp = request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.record(method, url, error=e, timings=timing, total=time.perf_counter() - start,
+                            retries=max(0, timing["attempts"] - 1))
+                raise
+            finally:
+                _current.timing = None
+            end = time.perf_counter()
+            if timing["headers_at"] is not None:
+                timing["transfer"] = end - timing["headers_at"]
+            history = getattr(getattr(resp.raw, "retries", None), "history", None)
+            retries = len(history) if history is not None else max(0, timing["attempts"] - 1)
+            body = resp.request.body
+            self.record(method, url, status=resp.status_code, timings=timing, total=end - start,
+                        bytes_sent=len(body) if body else 0, bytes_received=len(resp.content), retries=retries)
+            return resp
+
+        session.request = measured_request
+        return session
+
+    def trace_config(self):
+        """
+        aiohttp TraceConfig filling the timing dict passed as trace_request_ctx
+        (see asyncEngine.AsyncClient). TLS is part of connect there.
+        """
+        if aiohttp is None:
+            raise RuntimeError("Tracing the asyncio backend requires aiohttp (pip install aiohttp).")
+
+        def stamp(handler):
+            async def callback(session, context, params):
+                timing = context.trace_request_ctx
+                if isinstance(timing, dict):
+                    handler(timing, time.perf_counter())
+            return callback
+
+        def dns_start(timing, now):
+            timing["dns_start"] = now
+
+        def dns_end(timing, now):
+            timing["dns"] += now - timing.pop("dns_start", now)
+
+        def connect_start(timing, now):
+            timing["connect_start"] = now
+            timing["dns_before_connect"] = timing["dns"]
+
+        def connect_end(timing, now):
+            # DNS is resolved inside connection creation; count it only once.
+            dns = timing["dns"] - timing.pop("dns_before_connect", timing["dns"])
+            timing["connect"] += now - timing.pop("connect_start", now) - dns
+
+        def sent(timing, now):
+            timing["sent_at"] = now
+
+        def headers_received(timing, now):
+            timing["wait"] += now - (timing["sent_at"] or now)
+            timing["headers_at"] = now
+            timing["attempts"] += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_dns_resolvehost_start.append(stamp(dns_start))
+        trace.on_dns_resolvehost_end.append(stamp(dns_end))
+        trace.on_connection_create_start.append(stamp(connect_start))
+        trace.on_connection_create_end.append(stamp(connect_end))
+        trace.on_request_headers_sent.append(stamp(sent))
+        trace.on_request_chunk_sent.append(stamp(sent))
+        trace.on_request_end.append(stamp(headers_received))
+        return trace
+
+    def add_stage(self, name, limit):
+        """Register a pipeline stage; its timings are recorded with record_stage()."""
+        with self._lock:
+            self.stages[name] = StageStats(limit)
+
+    def record_stage(self, name, wait, service):
+        """Record one item of a pipeline stage: time queued for a slot and time spent in the stage."""
+        with self._lock:
+            stats = self.stages[name]
+            stats.wait.observe(wait)
+            stats.service.observe(service)
+
+    def summary(self):
+        duration = time.perf_counter() - self._start
+        with self._lock:
+            endpoints = {name: stats.to_dict() for name, stats in sorted(self.endpoints.items())}
+            stages = {name: stats.to_dict(duration) for name, stats in self.stages.items()}
+        summary = {
+            "run": self.name,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "duration_seconds": round(duration, 3),
+            "requests": sum(e["requests"] for e in endpoints.values()),
+            "retries": sum(e["retries"] for e in endpoints.values()),
+            "endpoints": endpoints,
+        }
+        if stages:
+            summary["stages"] = stages
+        return summary
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.summary(), indent=2))
+
+    def write_prometheus(self, path):
+        """Write the metrics in the Prometheus text exposition format (e.g. for node_exporter's textfile collector)."""
+        summary = self.summary()
+        run = summary["run"]
+        lines = [
+            "# HELP tms_http_requests_total HTTP requests by endpoint and status.",
+            "# TYPE tms_http_requests_total counter",
+        ]
+        for endpoint, stats in summary["endpoints"].items():
+            for status, n in stats["statuses"].items():
+                lines.append(f'tms_http_requests_total{{run="{run}",endpoint="{endpoint}",status="{status}"}} {n}')
+            for error, n in stats["errors"].items():
+                lines.append(f'tms_http_requests_total{{run="{run}",endpoint="{endpoint}",status="{error}"}} {n}')
+        for metric, key, help_text in (
+            ("tms_http_retries_total", "retries", "Retried HTTP attempts."),
+            ("tms_http_sent_bytes_total", "bytes_sent", "Request body bytes sent."),
+            ("tms_http_received_bytes_total", "bytes_received", "Response body bytes received."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for endpoint, stats in summary["endpoints"].items():
+                lines.append(f'{metric}{{run="{run}",endpoint="{endpoint}"}} {stats[key]}')
+        lines += [
+            "# HELP tms_http_phase_seconds Time spent per request phase.",
+            "# TYPE tms_http_phase_seconds histogram",
+        ]
+        for endpoint, stats in summary["endpoints"].items():
+            for phase, histogram in stats["phases"].items():
+                labels = f'run="{run}",endpoint="{endpoint}",phase="{phase}"'
+                cumulative = 0
+                for bound, n in histogram["buckets"].items():
+                    cumulative += n
+                    lines.append(f'tms_http_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"tms_http_phase_seconds_sum{{{labels}}} {histogram['sum']}")
+                lines.append(f"tms_http_phase_seconds_count{{{labels}}} {histogram['count']}")
+        if "stages" in summary:
+            lines += [
+                "# HELP tms_stage_seconds Time items spent queued for a pipeline stage (wait) and in it (service).",
+                "# TYPE tms_stage_seconds summary",
+            ]
+            for stage, stats in summary["stages"].items():
+                for kind in ("wait", "service"):
+                    labels = f'run="{run}",stage="{stage}",kind="{kind}"'
+                    lines.append(f"tms_stage_seconds_sum{{{labels}}} {stats[kind]['sum']}")
+                    lines.append(f"tms_stage_seconds_count{{{labels}}} {stats[kind]['count']}")
+        write_atomic(path, "\n".join(lines) + "\n")
+
+    def report(self, json_path=None, prometheus_path=None):
+        """Print one line per endpoint and write the requested metric files."""
+        summary = self.summary()
+        for endpoint, stats in summary["endpoints"].items():
+            phases = stats["phases"]
+            statuses = ", ".join(f"{s}: {n}" for s, n in sorted(stats["statuses"].items()))
+            errors = sum(stats["errors"].values())
+            print(f"{endpoint}: {stats['requests']} requests ({statuses}{', errors: ' + str(errors) if errors else ''}), "
+                  f"{stats['retries']} retries | p50 {phases['total']['p50'] * 1000:.0f} ms, "
+                  f"p95 {phases['total']['p95'] * 1000:.0f} ms "
+                  f"(wait {phases['wait']['p95'] * 1000:.0f}, connect {phases['connect']['p95'] * 1000:.0f}, "
+                  f"transfer {phases['transfer']['p95'] * 1000:.0f}, overhead {phases['overhead']['p95'] * 1000:.0f})")
+        # The busiest stage with the longest queue wait is the bottleneck.
+        for stage, stats in summary.get("stages", {}).items():
+            print(f"Stage {stage}: {stats['items']} items, limit {stats['limit']}, {stats['utilization']:.0%} busy | "
+                  f"queued p50 {stats['wait']['p50'] * 1000:.0f} ms, p95 {stats['wait']['p95'] * 1000:.0f} ms | "
+                  f"in stage p50 {stats['service']['p50'] * 1000:.0f} ms, p95 {stats['service']['p95'] * 1000:.0f} ms")
+        if json_path:
+            self.write_json(json_path)
+            print(f"Request metrics written to {json_path}")
+        if prometheus_path:
+            self.write_prometheus(prometheus_path)
+            print(f"Prometheus metrics written to {prometheus_path}")
+
+def write_atomic(path, text):
+    """Write via a temp file so readers (e.g. a metrics scraper) never see a partial file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,82 @@
+import csv                      # type: ignore
+import json                     # type: ignore
+import threading                # type: ignore
+import openpyxl                 # type: ignore
+
+# --- Streaming result sink ---
+#
+# Instead of writing every outcome into the loaded workbook and re-serializing
+# the whole file with wb.save at the end, results are appended to a companion
+# CSV or JSON-lines file as they arrive (one line per row: row number and
+# result). Writing costs are proportional to the number of results and nothing
+# is lost on a crash. merge_into_workbook optionally copies the results back
+# into a copy of the source workbook afterwards.
+
+class ResultSink:
+    """Line-buffered writer of (row number, result) pairs; format follows the file extension."""
+    def __init__(self, path, column="Status"):
+        self.path = path
+        self.column = column
+        self.jsonl = path.endswith(".jsonl")
+        # buffering=1 flushes every line to the OS as soon as it is written.
+        self._file = open(path, "w", newline="", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+        self._writer = None
+        if not self.jsonl:
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["row", column])
+        self.count = 0
+
+    def write(self, row_number, result):
+        with self._lock:
+            if self.jsonl:
+                self._file.write(json.dumps({"row": row_number, self.column: result}, ensure_ascii=False) + "\n")
+            else:
+                self._writer.writerow([row_number, result])
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def read_results(path, column="Status"):
+    """Yield (row number, result) pairs from a sink file written by ResultSink."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                yield int(entry["row"]), entry.get(column)
+        else:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 2:
+                    yield int(row[0]), row[1]
+
+def merge_into_workbook(excel_path, sink_path, output_path, column="Status", sheet_name="lookup"):
+    """
+    Copy the results of a sink file into the column of the source workbook's
+    lookup sheet (created if missing) and save it as output_path.
+    """
+    wb = openpyxl.load_workbook(excel_path)
+    sheet = wb[sheet_name]
+    header = [cell.value for cell in sheet[1]]
+    if column in header:
+        col = header.index(column) + 1
+    else:
+        col = len(header) + 1
+        sheet.cell(row=1, column=col, value=column)
+    for row_number, result in read_results(sink_path, column):
+        sheet.cell(row=row_number, column=col, value=result)
+    wb.save(output_path)
+    print(f"Merged results from {sink_path} into {output_path}")
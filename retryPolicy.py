@@ -0,0 +1,114 @@
+import random                                                       # type: ignore
+from requests.adapters import HTTPAdapter                           # type: ignore
+from urllib3.util.retry import Retry                                # type: ignore
+
+# --- Retry policies ---
+#
+# Connection errors, timeouts and 5xx responses are retried with exponential
+# backoff and full jitter instead of ending up as a final "Error" line. Whether
+# a POST may be retried depends on the endpoint: re-sending an update of an
+# existing object is harmless, re-sending a create can duplicate it. Each
+# script therefore declares a policy per endpoint path:
+#
+#   IDEMPOTENT      retry connection errors, read timeouts, 429 and 5xx for
+#                   every method
+#   NOT_IDEMPOTENT  retry GET/HEAD fully; for POSTs only retry when the request
+#                   never reached the server (connection errors) or was
+#                   rejected with 429
+#
+# Paths without a declared policy fall back to NOT_IDEMPOTENT.
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class JitteredRetry(Retry):
+    """urllib3 Retry with full jitter on the backoff and 429 retries for any method."""
+    BACKOFF_CAP = 30.0
+
+    def get_backoff_time(self):
+        backoff = min(self.BACKOFF_CAP, super().get_backoff_time())
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # A 429 is rejected before it is processed, so it is safe to retry even
+        # for endpoints that are not idempotent.
+        if status_code == 429 and self.total is not False:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+class RetryPolicy:
+    """Retry settings for one endpoint, usable by requests sessions and the asyncio backend."""
+    def __init__(self, safe_methods=("GET", "HEAD"), retries=4, backoff_factor=0.5, max_backoff=30.0):
+        self.safe_methods = tuple(m.upper() for m in safe_methods)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def urllib3_retry(self):
+        return JitteredRetry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(self.safe_methods),
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+
+    def adapter(self, pool_maxsize=10, adapter_class=HTTPAdapter):
+        return adapter_class(max_retries=self.urllib3_retry(), pool_maxsize=pool_maxsize)
+
+    def should_retry(self, method, attempt, status=None, error=None, connect_error=False):
+        """Retry decision for code paths that do not go through urllib3 (asyncio backend)."""
+        if attempt >= self.retries:
+            return False
+        safe = method.upper() in self.safe_methods
+        if error is not None:
+            return connect_error or safe
+        if status == 429:
+            return True
+        return safe and status in RETRY_STATUSES
+
+    def delay(self, attempt):
+        """Full-jitter backoff before retry number attempt + 1."""
+        if attempt == 0:
+            return 0
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+IDEMPOTENT = RetryPolicy(safe_methods=("GET", "HEAD", "POST"))
+NOT_IDEMPOTENT = RetryPolicy()
+
+def for_server(base_url, endpoint_policies):
+    """
+    Expand {path: policy} declarations into {url prefix: policy} for one server.
+    The server root gets NOT_IDEMPOTENT so undeclared endpoints are still covered.
+    """
+    policies = {base_url: NOT_IDEMPOTENT}
+    for path, policy in endpoint_policies.items():
+        policies[base_url + path] = policy
+    return policies
+
+def resolve(policies, url):
+    """Return the policy with the longest matching url prefix, or None."""
+    best = None
+    for prefix in policies:
+        if url.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return policies[best] if best is not None else None
+
+def mount(session, policies, pool_maxsize=10, adapter_class=HTTPAdapter):
+    """
+    Mount one retrying HTTPAdapter (or adapter_class) per url prefix on a
+    requests session. The adapters share a single connection pool, so
+    keep-alive connections are reused across endpoints of the same server.
+    """
+    shared = None
+    for prefix, policy in policies.items():
+        adapter = policy.adapter(pool_maxsize, adapter_class)
+        if shared is None:
+            shared = adapter
+        else:
+            adapter.poolmanager = shared.poolmanager
+        session.mount(prefix, adapter)
+    return session
@@ -1,8 +1,24 @@
-import openpyxl                 # type: ignore
-import requests                 # type: ignore
 from urllib.parse import quote  # type: ignore
-from bs4 import BeautifulSoup   # type: ignore
-import re                       # type: ignore
+from concurrent.futures import ThreadPoolExecutor   # type: ignore
+import retryPolicy
+import httpTransport
+import checkpointJournal
+import workQueue
+import lookupReader
+import resultSink
+import htmlExtract
+import requestMetrics
+import rateLimit
+import serverPool
+import authBreaker
+import sessionCache
+
+# Retry policy per endpoint. Admin commands (reindex, cache flush, ...) are not
+# guaranteed to be repeatable, so they are only retried when the request never
+# reached the server.
+RETRY_POLICIES = {
+    "/MercuryGate/util/adminConsole.jsp": retryPolicy.NOT_IDEMPOTENT,
+}
 
 def load_config(config_sheet):
     config = {}
@@ -11,26 +27,42 @@ def load_config(config_sheet):
             config[row[0].strip()] = str(row[1]).strip()
     return config
 
-def prime_session(session, primary_server):
-    url = f"https://{primary_server}.mercurygate.net/MercuryGate/util/adminConsole.jsp"
+def prime_session(session, base_url, connections=1, session_cache=None):
+    url = f"{base_url}/MercuryGate/util/adminConsole.jsp"
+    # Skipped while an earlier run primed this server recently (session_cache).
+    if session_cache is None or not session_cache.primed(base_url):
+        try:
+            resp = session.get(url, timeout=10)
+            print("Priming GET status:", resp.status_code)
+            if session_cache is not None and resp.status_code == 200:
+                session_cache.store(base_url)
+        except Exception as e:
+            print("Error during priming GET:", e)
+    # Open the rest of the pool's connections now so the workers start warm.
+    if connections > 1:
+        httpTransport.prewarm(session, url, connections)
+
+def parse_response_message(html_text):
+    message = htmlExtract.extract_admin_message(html_text)
+    return message if message is not None else "No message found"
+
+def run_command(session, post_url, command):
+    """Post one admin command and parse its result. Returns (ok, message)."""
     try:
-        resp = session.get(url, timeout=10)
-        print("Priming GET status:", resp.status_code)
+        response = session.post(post_url, data={"sCommandList": command}, timeout=10)
+        if response.status_code == 200:
+            return True, parse_response_message(response.text)
+        return False, f"HTTP {response.status_code}: {response.text[:100]}"
     except Exception as e:
-        print("Error during priming GET:", e)
+        return False, f"Error: {str(e)}"
 
-def parse_response_message(html_text):
-    soup = BeautifulSoup(html_text, "html.parser")
-    script_tags = soup.find_all("script")
-    for script in script_tags:
-        if "displayWindow('Results', message);" in script.text:
-            match = re.search(r"var message = '(.*?)';", script.text, re.DOTALL)
-            if match:
-                return match.group(1).replace("\\n", "\n")
-    return "No message found"
-
-def run_commands(excel_path):
-    wb = openpyxl.load_workbook(excel_path)
+def is_serial(value):
+    """Interpret the optional 'Serial' column (x / yes / true / 1)."""
+    return str(value).strip().lower() in ("x", "y", "yes", "true", "1") if value is not None else False
+
+def run_commands(excel_path, journal_path=None, resume=False, max_workers=4,
+                 results_path=None, merge_output_path=None, metrics_path=None, prometheus_path=None):
+    wb = lookupReader.open_workbook_readonly(excel_path)
     config_sheet = wb["config"]
     lookup_sheet = wb["lookup"]
 
@@ -41,55 +73,108 @@ def run_commands(excel_path):
             raise ValueError(f"Missing required config key: {key}")
 
     primary_server = config["PRIMARY_SERVER"]
+    # BASE_URL (optional) points the script at another host, e.g. the local mock server.
+    base_url = config.get("BASE_URL", f"https://{primary_server}.mercurygate.net").rstrip("/")
     auth_cookie = config["AUTH_COOKIE"]
     enterprise = config["ENTERPRISE"]
     sid_enterprise = quote(f"({enterprise},3640,0)")
 
-    session = requests.Session()
+    # Every HTTP call is timed per phase (DNS/connect/TLS/wait/transfer) and
+    # summarized per endpoint at the end of the run.
+    metrics = requestMetrics.RunMetrics("runAdminCommand")
+    # Requests to this server from every script running on this host share the
+    # optional RATE_LIMIT_* budget of the config sheet.
+    rate_limit = rateLimit.SharedRateLimit.from_config(config, base_url, "runAdminCommand")
+    # With SERVERS on the config sheet, requests are spread over the tenant's app servers.
+    servers = serverPool.ServerPool.from_config(config, base_url)
+    # Requests pause while AUTH_COOKIE is rejected and resume with a new one
+    # (from AUTH_COOKIE_FILE or a prompt).
+    auth = authBreaker.AuthBreaker.from_config(config)
+    # Priming is skipped when a recent run already did it (SESSION_CACHE_TTL).
+    session_cache = sessionCache.SessionCache.from_config(config)
+    session = httpTransport.create_session(retryPolicy.for_server(base_url, RETRY_POLICIES), max_workers, metrics, rate_limit, servers, auth)
     session.headers.update({
         "accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
         "content-type": "application/x-www-form-urlencoded",
         "user-agent": "Mozilla/5.0",
-        "origin": f"https://{primary_server}.mercurygate.net",
-        "referer": f"https://{primary_server}.mercurygate.net/MercuryGate/util/adminConsole.jsp",
+        "origin": base_url,
+        "referer": f"{base_url}/MercuryGate/util/adminConsole.jsp",
         "cookie": auth_cookie
     })
 
-    prime_session(session, primary_server)
+    serverPool.prime(servers, base_url, lambda url: prime_session(session, url, max_workers, session_cache))
 
-    # Setup result column
-    header_row = [cell.value for cell in lookup_sheet[1]]
-    if "Result" in header_row:
-        result_col = header_row.index("Result") + 1
-    else:
-        result_col = len(header_row) + 1
-        lookup_sheet.cell(row=1, column=result_col, value="Result")
+    # Results are streamed to the results file as they arrive instead of being
+    # written into the workbook and saved at the end.
+    header_row = lookupReader.read_header(lookup_sheet)
+    results_path = results_path or excel_path.replace(".xlsx", "_results.csv")
+    sink = resultSink.ResultSink(results_path, "Result")
 
-    for idx, row in enumerate(lookup_sheet.iter_rows(min_row=2, values_only=True), start=2):
-        command = row[0]
-        if not command:
-            print(f"Stopping at empty row {idx}")
-            break
+    # Commands completed in an earlier run keep their journaled result when resuming.
+    completed = checkpointJournal.load_completed(journal_path) if resume else {}
+    journal = checkpointJournal.CheckpointJournal(journal_path, resume) if journal_path else None
 
-        post_url = f"https://{primary_server}.mercurygate.net/MercuryGate/util/adminConsole.jsp?sidEnterprise={sid_enterprise}&"
-        post_data = {"sCommandList": command}
+    serial_idx = header_row.index("Serial") if "Serial" in header_row else None
+    post_url = f"{base_url}/MercuryGate/util/adminConsole.jsp?sidEnterprise={sid_enterprise}&"
 
-        try:
-            response = session.post(post_url, data=post_data, timeout=10)
-            if response.status_code == 200:
-                message = parse_response_message(response.text)
-            else:
-                message = f"HTTP {response.status_code}: {response.text[:100]}"
-        except Exception as e:
-            message = f"Error: {str(e)}"
+    def pending_commands():
+        for idx, row in enumerate(lookup_sheet.iter_rows(min_row=2, values_only=True), start=2):
+            command = row[0] if row else None
+            if not command:
+                print(f"Stopping at empty row {idx}")
+                break
+
+            key = f"{idx}|{command}"
+            if key in completed:
+                sink.write(idx, completed[key])
+                continue
 
-        print(f"Row {idx}: Command '{command}' -> {message}")
-        lookup_sheet.cell(row=idx, column=result_col, value=message)
+            # Commands flagged in the optional 'Serial' column share one lane and
+            # run one at a time in workbook order; all others get their own lane.
+            serial = serial_idx is not None and serial_idx < len(row) and is_serial(row[serial_idx])
+            yield idx, key, command, "serial" if serial else idx
+
+    def handle(item):
+        idx, key, command, lane = item
+        ok, message = run_command(session, post_url, command)
+        return idx, key, command, ok, message
+
+    # Responses are parsed in the workers; results are recorded against their
+    # own row number from this thread only.
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = workQueue.keyed_map(executor, handle, pending_commands(), lambda item: item[3], max_workers * 2)
+            for idx, key, command, ok, message in results:
+                print(f"Row {idx}: Command '{command}' -> {message}")
+                sink.write(idx, message)
+                if journal:
+                    journal.record(key, ok, message)
+    finally:
+        if journal:
+            journal.close()
+        sink.close()
+        wb.close()
+    print(f"Processing complete. Results saved to {results_path}")
+    if rate_limit:
+        rate_limit.report()
+    if servers:
+        servers.report()
+    auth.report()
+    if session_cache:
+        session_cache.report()
+    metrics.report(metrics_path, prometheus_path)
 
-    output_path = "./runAdminCommand_updated.xlsx"
-    wb.save(output_path)
-    print(f"Processing complete. Results saved to {output_path}")
+    if merge_output_path:
+        resultSink.merge_into_workbook(excel_path, results_path, merge_output_path, "Result")
 
 if __name__ == "__main__":
     excel_file_path = "./runAdminCommand.xlsx"  # Update this path as needed
-    run_commands(excel_file_path)
+    journal_path = excel_file_path.replace(".xlsx", ".journal.jsonl")
+    resume = False  # True skips commands the journal records as done (after an interrupted run)
+    max_workers = 4  # Commands run in parallel; mark a row in the 'Serial' column to keep it in order
+    results_path = excel_file_path.replace(".xlsx", "_results.csv")
+    merge_output_path = None  # e.g. "./runAdminCommand_updated.xlsx" to copy the results into a workbook
+    metrics_path = excel_file_path.replace(".xlsx", ".metrics.json")  # Per-endpoint request timings of the run
+    prometheus_path = None  # e.g. "./runAdminCommand.prom" for a Prometheus textfile collector
+    run_commands(excel_file_path, journal_path, resume, max_workers, results_path, merge_output_path,
+                 metrics_path, prometheus_path)
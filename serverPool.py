@@ -0,0 +1,217 @@
+import contextvars              # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+from contextlib import contextmanager   # type: ignore
+from urllib.parse import urlsplit   # type: ignore
+
+# --- Server pool ---
+#
+# A tenant usually runs on several app servers, but the scripts build every
+# URL from one base_url. When the config sheet lists SERVERS, requests to
+# base_url are spread over them: each request of a requests session (or of
+# asyncEngine.AsyncClient) is rewritten to the chosen server just before it is
+# sent. The default choice is the server with the fewest requests outstanding
+# relative to its weight; LOAD_BALANCING = round-robin uses smooth weighted
+# round robin instead.
+#
+# Health: a server whose requests fail EJECT_AFTER times in a row (connection
+# errors or 5xx) is ejected for a cool-down that doubles with every ejection
+# in a row; after it, a single failure ejects it again and a success restores
+# it. If every server is ejected the pool keeps using all of them rather than
+# stalling. prime() primes each server on its own, and requests that depend
+# on server-side state of an earlier one (e.g. a form opened in one request
+# and saved in the next) can be kept on its server with pinned().
+
+# Server the requests of the current thread or task are pinned to.
+_pinned = contextvars.ContextVar("pinned_server", default=None)
+
+class Server:
+    """One app server of the pool and its counters."""
+    def __init__(self, base_url, weight=1.0):
+        self.base_url = base_url.rstrip("/")
+        self.weight = weight
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.backoff = 0            # ejections since the last success
+        self.ejected_until = 0.0
+        self.current = 0.0          # smooth weighted round robin state
+
+    @property
+    def name(self):
+        return urlsplit(self.base_url).netloc
+
+class ServerPool:
+    """
+    Spreads requests to base_url over several servers. acquire(url) picks a
+    server and returns the rewritten url, release(server, ok) reports the
+    outcome; attach() does both for every request of a requests session.
+    """
+    EJECT_AFTER = 3         # failures in a row that eject a server
+    EJECT_FOR = 10.0        # seconds of the first ejection, doubled for each further one
+    MAX_EJECT_FOR = 300.0
+    STRATEGIES = ("least-outstanding", "round-robin")
+
+    def __init__(self, base_url, servers, strategy="least-outstanding"):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy {strategy!r}, expected one of {', '.join(self.STRATEGIES)}")
+        if not servers:
+            raise ValueError("A server pool needs at least one server")
+        self.base_url = base_url.rstrip("/")
+        self.servers = list(servers)
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._next = 0
+
+    @classmethod
+    def from_config(cls, config, base_url):
+        """
+        Pool built from the optional config sheet keys, or None without them:
+        SERVERS is a comma-separated list of server names (as PRIMARY_SERVER)
+        or base URLs, each optionally with "=weight" (e.g. "app1, app2=2"),
+        LOAD_BALANCING is least-outstanding (default) or round-robin.
+        """
+        servers = []
+        for part in filter(None, (p.strip() for p in config.get("SERVERS", "").split(","))):
+            name, _, weight = part.partition("=")
+            name = name.strip()
+            url = name if "://" in name else f"https://{name}.mercurygate.net"
+            weight = float(weight) if weight.strip() else 1.0
+            if weight <= 0:
+                raise ValueError(f"Server weight must be positive: {part}")
+            servers.append(Server(url, weight))
+        if not servers:
+            return None
+        pool = cls(base_url, servers, config.get("LOAD_BALANCING", "least-outstanding").strip().lower())
+        names = ", ".join(s.name + (f" (weight {s.weight:g})" if s.weight != 1 else "") for s in pool.servers)
+        print(f"Load balancing over {len(pool.servers)} servers ({pool.strategy}): {names}")
+        return pool
+
+    def _owns(self, url):
+        return url == self.base_url or url.startswith(self.base_url + "/")
+
+    def server_of(self, url):
+        """The server a rewritten url (e.g. a response's url) points at, or None."""
+        return next((s for s in self.servers if url == s.base_url or url.startswith(s.base_url + "/")), None)
+
+    def policies(self, policies):
+        """Copy every {url prefix: policy} entry under base_url to each server."""
+        expanded = dict(policies)
+        for prefix, policy in policies.items():
+            if self._owns(prefix):
+                for server in self.servers:
+                    expanded.setdefault(server.base_url + prefix[len(self.base_url):], policy)
+        return expanded
+
+    def _pick(self):
+        now = time.monotonic()
+        healthy = [s for s in self.servers if s.ejected_until <= now] or self.servers
+        if self.strategy == "round-robin":
+            total = sum(s.weight for s in healthy)
+            for s in healthy:
+                s.current += s.weight
+            best = max(healthy, key=lambda s: s.current)
+            best.current -= total
+            return best
+        # Ties go round robin, so an idle pool still uses every server.
+        self._next = (self._next + 1) % len(healthy)
+        order = healthy[self._next:] + healthy[:self._next]
+        return min(order, key=lambda s: s.outstanding / s.weight)
+
+    def choose(self):
+        """
+        Pick the server for a request ahead of sending it, for requests that
+        need per-server state (e.g. its CSRF token); send it pinned() there.
+        """
+        with self._lock:
+            return self._pick()
+
+    def acquire(self, url):
+        """
+        Choose the server for a request and count it as outstanding. Returns
+        (server, url rewritten to it); server is None for urls of other hosts.
+        """
+        pinned = _pinned.get()
+        if pinned not in self.servers:
+            pinned = None
+        with self._lock:
+            if self._owns(url):
+                server = pinned or self._pick()
+                url = server.base_url + url[len(self.base_url):]
+            else:
+                server = self.server_of(url)
+            if server is not None:
+                server.outstanding += 1
+                server.requests += 1
+        return server, url
+
+    def release(self, server, ok):
+        """Finish a request from acquire(); ok is False for errors and 5xx responses."""
+        if server is None:
+            return
+        with self._lock:
+            server.outstanding -= 1
+            now = time.monotonic()
+            if ok:
+                server.consecutive_failures = 0
+                if server.ejected_until <= now:
+                    server.backoff = 0
+                return
+            server.failures += 1
+            server.consecutive_failures += 1
+            if server.consecutive_failures >= self.EJECT_AFTER and server.ejected_until <= now:
+                duration = min(self.EJECT_FOR * 2 ** server.backoff, self.MAX_EJECT_FOR)
+                server.ejected_until = now + duration
+                server.ejections += 1
+                server.backoff += 1
+                # One more failure after the cool-down ejects it again.
+                server.consecutive_failures = self.EJECT_AFTER - 1
+                print(f"Server {server.name} ejected for {duration:.0f}s after {self.EJECT_AFTER} failures in a row")
+
+    def attach(self, session):
+        """Balance every request made through a requests session."""
+        request = session.request
+
+        def balanced_request(method, url, **kwargs):
+            server, url = self.acquire(url)
+            ok = False
+            try:
+                resp = request(method, url, **kwargs)
+                ok = resp.status_code < 500
+                return resp
+            finally:
+                self.release(server, ok)
+
+        session.request = balanced_request
+        return session
+
+    @contextmanager
+    def pinned(self, server):
+        """
+        Send the requests of this thread or task made inside the block to
+        server (even while it is ejected); server None leaves them balanced.
+        """
+        token = _pinned.set(server)
+        try:
+            yield server
+        finally:
+            _pinned.reset(token)
+
+    def prime(self, prime_fn):
+        """Run prime_fn(server base url) once per server, its requests pinned to that server."""
+        for server in self.servers:
+            with self.pinned(server):
+                prime_fn(server.base_url)
+
+    def report(self):
+        for s in self.servers:
+            print(f"Server {s.name}: {s.requests} requests, {s.failures} failed, ejected {s.ejections} times")
+
+def prime(servers, base_url, prime_fn):
+    """Run prime_fn(base_url), or prime_fn once per server when a pool is configured."""
+    if servers is None:
+        prime_fn(base_url)
+    else:
+        servers.prime(prime_fn)
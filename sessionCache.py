@@ -0,0 +1,152 @@
+import hashlib                  # type: ignore
+import json                     # type: ignore
+import os                       # type: ignore
+import tempfile                 # type: ignore
+import threading                # type: ignore
+import time                     # type: ignore
+from urllib.parse import urlsplit   # type: ignore
+
+# --- Session cache ---
+#
+# Every run used to start with a priming GET per server (and editStatusMessages
+# with a CSRF token from addMessage.jsp) before the first row was sent. When
+# runs are launched back to back that is the same handful of serial round
+# trips each time. So a small file per server and AUTH_COOKIE (in the temp
+# directory by default, readable only by the owner) records when the server
+# was last primed, plus the CSRF token, and later runs skip the priming GET
+# for SESSION_CACHE_TTL seconds. The cookies a priming response sets are not
+# kept: requests are sent with AUTH_COOKIE as an explicit Cookie header, which
+# requests never merges jar cookies into and asyncEngine sends with aiohttp's
+# DummyCookieJar, so neither backend has a jar to seed.
+# Nothing is checked up front. A CSRF token is only fetched again when the
+# server rejects it (see CsrfToken). A new AUTH_COOKIE starts a new cache
+# entry, so state from an expired cookie is never reused.
+
+class SessionCache:
+    """
+    Last priming and CSRF token per server, shared by all runs on this host
+    with the same AUTH_COOKIE. Each part expires ttl seconds after it was saved.
+    """
+    PREFIX = "tms-session-"
+
+    def __init__(self, cookie, ttl=900.0, cache_dir=None):
+        self.cookie = cookie
+        self.ttl = ttl
+        self.cache_dir = cache_dir or tempfile.gettempdir()
+        self.reused = 0
+        self.saved = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Cache for config["AUTH_COOKIE"], or None when SESSION_CACHE_TTL is 0.
+        SESSION_CACHE_TTL (seconds, default 900) and SESSION_CACHE_DIR (default:
+        the temp directory) are optional config sheet keys.
+        """
+        ttl = float(config.get("SESSION_CACHE_TTL", 900))
+        if ttl <= 0:
+            return None
+        return cls(config["AUTH_COOKIE"], ttl, config.get("SESSION_CACHE_DIR"))
+
+    def path(self, base_url):
+        key = f"{urlsplit(base_url).netloc}\n{self.cookie}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{self.PREFIX}{digest}.json")
+
+    def _read(self, base_url):
+        try:
+            with open(self.path(base_url), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entry if isinstance(entry, dict) else {}
+
+    def _write(self, base_url, entry):
+        # Written to a temp file and renamed, so a concurrent run reads either
+        # the old entry or the new one. mkstemp creates it with mode 0600.
+        path = self.path(base_url)
+        try:
+            fd, temp = tempfile.mkstemp(prefix=self.PREFIX, dir=os.path.dirname(path))
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(temp, path)
+        except OSError as e:
+            print(f"Could not save session cache {path}: {e}")
+
+    def _fresh(self, part):
+        return bool(part) and 0 <= time.time() - part.get("saved", 0) < self.ttl
+
+    def primed(self, base_url):
+        """True (and counted as reused) if base_url was primed less than ttl seconds ago."""
+        part = self._read(base_url).get("primed")
+        if not self._fresh(part):
+            return False
+        self.reused += 1
+        age = time.time() - part["saved"]
+        print(f"{urlsplit(base_url).netloc} was primed {age:.0f}s ago; priming GET skipped.")
+        return True
+
+    def store(self, base_url):
+        """Record a successful priming of base_url."""
+        entry = self._read(base_url)
+        entry["primed"] = {"saved": time.time()}
+        self._write(base_url, entry)
+        self.saved += 1
+
+    def csrf_token(self, base_url):
+        """The fresh cached CSRF token for base_url, or None."""
+        part = self._read(base_url).get("csrf")
+        return part["token"] if self._fresh(part) else None
+
+    def store_csrf(self, base_url, token):
+        entry = self._read(base_url)
+        entry["csrf"] = {"saved": time.time(), "token": token}
+        self._write(base_url, entry)
+
+    def report(self):
+        print(f"Session cache: {self.reused} primings skipped, {self.saved} saved (TTL {self.ttl:g}s).")
+
+# Text of the 403 page the CSRF filter answers with. The filter runs before the
+# request reaches the page, so a request rejected with it was not processed.
+CSRF_REJECTION_MARKERS = ("invalid csrf token", "could not verify the provided csrf token")
+
+def csrf_rejected(resp):
+    """True if resp is the CSRF filter refusing a request (403 with its rejection text)."""
+    text = (resp.text or "").lower()
+    return resp.status_code == 403 and any(marker in text for marker in CSRF_REJECTION_MARKERS)
+
+class CsrfToken:
+    """
+    The CSRF token requests of base_url are sent with, starting from the cached
+    one. refresh() fetches a new token with fetch() only after the server
+    rejected the current one, once for all workers that saw it rejected.
+    """
+    def __init__(self, fetch, cache=None, base_url=None):
+        self._fetch = fetch
+        self._cache = cache
+        self._base_url = base_url
+        self._lock = threading.Lock()
+        self.token = cache.csrf_token(base_url) if cache else None
+        self.refreshes = 0
+
+    def _use(self, token):
+        self.token = token or None
+        if self._cache and self.token:
+            self._cache.store_csrf(self._base_url, self.token)
+
+    def set(self, token):
+        """Use token from now on (e.g. one read off a priming response) and cache it."""
+        with self._lock:
+            self._use(token)
+
+    def refresh(self, rejected):
+        """
+        The token to resend with after the server rejected token `rejected`.
+        Only the first caller per rejected token fetches (the others wait for
+        it and get its result).
+        """
+        with self._lock:
+            if self.token == rejected:
+                self.refreshes += 1
+                self._use(self._fetch())
+            return self.token
@@ -0,0 +1,81 @@
+import os                       # type: ignore
+import subprocess               # type: ignore
+import sys                      # type: ignore
+import zlib                     # type: ignore
+import resultSink
+
+# --- Sharding ---
+#
+# One process tops out on the GIL long before the server does. Shard mode
+# splits the lookup rows into N disjoint parts by a stable hash of each row's
+# key (crc32, the same on every host and Python version), so "--shard i/N"
+# can run as N processes on one host or spread over several jump hosts
+# without two of them ever posting the same row. Every shard writes its own
+# results, journal, rejects and metrics files (path.shard-i-of-N.ext); the
+# results files are merged back into one file in workbook order afterwards.
+
+def parse_shard(spec):
+    """Parse "i/N" (1-based) into (i, N)."""
+    index, sep, count = str(spec).partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index = count = 0
+    if not sep or count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {spec!r}, expected i/N with 1 <= i <= N")
+    return index, count
+
+def shard_of(key, count):
+    """The 1-based shard a row key belongs to out of count shards."""
+    return zlib.crc32(str(key).encode("utf-8")) % count + 1
+
+def in_shard(key, shard):
+    """True if the row key belongs to shard (i, N); every key is in shard None."""
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+def shard_path(path, shard):
+    """path with the shard inserted before its extension: x.csv -> x.shard-2-of-4.csv."""
+    if not path or shard is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def launch(script, count, args=()):
+    """
+    Run script once per shard as local worker processes ("--shard i/N" plus
+    args) and wait for all of them. Returns the shards whose process failed.
+    """
+    processes = []
+    for index in range(1, count + 1):
+        command = [sys.executable, script, "--shard", f"{index}/{count}"] + list(args)
+        # No terminal input: N shards must not all prompt for a new cookie at
+        # once (authBreaker), so they rely on AUTH_COOKIE_FILE or fail fast.
+        processes.append((index, subprocess.Popen(command, stdin=subprocess.DEVNULL)))
+    print(f"Started {count} shard processes of {os.path.basename(script)}.")
+    failed = []
+    for index, process in processes:
+        if process.wait() != 0:
+            print(f"Shard {index}/{count} exited with status {process.returncode}")
+            failed.append(index)
+    return failed
+
+def merge_results(path, count, column="Status"):
+    """
+    Merge the results files of shards 1..count of path into path, sorted by
+    workbook row. Raises ValueError if a shard file is missing or a row was
+    reported by more than one shard (e.g. shards run with different N).
+    """
+    shard_paths = [shard_path(path, (index, count)) for index in range(1, count + 1)]
+    missing = [p for p in shard_paths if not os.path.exists(p)]
+    if missing:
+        raise ValueError(f"Missing shard results: {', '.join(missing)}")
+    results = {}
+    for index, p in enumerate(shard_paths, start=1):
+        for row_number, result in resultSink.read_results(p, column):
+            if row_number in results and results[row_number][0] != index:
+                raise ValueError(f"Row {row_number} was reported by shards {results[row_number][0]} and {index}")
+            results[row_number] = (index, result)
+    with resultSink.ResultSink(path, column) as sink:
+        for row_number in sorted(results):
+            sink.write(row_number, results[row_number][1])
+    print(f"Merged {len(results)} results from {count} shards into {path}")
@@ -0,0 +1,126 @@
+import time                                               # type: ignore
+from collections import deque                            # type: ignore
+from concurrent.futures import wait, FIRST_COMPLETED     # type: ignore
+
+# --- Bounded work queue ---
+#
+# Submitting every row to a ThreadPoolExecutor up front keeps one future (and
+# its row) alive per input row until the run ends. These helpers keep only a
+# window of futures in flight and pull the next row from the input only when a
+# slot frees up, so memory follows the window size instead of the workbook size.
+# staged_map does the same for work that goes through several steps, with a
+# separate queue and concurrency limit per step.
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """
+    Run fn(item) on the executor for every item with at most max_in_flight
+    futures pending at once. Yields results in completion order; each future is
+    dropped as soon as its result has been yielded. max_in_flight may also be a
+    callable returning the current limit (e.g. AdaptiveLimit.current_limit).
+    """
+    limit = max_in_flight if callable(max_in_flight) else (lambda: max_in_flight)
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        while len(pending) >= limit():
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def keyed_map(executor, fn, items, key_fn, max_in_flight):
+    """
+    Like bounded_map, but items that share key_fn(item) run one after another in
+    input order (a "lane" per key) while different keys run in parallel.
+    At most max_in_flight items are pending or queued in lanes at once.
+    Yields results in completion order.
+    """
+    lanes = {}          # key -> items waiting behind the one currently running
+    future_keys = {}    # future -> key of the lane it belongs to
+    queued = 0
+
+    def finish(done):
+        nonlocal queued
+        for future in done:
+            key = future_keys.pop(future)
+            waiting = lanes[key]
+            if waiting:
+                queued -= 1
+                future_keys[executor.submit(fn, waiting.popleft())] = key
+            else:
+                del lanes[key]
+            yield future.result()
+
+    for item in items:
+        key = key_fn(item)
+        if key in lanes:
+            lanes[key].append(item)
+            queued += 1
+        else:
+            lanes[key] = deque()
+            future_keys[executor.submit(fn, item)] = key
+        while future_keys and len(future_keys) + queued >= max_in_flight:
+            done, _ = wait(list(future_keys), return_when=FIRST_COMPLETED)
+            yield from finish(done)
+    while future_keys:
+        done, _ = wait(list(future_keys), return_when=FIRST_COMPLETED)
+        yield from finish(done)
+
+def staged_map(stages, items, max_in_flight):
+    """
+    Run every item through a pipeline of stages, each with its own executor and
+    concurrency limit, so stage 2 of one item overlaps stage 1 of the next and
+    a slow stage can be throttled on its own. stages is a list of
+    (executor, fn, limit, on_timing) tuples: fn(item) returns (done, value);
+    when done (or in the last stage) value is the item's result, otherwise it
+    is queued for the next stage. on_timing(wait, service), if given, receives
+    the time the item queued for a slot and the time it spent in the stage.
+    At most max_in_flight items (or max_in_flight()) are in the pipeline at
+    once. Yields results in completion order.
+    """
+    limit = max_in_flight if callable(max_in_flight) else (lambda: max_in_flight)
+    queues = [deque() for _ in stages]      # (item, time queued) waiting for a slot
+    running = [0] * len(stages)
+    future_stages = {}                      # future -> index of its stage
+    in_flight = 0
+
+    def timed(fn, on_timing, item, queued_at):
+        started = time.monotonic()
+        try:
+            return fn(item)
+        finally:
+            if on_timing:
+                on_timing(started - queued_at, time.monotonic() - started)
+
+    def dispatch():
+        for i, (executor, fn, stage_limit, on_timing) in enumerate(stages):
+            while queues[i] and running[i] < stage_limit:
+                item, queued_at = queues[i].popleft()
+                running[i] += 1
+                future_stages[executor.submit(timed, fn, on_timing, item, queued_at)] = i
+
+    def collect():
+        nonlocal in_flight
+        done, _ = wait(list(future_stages), return_when=FIRST_COMPLETED)
+        for future in done:
+            i = future_stages.pop(future)
+            running[i] -= 1
+            finished, value = future.result()
+            if finished or i == len(stages) - 1:
+                in_flight -= 1
+                yield value
+            else:
+                queues[i + 1].append((value, time.monotonic()))
+        dispatch()
+
+    for item in items:
+        queues[0].append((item, time.monotonic()))
+        in_flight += 1
+        dispatch()
+        while in_flight >= limit():
+            yield from collect()
+    while in_flight:
+        yield from collect()